@@ -0,0 +1,69 @@
+"""Benchmark: `build_comparison` vs. chained outer merges, for many engines.
+
+Run from `src/`: `python -m benchmarks.bench_comparison [engines] [queries] [results per query]`
+"""
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.compare import build_comparison
+
+COLUMNS = ["label", "object", "explanation"]
+LABELS = np.array(["GREAT", "OK", "BAD"])
+
+
+def engine_df(seed: int, queries: int, per_query: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    # Each engine returns a different number of results for some queries, so the join has gaps
+    keep = rng.random(queries * per_query) > 0.05
+    query = np.repeat(np.arange(queries), per_query)[keep]
+    position = np.tile(np.arange(1, per_query + 1), queries)[keep]
+    document = rng.integers(0, 100, len(query))
+    return pd.DataFrame({
+        "query": pd.Categorical([f"query {q}" for q in query]),
+        "position": position,
+        "object_id": [f"doc-{q}-{d}" for q, d in zip(query, document)],
+        "object": [f'{{"title": "Product {d}", "description": "Soft cotton jersey top"}}' for d in document],
+        "label": pd.Categorical(LABELS[rng.integers(0, 3, len(query))]),
+        "explanation": [f"Explanation for document {d}" for d in document]
+    })
+
+
+def merge_comparison(frames, names) -> pd.DataFrame:
+    result = None
+    for df, name in zip(frames, names):
+        df = df[["query", "position"] + COLUMNS].copy()
+        df.columns = ["query", "position"] + [f"{name}_{column}" for column in COLUMNS]
+        result = df if result is None else pd.merge(result, df, on=["query", "position"], how="outer")
+    return result.sort_values(["query", "position"]).reset_index(drop=True)
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = build()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(df)
+
+
+def main(engines: int = 10, queries: int = 50_000, per_query: int = 5):
+    frames = [engine_df(seed, queries, per_query) for seed in range(engines)]
+    names = [f"engine{i}" for i in range(engines)]
+    print(f"{engines} engines x {queries} queries x {per_query} results")
+    print(f"{'builder':<14}{'time (s)':>10}{'peak (MB)':>12}{'rows':>10}")
+    for name, build in [
+        ("merge", lambda: merge_comparison(frames, names)),
+        ("hash join", lambda: build_comparison(frames, names)),
+        ("object_id", lambda: build_comparison(frames, names, on="object_id", columns=["label"]))
+    ]:
+        elapsed, peak, rows = measure(build)
+        print(f"{name:<14}{elapsed:>10.2f}{peak / 1e6:>12.0f}{rows:>10}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,166 @@
+"""Benchmark: scraping, evaluating and end-to-end runs against local stand-ins for OpenSearch and the evaluations API.
+
+Run from `src/`: `python -m benchmarks.bench_end_to_end [queries ...]` (1k, 10k and 100k queries by default)
+
+The fake servers from `tests.fakes` run in this process. Each scenario runs in a fresh process, so its peak RSS
+is its own: `_search` and `_msearch` scrapes with `OpenSearchScraper`, `evaluate` with `ObjectiveEvalRunner` on
+the `_search` scrape, and `run`, a pipelined `ObjectiveEvaluator.run` that also loads the results. Latency
+percentiles are per request: per search, per `_msearch` batch, or per evaluation chunk from submission to completion.
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from objective_evaluator.evalrunner import EvaluationParams, ObjectiveEvalRunner
+from objective_evaluator.evaluator import ObjectiveEvaluator
+from objective_evaluator.instrumentation import EVALUATE_POLL, SEARCH_LATENCY, Instrumentation
+from objective_evaluator.ratelimit import RateLimitParams
+from objective_evaluator.scrapers.opensearch import OpenSearchScraper, OpenSearchScrapeParams
+from tests.fakes import FakeEvaluationAPI, FakeOpenSearch
+
+SIZES = (1_000, 10_000, 100_000)
+SCENARIOS = ("_search", "_msearch", "evaluate", "run")
+
+
+class CatalogueSearch(FakeOpenSearch):
+    """Hits with a `description` of `source_size` bytes, so result sizes are realistic."""
+
+    def __init__(self, source_size: int = 500, **options):
+        super().__init__(**options)
+        self.description = "Soft cotton jersey top " * (source_size // 23)
+
+    def search(self, body: dict) -> dict:
+        response = super().search(body)
+        for hit in response.get("hits", {}).get("hits", []):
+            hit["_source"]["description"] = self.description
+        return response
+
+
+class LeanEvaluationAPI(FakeEvaluationAPI):
+    """Forgets the items of each evaluation once its results are served, so the server's memory stays flat."""
+
+    def handle(self, method: str, path: str, data: bytes):
+        response = super().handle(method, path, data)
+        if method == "GET" and response[1].get("status") == "completed":
+            with self._lock:
+                submitted, payload, failed = self.evaluations[response[1]["id"]]
+                self.evaluations[response[1]["id"]] = (submitted, {**payload, "data": []}, failed)
+        return response
+
+
+def scraper(opensearch_port: int, **params) -> OpenSearchScraper:
+    return OpenSearchScraper(
+        OpenSearchScrapeParams(
+            scrape_id="bench-opensearch",
+            index="bench",
+            host="http://127.0.0.1",
+            port=opensearch_port,
+            username="admin",
+            password="admin",
+            query_template={"query": {"multi_match": {"query": "{query}", "fields": ["prod_name"]}}},
+            # Failed searches are retried at once, without slowing the scrape down
+            rate_limit=RateLimitParams(
+                rate=100_000, max_rate=100_000, burst=1_000, decrease=1.0, retry_backoff=0.01, failure_threshold=1_000
+            ),
+            retry_backoff=0.01,
+            **params
+        )
+    )
+
+
+def eval_params(api_url: str, work_dir: str) -> EvaluationParams:
+    return EvaluationParams(
+        scrape_results_path=os.path.join(work_dir, "bench-opensearch.jsonl"),
+        save_to_path=os.path.join(work_dir, "bench-opensearch_eval.json"),
+        api_key="fake",
+        eval_name="bench-opensearch_eval",
+        api_url=api_url,
+        chunk_size=1_000,
+        max_concurrent_chunks=4,
+        poll_interval=0.01
+    )
+
+
+def run_scenario(scenario: str, queries: int, opensearch_port: int, api_url: str, work_dir: str, hits: int) -> dict:
+    """Run one scenario and return its duration, items processed, latency percentiles and peak RSS."""
+    query_list = [f"query {i}" for i in range(queries)]
+    instrumentation = Instrumentation()
+    start = time.perf_counter()
+    if scenario in ("_search", "_msearch"):
+        msearch = scenario == "_msearch"
+        engine = scraper(opensearch_port, limit=hits, concurrency=2 if msearch else 8, msearch=msearch)
+        engine.instrument(instrumentation)
+        path = os.path.join(work_dir, "bench-opensearch.jsonl" if not msearch else "bench-msearch.jsonl")
+        engine.scrape(query_list, path)
+        items, measurement = queries, SEARCH_LATENCY
+    elif scenario == "evaluate":
+        ObjectiveEvalRunner(eval_params(api_url, work_dir), instrumentation=instrumentation).run()
+        items, measurement = queries * hits, EVALUATE_POLL
+    else:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[scraper(opensearch_port, limit=hits, concurrency=8)],
+            api_key="fake",
+            work_dir=os.path.join(work_dir, "run") + "/",
+            eval_options={"api_url": api_url, "chunk_size": 1_000, "max_concurrent_chunks": 4, "poll_interval": 0.01},
+            instrumentation=instrumentation
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluator.run(query_list, pipeline=True)
+        items, measurement = len(evaluator.dfs[0]), SEARCH_LATENCY
+    elapsed = time.perf_counter() - start
+
+    summaries = instrumentation.summaries([measurement])
+    percentiles = {f"p{p}": max(summary[f"p{p}"] for summary in summaries) for p in (50, 95, 99)} if summaries else {}
+    return {
+        "time": elapsed,
+        "items": items,
+        **percentiles,
+        # Kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    }
+
+
+def main(
+    sizes=SIZES,
+    hits: int = 10,
+    source_size: int = 500,
+    search_latency: float = 0.001,
+    eval_latency: float = 0.05,
+    error_rate: float = 0.01,
+    eval_errors: int = 2
+):
+    """`error_rate` of the searches fail once with a 429, and the first `eval_errors` requests to the evaluations API with a 503."""
+    context = multiprocessing.get_context("spawn")
+    print(f"{hits} hits per query, {source_size} byte documents, {error_rate:.0%} of searches throttled once")
+    print(f"{'queries':>8}  {'scenario':<10}{'time (s)':>10}{'items/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'peak RSS (MB)':>15}")
+    for queries in sizes:
+        every = round(1 / error_rate) if error_rate else 0
+        failures = {f"query {i}": 1 for i in range(0, queries, every)} if every else {}
+        with tempfile.TemporaryDirectory() as work_dir, \
+                CatalogueSearch(source_size, latency=search_latency, hits=hits, failures=failures) as opensearch, \
+                LeanEvaluationAPI(eval_latency=eval_latency, errors=[503] * eval_errors) as api:
+            for scenario in SCENARIOS:
+                # Every scenario sees the same errors
+                opensearch.failures = dict(failures)
+                api.errors = [503] * eval_errors
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(
+                        run_scenario, scenario, queries, opensearch.port, api.api_url, work_dir, hits
+                    ).result()
+                latency = "".join(
+                    f"{result[p] * 1000:>10.1f}" if p in result else f"{'-':>10}" for p in ("p50", "p95", "p99")
+                )
+                print(
+                    f"{queries:>8}  {scenario:<10}{result['time']:>10.2f}{result['items'] / result['time']:>10.0f}"
+                    f"{latency}{result['peak_rss'] / 1e6:>15.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,86 @@
+"""Benchmark: loading an `_eval.json` file with the columnar loader vs. the per-judgement row loop.
+
+Run from `src/`: `python -m benchmarks.bench_eval_to_df [judgements]`
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from objective_evaluator.results import load_eval_df
+
+
+def write_eval(path: str, judgements: int, per_query: int = 20) -> None:
+    labels = ["GREAT", "OK", "BAD"]
+    with open(path, "w") as f:
+        json.dump({
+            "status": "completed",
+            "judgements": [
+                {
+                    "query": f"query {i // per_query}",
+                    "object_id": f"object-{i}",
+                    "object": {"prod_name": f"Product {i}", "detail_desc": "Soft cotton jersey top " * 4, "rank": i % per_query},
+                    "judgement": {"score": i % 3, "label": labels[i % 3], "explanation": f"{labels[i % 3]} match for the query"}
+                }
+                for i in range(judgements)
+            ]
+        }, f)
+
+
+def legacy_eval_to_df(path: str) -> pd.DataFrame:
+    with open(path, 'r') as file:
+        data = json.load(file)
+
+    rows = []
+    current_query = None
+    position = 0
+    for judgement in data.get('judgements', []):
+        if judgement['query'] != current_query:
+            current_query = judgement['query']
+            position = 1
+        else:
+            position += 1
+        rows.append({
+            'query': judgement['query'],
+            'position': position,
+            'object_id': judgement['object_id'],
+            'object': json.dumps(judgement['object']),
+            'score': judgement['judgement']['score'],
+            'label': judgement['judgement']['label'],
+            'explanation': judgement['judgement']['explanation']
+        })
+    return pd.DataFrame(rows)
+
+
+def measure(load, path: str):
+    # Time without tracing, which slows allocation-heavy code down, then trace a second load for peak memory
+    start = time.perf_counter()
+    df = load(path)
+    elapsed = time.perf_counter() - start
+    size = df.memory_usage(deep=True).sum()
+    del df
+
+    tracemalloc.start()
+    load(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main(judgements: int = 200_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench_eval.json")
+        write_eval(path, judgements)
+        print(f"{judgements} judgements, {os.path.getsize(path) / 1e6:.0f} MB")
+        print(f"{'loader':<12}{'time (s)':>10}{'peak (MB)':>12}{'frame (MB)':>12}")
+        for name, load in [("legacy", legacy_eval_to_df), ("columnar", load_eval_df)]:
+            elapsed, peak, size = measure(load, path)
+            print(f"{name:<12}{elapsed:>10.2f}{peak / 1e6:>12.0f}{size / 1e6:>12.0f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
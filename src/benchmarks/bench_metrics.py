@@ -0,0 +1,66 @@
+"""Benchmark: vectorized `ranking_metrics` vs. a per-query groupby loop.
+
+Run from `src/`: `python -m benchmarks.bench_metrics [judgements]`
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.metrics import ranking_metrics
+
+LABELS = np.array(["BAD", "OK", "GREAT"])
+
+
+def judgements_df(judgements: int, per_query: int = 20) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 3, judgements)
+    return pd.DataFrame({
+        "query": pd.Categorical(np.arange(judgements) // per_query),
+        "position": np.arange(judgements) % per_query + 1,
+        "score": scores,
+        "label": pd.Categorical(LABELS[scores])
+    })
+
+
+def loop_metrics(df: pd.DataFrame, k: int = 10) -> pd.DataFrame:
+    rows = {}
+    for query, group in df.groupby("query", observed=True):
+        group = group.sort_values("position")
+        gains = 2.0 ** group["score"].to_numpy() - 1
+        discounts = 1 / np.log2(np.arange(2, len(gains) + 2))
+        dcg = (gains[:k] * discounts[:k]).sum()
+        idcg = (np.sort(gains)[::-1][:k] * discounts[:k]).sum()
+        relevant = group["label"].isin(["GREAT", "OK"]).to_numpy()
+        bad = (group["label"] == "BAD").to_numpy()
+        rows[query] = {
+            "ndcg": dcg / idcg if idcg else 0.0,
+            "precision": relevant[:k].sum() / k,
+            "reciprocal_rank": 1 / (relevant.argmax() + 1) if relevant.any() else 0.0,
+            "first_bad_position": bad.argmax() + 1 if bad.any() else np.nan
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def main(judgements: int = 1_000_000):
+    df = judgements_df(judgements)
+    print(f"{judgements} judgements, {df['query'].nunique()} queries")
+
+    start = time.perf_counter()
+    fast = ranking_metrics(df)
+    vectorized = time.perf_counter() - start
+
+    # The loop is timed on a sample of queries and extrapolated
+    sample = df[df["query"].cat.codes < 2000]
+    start = time.perf_counter()
+    slow = loop_metrics(sample)
+    looped = (time.perf_counter() - start) * df["query"].nunique() / sample["query"].nunique()
+
+    assert np.allclose(fast["ndcg@10"].to_numpy()[:2000], slow["ndcg"].to_numpy())
+    print(f"{'loop (s, est.)':<18}{looped:>8.2f}")
+    print(f"{'vectorized (s)':<18}{vectorized:>8.2f}{looped / vectorized:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,65 @@
+"""Micro-benchmark: compiled `QueryTemplate` rendering vs. the JSON dump/replace/reparse approach.
+
+Run from `src/`: `python -m benchmarks.bench_template`
+"""
+import json
+import timeit
+
+from objective_evaluator.template import QueryTemplate
+
+QUERY = 'cotton jersey "top" with gathers'
+
+
+def function_score_template(functions: int = 200) -> dict:
+    return {
+        "size": "{limit}",
+        "query": {
+            "function_score": {
+                "query": {
+                    "bool": {
+                        "must": {"multi_match": {"query": "{query}", "fields": ["prod_name^3", "detail_desc"]}},
+                        "filter": "{filters}"
+                    }
+                },
+                "functions": [
+                    {"filter": {"term": {"colour_group_name": f"colour-{i}"}}, "weight": 1 + i / functions}
+                    for i in range(functions)
+                ],
+                "score_mode": "sum",
+                "boost_mode": "multiply"
+            }
+        }
+    }
+
+
+def hybrid_template(dims: int = 768) -> dict:
+    return {
+        "size": "{limit}",
+        "query": {
+            "hybrid": {
+                "queries": [
+                    {"match": {"detail_desc": {"query": "{query}"}}},
+                    {"knn": {"embedding": {"vector": [i / dims for i in range(dims)], "k": 100}}}
+                ]
+            }
+        }
+    }
+
+
+def legacy_render(template: dict, query: str) -> dict:
+    return json.loads(json.dumps(template).replace('"{query}"', json.dumps(query)))
+
+
+def main(number: int = 2000):
+    print(f"{'template':<16}{'legacy (us)':>14}{'compiled (us)':>16}{'speedup':>10}")
+    for name, template in [("function_score", function_score_template()), ("hybrid", hybrid_template())]:
+        compiled = QueryTemplate(template)
+        values = {"query": QUERY, "limit": 10, "filters": [{"term": {"index_group_name": "Ladieswear"}}]}
+
+        legacy = timeit.timeit(lambda: legacy_render(template, QUERY), number=number) / number * 1e6
+        fast = timeit.timeit(lambda: compiled.render(**values), number=number) / number * 1e6
+        print(f"{name:<16}{legacy:>14.1f}{fast:>16.2f}{legacy / fast:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.results import LABELS, EvalResults
+
+
+class LabelCounts:
+    """Label counts for one evaluation, broken down per query and per position.
+
+    All counts come from one pass over the query, position and label columns. `by_query[q, l]` is the
+    number of judgements of query `queries[q]` with label `labels[l]`, and `by_position[p, l]` the number
+    at position `p + 1`. Judgements without a label are not counted.
+    """
+
+    def __init__(self, name: str, queries: List[str], labels: List[str], by_query: np.ndarray, by_position: np.ndarray):
+        self.name = name
+        self.queries = queries
+        self.labels = labels
+        self.by_query = by_query
+        self.by_position = by_position
+
+    @classmethod
+    def from_results(cls, results: EvalResults) -> "LabelCounts":
+        labels = results.labels
+        query_codes = np.asarray(results.column("query").codes, dtype=np.int64)
+        label_codes = np.asarray(results.column("label").codes, dtype=np.int64)
+        positions = np.asarray(results.column("position"), dtype=np.int64)
+
+        labelled = label_codes >= 0
+        query_codes, label_codes, positions = query_codes[labelled], label_codes[labelled], positions[labelled]
+        max_position = int(positions.max()) if len(positions) else 0
+        by_query = np.bincount(query_codes * len(labels) + label_codes, minlength=len(results.queries) * len(labels))
+        by_position = np.bincount((positions - 1) * len(labels) + label_codes, minlength=max_position * len(labels))
+        return cls(
+            results.name,
+            results.queries,
+            labels,
+            by_query.reshape(len(results.queries), len(labels)),
+            by_position.reshape(max_position, len(labels))
+        )
+
+    @property
+    def totals(self) -> Dict[str, int]:
+        """Counts per label, always including GREAT, OK and BAD."""
+        totals = dict.fromkeys(LABELS, 0)
+        totals.update(zip(self.labels, self.by_query.sum(axis=0).tolist()))
+        return totals
+
+    @property
+    def total(self) -> int:
+        return int(self.by_query.sum())
+
+    def per_query(self) -> pd.DataFrame:
+        """One row per query, one column per label."""
+        return pd.DataFrame(self.by_query, index=pd.Index(self.queries, name="query"), columns=self.labels)
+
+    def per_position(self) -> pd.DataFrame:
+        """One row per position (1-based), one column per label."""
+        positions = pd.RangeIndex(1, len(self.by_position) + 1, name="position")
+        return pd.DataFrame(self.by_position, index=positions, columns=self.labels)
+
+
+def label_counts(results: EvalResults) -> LabelCounts:
+    """The `LabelCounts` of `results`, computed once and reused until its `_eval.json` file changes."""
+    return results.cached("label_counts", LabelCounts.from_results)
+
+
+def engine_label_counts(results: List[EvalResults]) -> pd.DataFrame:
+    """One row per evaluation with its count of each label and the total."""
+    rows = {}
+    for r in results:
+        counts = label_counts(r)
+        rows[r.name] = {**counts.totals, "Total": counts.total}
+    df = pd.DataFrame.from_dict(rows, orient="index").fillna(0).astype(int)
+    df.index.name = "eval_name"
+    return df
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Set
+
+from pydantic import BaseModel
+
+
+def cache_key(*parts) -> str:
+    """A stable content hash of JSON-serializable parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    evictions: int = 0
+
+
+class ResponseCache:
+    """Stores the objects a search engine returned for a query, keyed by `BaseScraper.cache_key`."""
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def lookup(self, keys: Iterable[str]) -> Set[str]:
+        """Return the keys that are cached and not expired, counting hits and misses."""
+        raise NotImplementedError("Subclass must implement abstract method")
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        raise NotImplementedError("Subclass must implement abstract method")
+
+    def put(self, key: str, objects: List[dict]) -> None:
+        raise NotImplementedError("Subclass must implement abstract method")
+
+
+class SQLiteResponseCache(ResponseCache):
+    """A `ResponseCache` in a single SQLite file.
+
+    Entries older than `ttl` seconds are treated as missing. Once the cached responses exceed `max_bytes`,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+        self.size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __getstate__(self) -> dict:
+        # A copy sent to a worker process opens its own connection to the same file. Its stats are its own.
+        return {"path": self.path, "ttl": self.ttl, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def lookup(self, keys: Iterable[str]) -> Set[str]:
+        keys = list(keys)
+        found = set()
+        with self._lock:
+            # Stay well under SQLite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key, created FROM responses WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, created in rows:
+                    if self._expired(created):
+                        self._delete(key)
+                        self.stats.expired += 1
+                    else:
+                        found.add(key)
+            self._db.commit()
+            self.stats.hits += len(found)
+            self.stats.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1]):
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, objects: List[dict]) -> None:
+        value = json.dumps(objects).encode()
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._db.execute(
+                "INSERT INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self.size += len(value)
+            if self.max_bytes is not None:
+                self._evict()
+            self._db.commit()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _delete(self, key: str) -> None:
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.size -= row[0]
+
+    def _evict(self) -> None:
+        evicted = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if self.size <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.stats.evictions += len(evicted)
@@ -0,0 +1,89 @@
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# In a compact scrape file, each line is either a document, written once the first time it is returned:
+#   {"doc": "<document id>", "object": {...}}
+# or the hit list of one query, in rank order:
+#   {"query": "...", "hits": ["<document id>", ...]}
+DOC_KEY = "doc"
+HITS_KEY = "hits"
+# In a compact `_eval.json` file, documents are stored once under this key, by id, and each
+# judgement has a "doc" id in place of its "object"
+DOCUMENTS_KEY = "documents"
+
+
+def project(obj: Any, fields: Optional[List[str]]) -> Any:
+    """Keep only `fields` of a search result object. Dotted fields such as "brand.name" keep nested values."""
+    if fields is None or not isinstance(obj, dict):
+        return obj
+    projected = {}
+    for field in fields:
+        path = field.split(".")
+        value = obj
+        try:
+            for part in path:
+                value = value[part]
+        except (KeyError, TypeError):
+            continue
+        target = projected
+        for part in path[:-1]:
+            target = target.setdefault(part, {})
+        target[path[-1]] = value
+    return projected
+
+
+def document_id(obj: Any) -> str:
+    """A content hash of a document, so the same document gets the same id in every file and from every engine."""
+    return hashlib.blake2b(json.dumps(obj, sort_keys=True, separators=(",", ":")).encode(), digest_size=12).hexdigest()
+
+
+def compact_lines(query: str, objects: Iterable[Any], written: set) -> bytes:
+    """NDJSON for one query's hits, preceded by any documents not in `written` yet. Adds their ids to `written`."""
+    lines, hits = [], []
+    for obj in objects:
+        doc = document_id(obj)
+        if doc not in written:
+            written.add(doc)
+            lines.append(json.dumps({DOC_KEY: doc, "object": obj}).encode())
+        hits.append(doc)
+    lines.append(json.dumps({"query": query, HITS_KEY: hits}).encode())
+    return b"\n".join(lines) + b"\n"
+
+
+def is_compact(record: dict) -> bool:
+    return DOC_KEY in record or HITS_KEY in record
+
+
+def expand_records(records: Iterable[dict]) -> Iterator[dict]:
+    """{"query", "object"} dicts from the records of a compact scrape file. Each document is parsed once and shared."""
+    documents: Dict[str, Any] = {}
+    for record in records:
+        if DOC_KEY in record:
+            documents[record[DOC_KEY]] = record["object"]
+            continue
+        query = record["query"]
+        for doc in record[HITS_KEY]:
+            yield {"query": query, "object": documents[doc]}
+
+
+def compact_status(status: dict) -> dict:
+    """An evaluation status with each distinct judged object stored once under "documents"."""
+    documents, judgements = {}, []
+    for judgement in status.get("judgements", []):
+        doc = document_id(judgement["object"])
+        documents.setdefault(doc, judgement["object"])
+        judgements.append({**{k: v for k, v in judgement.items() if k != "object"}, DOC_KEY: doc})
+    return {**status, DOCUMENTS_KEY: documents, "judgements": judgements}
+
+
+def expand_judgements(data: dict) -> List[dict]:
+    """The judgements of an `_eval.json` file, compact or not, each with its "object"."""
+    judgements = data.get("judgements", [])
+    documents = data.get(DOCUMENTS_KEY)
+    if documents is None:
+        return judgements
+    return [
+        {**{k: v for k, v in judgement.items() if k != DOC_KEY}, "object": documents[judgement[DOC_KEY]]}
+        for judgement in judgements
+    ]
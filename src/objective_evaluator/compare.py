@@ -0,0 +1,98 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.results import EvalResults
+
+COMPARISON_COLUMNS = ["label", "object", "explanation"]
+
+
+def _query_codes(frame: pd.DataFrame, queries: pd.Index) -> np.ndarray:
+    query = frame["query"] if isinstance(frame["query"].dtype, pd.CategoricalDtype) else frame["query"].astype("category")
+    return queries.get_indexer(query.cat.categories)[query.cat.codes.to_numpy()]
+
+
+def _fill(size: int, rows: np.ndarray, values) -> np.ndarray:
+    """A column of `size` rows, with `values` at `rows` and NaN elsewhere."""
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = np.full(size, -1, dtype=values.cat.codes.dtype)
+        codes[rows] = values.cat.codes.to_numpy()
+        return pd.Categorical.from_codes(codes, dtype=values.dtype)
+    if values.dtype.kind in "iuf":
+        column = np.full(size, np.nan)
+    else:
+        column = np.full(size, np.nan, dtype=object)
+    column[rows] = values.to_numpy()
+    return column
+
+
+def build_comparison(
+    frames: Sequence[pd.DataFrame],
+    names: Sequence[str],
+    on: str = "position",
+    columns: Sequence[str] = COMPARISON_COLUMNS
+) -> pd.DataFrame:
+    """Join results DataFrames into one comparison table.
+
+    Each (query, `on`) key of every frame is encoded as one integer. The sorted, de-duplicated keys
+    form a single index, and each engine's columns are scattered into preallocated arrays at their
+    positions in it. The work is one pass per engine, so it grows linearly with the number of engines.
+
+    With `on="position"`, there is one row per query and position, with `<name>_<column>` for each
+    engine, as in an outer merge. With `on="object_id"`, there is one row per query and document,
+    with the document's `<name>_position` and `<name>_<column>` in each engine. For every engine after
+    the first, `<name>_rank_change` is how many places the document moved up relative to the first
+    engine (negative when it moved down, NaN when it is missing from either).
+    """
+    if on not in ("position", "object_id"):
+        raise ValueError(f"Can only join on 'position' or 'object_id', not {on!r}")
+    queries = pd.Index(sorted(set().union(*(
+        frame["query"].cat.categories if isinstance(frame["query"].dtype, pd.CategoricalDtype) else frame["query"].unique()
+        for frame in frames
+    ))))
+
+    query_codes = [_query_codes(frame, queries) for frame in frames]
+    if on == "position":
+        positions = [frame["position"].to_numpy(np.int64) for frame in frames]
+        stride = max((int(p.max()) for p in positions if len(p)), default=0) + 1
+        keys = [codes * stride + p for codes, p in zip(query_codes, positions)]
+    else:
+        object_ids, vocabulary = pd.factorize(pd.concat([frame["object_id"] for frame in frames], ignore_index=True))
+        stride = max(len(vocabulary), 1)
+        bounds = np.cumsum([0] + [len(frame) for frame in frames])
+        keys = [codes * stride + object_ids[start:end] for codes, start, end in zip(query_codes, bounds[:-1], bounds[1:])]
+
+    index = np.unique(np.concatenate(keys)) if keys else np.empty(0, dtype=np.int64)
+    result = {"query": pd.Categorical.from_codes(index // stride, categories=queries)}
+    if on == "position":
+        result["position"] = index % stride
+    else:
+        result["object_id"] = vocabulary.to_numpy()[index % stride]
+
+    for frame, name, frame_keys in zip(frames, names, keys):
+        if on == "object_id":
+            # A document listed more than once for a query is compared at its best position
+            frame_keys, first = np.unique(frame_keys, return_index=True)
+            frame = frame.iloc[first]
+        rows = np.searchsorted(index, frame_keys)
+        if on == "object_id":
+            result[f"{name}_position"] = _fill(len(index), rows, frame["position"])
+        for column in columns:
+            result[f"{name}_{column}"] = _fill(len(index), rows, frame[column])
+
+    if on == "object_id" and frames:
+        baseline = result[f"{names[0]}_position"]
+        for name in names[1:]:
+            result[f"{name}_rank_change"] = baseline - result[f"{name}_position"]
+
+    return pd.DataFrame(result, copy=False)
+
+
+def comparison_df(results: List[EvalResults], on: str = "position", columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """`build_comparison` over evaluations, reading only the columns the comparison needs."""
+    columns = list(COMPARISON_COLUMNS if columns is None else columns)
+    needed = ["query", "position"] + (["object_id"] if on == "object_id" else []) + [c for c in columns if c != "position"]
+    frames = [r.load(columns=dict.fromkeys(needed)) for r in results]
+    return build_comparison(frames, [r.name for r in results], on, columns)
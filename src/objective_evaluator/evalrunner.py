@@ -1,90 +1,298 @@
 
+import asyncio
+import contextlib
+import itertools
 import json
-import time
+import tempfile
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+
 import requests
-from pydantic import BaseModel 
+from pydantic import BaseModel, ConfigDict
+
+from objective_evaluator.compact import compact_status
+from objective_evaluator.instrumentation import EVALUATE_POLL, EVALUATE_SUBMIT, Instrumentation
+from objective_evaluator.judgements import JudgementStore, judgement_key
+from objective_evaluator.scraper import read_search_results
+from objective_evaluator.tracker import EvaluationFailed, EvaluationTracker, ObjectiveAntonEvalFailed
 
 class EvaluationParams(BaseModel):
     scrape_results_path: str
     save_to_path: str
     api_key: str
     eval_name: str
+    api_url: str = "https://api.objective.inc/v1/evaluations"
+    # Split the results into evaluations of at most `chunk_size` queries each, with up to
+    # `max_concurrent_chunks` running at once. A failed chunk is resubmitted on its own up to `max_retries` times.
+    chunk_size: Optional[int] = None
+    max_concurrent_chunks: int = 4
+    max_retries: int = 2
+    # Status polling starts at `poll_interval` seconds and backs off to `max_poll_interval`, see `EvaluationTracker`
+    poll_interval: float = 1.0
+    max_poll_interval: float = 30.0
+    # Save the results with each distinct judged object stored once, see `objective_evaluator.compact`
+    compact: bool = False
     
 
-class ObjectiveAntonEvalFailed(Exception):
-    """Custom exception for ObjectiveAntonEvaluator failures."""
-    def __init__(self, message: str, status_code: int = None):
-        self.message = message
-        self.status_code = status_code
-        super().__init__(self.message)
-
-
 class ObjectiveEvalRunner(BaseModel):
+    model_config = ConfigDict(
+        arbitrary_types_allowed=True
+        )
     params: EvaluationParams
+    # When set, (query, object) pairs judged by an earlier run are taken from the store instead of being sent again
+    judgement_store: Optional[JudgementStore] = None
+    # When set, the time spent submitting each evaluation and waiting for it is recorded here
+    instrumentation: Optional[Instrumentation] = None
+
+    def __init__(
+        self,
+        params: EvaluationParams,
+        judgement_store: Optional[JudgementStore] = None,
+        instrumentation: Optional[Instrumentation] = None
+    ):
+        super().__init__(params=params, judgement_store=judgement_store, instrumentation=instrumentation)
+
+    def span(self, name: str):
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        return self.instrumentation.span(name, eval=self.params.eval_name)
+
+    def run(self) -> Optional[str]:
+        """Evaluate the scrape results and save them.
+
+        Returns the evaluation ID (comma-separated IDs when chunked), or None if every judgement came from the store.
+        """
+        return asyncio.run(self.run_async())
+
+    async def run_async(self, tracker: Optional[EvaluationTracker] = None) -> Optional[str]:
+        """Like `run`, for use inside an event loop. Pass a `tracker` to share its connection pool between runners."""
+        if tracker is None:
+            async with self.tracker() as tracker:
+                return await self.run_async(tracker)
+
+        if self.judgement_store is None:
+            eval_ids, status = await self.evaluate(read_search_results(self.params.scrape_results_path), tracker)
+            self.save(status)
+            return ",".join(eval_ids)
+
+        keys = self.judgement_keys()
+        cached = self.judgement_store.lookup(keys)
+
+        eval_ids, status = [], {"status": "completed"}
+        if len(cached) < len(set(keys)):
+            unseen = (
+                item for item, key in zip(read_search_results(self.params.scrape_results_path), keys)
+                if key not in cached
+            )
+            eval_ids, status = await self.evaluate(unseen, tracker)
+            self.store_judgements(status, [key for key in keys if key not in cached])
+
+        self.save(self.merge_judgements(status, keys, len(cached)))
+        return ",".join(eval_ids) or None
+
+    async def run_pipelined(self, chunks: AsyncIterable[List[dict]], tracker: EvaluationTracker) -> Optional[str]:
+        """Evaluate chunks of {"query", "object"} items as they are produced, e.g. by a scrape that is still running.
+
+        Chunks are submitted as they arrive, so judging overlaps with scraping. The scrape file must be
+        complete by the time `chunks` is exhausted.
+        """
+        if self.judgement_store is None:
+            eval_ids, status = await self.evaluate_chunks(chunks, tracker)
+            self.save(status)
+            return ",".join(eval_ids)
+
+        cached, submitted = 0, []
+
+        async def unseen_chunks() -> AsyncIterator[List[dict]]:
+            nonlocal cached
+            configuration = self.configuration()
+            async for chunk in chunks:
+                keys = [judgement_key(item["query"], item["object"], configuration) for item in chunk]
+                found = self.judgement_store.lookup(keys)
+                cached += len(found)
+                unseen = [(item, key) for item, key in zip(chunk, keys) if key not in found]
+                if unseen:
+                    submitted.extend(key for _, key in unseen)
+                    yield [item for item, _ in unseen]
+
+        eval_ids, status = await self.evaluate_chunks(unseen_chunks(), tracker)
+        self.store_judgements(status, submitted)
+        self.save(self.merge_judgements(status, self.judgement_keys(), cached))
+        return ",".join(eval_ids) or None
 
-    def __init__(self, params: EvaluationParams):
-        super().__init__(params=params)
+    def judgement_keys(self) -> List[str]:
+        configuration = self.configuration()
+        return [
+            judgement_key(item["query"], item["object"], configuration)
+            for item in read_search_results(self.params.scrape_results_path)
+        ]
 
-    def run(self) -> str:
-        # Load the crawl results
-        with open(self.params.scrape_results_path, 'r') as f:
-            scrape_results = json.load(f)
+    def store_judgements(self, status: dict, keys: List[str]) -> None:
+        """Store the judgements of an evaluation, given the keys of the items submitted for it in order.
+
+        Judgements come back in the order their items were sent, so they are stored under the submitted item's
+        key rather than one built from the query and object the API echoes back, which needn't match it exactly.
+        """
+        judgements = status.get("judgements", [])
+        if len(judgements) != len(keys):
+            # Judgements are missing, so they can't be paired by position. Go by what the API echoed back instead
+            configuration = self.configuration()
+            keys = [judgement_key(judgement["query"], judgement["object"], configuration) for judgement in judgements]
+        self.judgement_store.put_many([
+            (key, {k: v for k, v in judgement.items() if k not in ("query", "object")})
+            for key, judgement in zip(keys, judgements)
+        ])
+
+    def merge_judgements(self, status: dict, keys: List[str], cached: int) -> dict:
+        """Status with stored and new judgements merged back in scrape order. Raises if any result has no judgement."""
+        judgements, missing = [], 0
+        for item, key in zip(read_search_results(self.params.scrape_results_path), keys):
+            judgement = self.judgement_store.get(key)
+            if judgement is None:
+                missing += 1
+            else:
+                judgements.append({"query": item["query"], "object": item["object"], **judgement})
+        if missing:
+            raise ObjectiveAntonEvalFailed(
+                f"No judgement for {missing} of {len(keys)} search results. The judgements that were returned "
+                f"are stored, so running again only submits these results"
+            )
+        return {**status, "status": "completed", "judgements": judgements, "cached_judgements": cached}
+
+    def tracker(self, **options) -> EvaluationTracker:
+        return EvaluationTracker(
+            api_url=self.params.api_url,
+            api_key=self.params.api_key,
+            poll_interval=self.params.poll_interval,
+            max_poll_interval=self.params.max_poll_interval,
+            **options
+        )
 
-        payload = {
-            "configuration": {
-                "eval_name": self.params.eval_name
-            },
-            "data": scrape_results
+    async def evaluate(self, items: Iterable[dict], tracker: EvaluationTracker) -> Tuple[List[str], dict]:
+        """Evaluate {"query", "object"} items, in chunks if configured. Returns the evaluation IDs and the combined final status."""
+        if self.params.chunk_size is None:
+            eval_id, status = await self.submit(items, tracker)
+            return [eval_id], status
+
+        async def chunks() -> AsyncIterator[List[dict]]:
+            for chunk in self.chunks(items):
+                yield chunk
+
+        return await self.evaluate_chunks(chunks(), tracker)
+
+    async def evaluate_chunks(self, chunks: AsyncIterable[List[dict]], tracker: EvaluationTracker) -> Tuple[List[str], dict]:
+        """Submit each chunk as its own evaluation, `max_concurrent_chunks` at a time, and combine them in order."""
+        semaphore = asyncio.Semaphore(self.params.max_concurrent_chunks)
+
+        async def submit_chunk(chunk: List[dict]) -> Tuple[str, dict]:
+            async with semaphore:
+                return await self.submit_chunk(chunk, tracker)
+
+        # Keep a bounded window of chunks in memory and collect them in order
+        eval_ids, judgements, pending = [], [], deque()
+
+        def collect(result: Tuple[str, dict]) -> None:
+            eval_ids.append(result[0])
+            judgements.extend(result[1].get("judgements", []))
+
+        try:
+            async for chunk in chunks:
+                if len(pending) >= self.params.max_concurrent_chunks * 2:
+                    collect(await pending.popleft())
+                pending.append(asyncio.ensure_future(submit_chunk(chunk)))
+            while pending:
+                collect(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return eval_ids, {
+            "id": eval_ids[0] if eval_ids else None,
+            "ids": eval_ids,
+            "status": "completed",
+            "configuration": self.configuration(),
+            "judgements": judgements
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.params.api_key}"
+    def chunks(self, items: Iterable[dict]) -> Iterator[List[dict]]:
+        """Group items into chunks of `chunk_size` queries, keeping all results for a query together."""
+        chunk, queries = [], 0
+        for _, group in itertools.groupby(items, key=lambda item: item["query"]):
+            if queries == self.params.chunk_size:
+                yield chunk
+                chunk, queries = [], 0
+            chunk.extend(group)
+            queries += 1
+        if chunk:
+            yield chunk
+
+    async def submit_chunk(self, chunk: List[dict], tracker: EvaluationTracker) -> Tuple[str, dict]:
+        """Submit a chunk, resubmitting it if its evaluation failed. Request errors are the tracker's to retry."""
+        for attempt in range(self.params.max_retries + 1):
+            try:
+                return await self.submit(chunk, tracker)
+            except EvaluationFailed:
+                if attempt == self.params.max_retries:
+                    raise
+
+    def configuration(self) -> dict:
+        return {
+            "eval_name": self.params.eval_name
         }
 
-        response = requests.post(
-            "https://api.objective.inc/v1/evaluations",
-            headers=headers,
-            json=payload
-        )
+    async def submit(self, items: Iterable[dict], tracker: EvaluationTracker) -> Tuple[str, dict]:
+        """Submit {"query", "object"} items as one evaluation and wait for it. Returns the evaluation ID and its final status."""
+        # Stream the crawl results into the request body on disk rather than loading them into memory
+        with tempfile.TemporaryFile() as payload:
+            self.write_payload(payload, items)
+            headers = {
+                "Content-Type": "application/json",
+                "Content-Length": str(payload.tell())
+            }
 
-        if response.status_code == 200:
-            evaluation_result = response.json()
-            eval_id = evaluation_result["id"]
-            status = self.status(eval_id)
-            while status['status'] in ["processing", "accepted"]:
-                time.sleep(1)
-                status = self.status(eval_id)
-
-            if status['status'] == "failed":
-                raise ObjectiveAntonEvalFailed(
-                    f"Evaluation failed. Status code: {response.status_code}, Response: {response.text}",
-                    response.status_code
-                )
-            elif status['status'] == "error":
-                raise ObjectiveAntonEvalFailed(
-                    f"Evaluation failed. Status code: {response.status_code}, Response: {response.text}",
-                    response.status_code
-                )
-            elif status['status'] == "completed":
-                # Save the results to the specified path
-                with open(self.params.save_to_path, 'w') as f:
+            async def content() -> AsyncIterator[bytes]:
+                payload.seek(0)
+                while data := payload.read(1 << 16):
+                    yield data
+
+            with self.span(EVALUATE_SUBMIT):
+                response = await tracker.request("POST", self.params.api_url, content=content, headers=headers)
+
+        eval_id = response.json()["id"]
+        with self.span(EVALUATE_POLL):
+            status = await tracker.wait(eval_id)
+        if status['status'] in ("failed", "error"):
+            raise EvaluationFailed(f"Evaluation {eval_id} failed. Response: {json.dumps(status)}")
+        return eval_id, status
+
+    def save(self, status: dict) -> None:
+        if status['status'] == "completed":
+            # Save the results to the specified path
+            with open(self.params.save_to_path, 'w') as f:
+                if self.params.compact:
+                    json.dump(compact_status(status), f)
+                else:
                     json.dump(status, f, indent=4)
-            
-            return eval_id
-        else:
-            raise ObjectiveAntonEvalFailed(
-                f"Request failed with status code {response.status_code}",
-                response.status_code
-            )
-        
+
+    def write_payload(self, f, items: Iterable[dict] = None) -> None:
+        if items is None:
+            items = read_search_results(self.params.scrape_results_path)
+        f.write(b'{"configuration": ' + json.dumps(self.configuration()).encode() + b', "data": [')
+        for i, item in enumerate(items):
+            f.write((b", " if i else b"") + json.dumps(item).encode())
+        f.write(b"]}")
 
     def status(self, eval_id: str):
         headers = {
             "Authorization": f"Bearer {self.params.api_key}"
         }
         response = requests.get(
-            f"https://api.objective.inc/v1/evaluations/{eval_id}",
+            f"{self.params.api_url}/{eval_id}",
             headers=headers
         )
+        if response.status_code != 200:
+            raise ObjectiveAntonEvalFailed(
+                f"Request failed with status code {response.status_code}",
+                response.status_code
+            )
         return response.json()
@@ -1,39 +1,37 @@
+import asyncio
+import contextlib
+import functools
 import json
 import os
 import shutil
 import concurrent.futures
+from concurrent.futures import Executor
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import pandas as pd
 from pydantic import BaseModel, ConfigDict
 
+from objective_evaluator.aggregate import LabelCounts, label_counts
+from objective_evaluator.cache import ResponseCache
+from objective_evaluator.compare import comparison_df
 from objective_evaluator.evalrunner import EvaluationParams, ObjectiveEvalRunner
+from objective_evaluator.incremental import diff_scrapes, merge_evaluations, write_subset
+from objective_evaluator.instrumentation import EVALUATE, PREPARE, RENDER, RUN, SCRAPE, SCRAPE_AND_EVALUATE, Instrumentation
+from objective_evaluator.judgements import JudgementStore
+from objective_evaluator.metrics import engine_metrics
+from objective_evaluator.partition import scrape_partitioned, worker_plan
+from objective_evaluator.pipeline import PipelineAborted, ScrapePipeline
+from objective_evaluator.queries import QuerySet, QuerySetParams, prepare_queries
+# DF_STYLE and HTML_TEMPLATE moved to objective_evaluator.report and are still importable from here
+from objective_evaluator.report import DF_STYLE, HTML_TEMPLATE, HTMLReportWriter
+from objective_evaluator.results import EvalResults, LazyFrames, load_eval_df
 from objective_evaluator.scraper import BaseScraper
+from objective_evaluator.significance import compare_engines
 
 
-DF_STYLE = [
-                {'selector': 'th', 'props': [('background-color', '#f2f2f2'), ('color', 'black'), ('font-weight', 'bold')]},
-                {'selector': 'td', 'props': [('border', '1px solid #ddd'), ('padding', '8px')]},
-                {'selector': 'tr:nth-of-type(even)', 'props': [('background-color', '#f9f9f9')]},
-            ]
-
-HTML_TEMPLATE = """
-    <html>
-    <head>
-        <style>
-            body {{ font-family: Arial, sans-serif; }}
-            table {{ border-collapse: collapse; width: 100%; }}
-            th, td {{ text-align: left; padding: 8px; }}
-            th {{ background-color: #f2f2f2; }}
-        </style>
-    </head>
-    <body>
-        <h1><svg class="text-primary fill-current h-5 w-auto" width="93" height="30" viewBox="0 0 93 30" fill="none" xmlns="http://www.w3.org/2000/svg"><rect x="31.8769" width="29.9999" height="29.9999" fill="currentColor"></rect><path d="M92.8086 30L62.8087 30L92.8086 8.01086e-05L92.8086 30Z" fill="currentColor"></path><ellipse cx="15" cy="15" rx="15" ry="15" fill="currentColor"></ellipse></svg>&nbsp;&nbsp;{title}</h1>
-        {df_html}
-    </body>
-    </html>
-    """ 
+# Queries per evaluation in pipelined runs, unless `chunk_size` is set in `eval_options`
+PIPELINE_CHUNK_SIZE = 100
 
 
 class ObjectiveEvaluator(BaseModel):
@@ -43,156 +41,343 @@ class ObjectiveEvaluator(BaseModel):
     scrapers: List[BaseScraper]
     api_key: str
     work_dir: str
-    dfs: List[pd.DataFrame]
-
-    def __init__(self, scrapers: List[BaseScraper], api_key: str, work_dir: str):
-        super().__init__(scrapers=scrapers, api_key=api_key, work_dir=work_dir, dfs=[])
+    # One entry per loaded `_eval.json` file. Results are read from disk on demand, see `dfs`.
+    results: List[EvalResults]
+    response_cache: Optional[ResponseCache] = None
+    judgement_store: Optional[JudgementStore] = None
+    # Extra `EvaluationParams` fields for every evaluation, e.g. {"chunk_size": 500, "max_concurrent_chunks": 8}
+    eval_options: Dict[str, Any] = {}
+    # Runs the scrape workers of scrapers with `max_workers` > 1, e.g. a ProcessPoolExecutor for CPU-heavy scrapers.
+    # When set, every scrape goes through it. By default each run uses a thread pool for this.
+    scrape_executor: Optional[Executor] = None
+    # Spans of each stage of `run`, loading and rendering, and the latency of every search, see `latency`
+    instrumentation: Instrumentation
+    # Normalize and deduplicate the queries before a run, see `objective_evaluator.queries`. The prepared
+    # queries of the last run, with the mapping back to the originals, are kept in `query_set`.
+    query_preparation: Optional[QuerySetParams] = None
+    query_set: Optional[QuerySet] = None
+
+    def __init__(
+        self,
+        scrapers: List[BaseScraper],
+        api_key: str,
+        work_dir: str,
+        response_cache: Optional[ResponseCache] = None,
+        judgement_store: Optional[JudgementStore] = None,
+        eval_options: Optional[Dict[str, Any]] = None,
+        scrape_executor: Optional[Executor] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        query_preparation: Optional[QuerySetParams] = None
+    ):
+        super().__init__(
+            scrapers=scrapers,
+            api_key=api_key,
+            work_dir=work_dir,
+            results=[],
+            response_cache=response_cache,
+            judgement_store=judgement_store,
+            eval_options=eval_options or {},
+            scrape_executor=scrape_executor,
+            instrumentation=instrumentation or Instrumentation(),
+            query_preparation=query_preparation
+        )
         self.api_key = api_key
         self.work_dir = work_dir
 
-    def run(self, queries: List[str], clear_work_dir: bool = False) -> None:
-        if clear_work_dir: 
+    def run(
+        self,
+        queries: List[str],
+        clear_work_dir: bool = False,
+        resume: bool = False,
+        pipeline: bool = False,
+        incremental: bool = False
+    ) -> None:
+        """Scrape and evaluate `queries` with every scraper, then load the results.
+
+        With `pipeline`, each scraper's results are submitted for evaluation in chunks while it is still
+        scraping, so the run takes about as long as the slower of the two rather than their sum.
+        With `incremental`, each scraper's new hits are compared with its previous run in `work_dir`, and only
+        queries whose hits changed are evaluated, see `evaluate_changes`. Scrapers without a previous run are
+        evaluated in full.
+        With `query_preparation`, only the representatives in `query_set` are scraped and evaluated.
+        Use `query_set.fan_out(df)` to get results for every original query.
+        """
+        # `latency` and `timings` describe the latest run only
+        self.instrumentation.reset()
+        if self.query_preparation is not None:
+            with self.instrumentation.span(PREPARE):
+                self.query_set = prepare_queries(queries, self.query_preparation)
+            queries = self.query_set.queries
+
+        # When resuming, each scraper only fetches the queries missing from its checkpoint in work_dir,
+        # so the work dir is never cleared. Incremental runs need the previous run's files.
+        if clear_work_dir and not resume and not incremental:
             if os.path.exists(self.work_dir):
                 shutil.rmtree(self.work_dir)
-            os.makedirs(self.work_dir)
+        os.makedirs(self.work_dir, exist_ok=True)
         completed_eval_paths = []
 
-        def process_scraper(scraper, queries):
-            scrape_path = self.work_dir + scraper.params.scrape_id + ".json"
-            eval_path = scrape_path.replace(".json", "_eval.json")
-            scraper.scrape(queries, scrape_path)
-            eval_id = ObjectiveEvalRunner(
-                EvaluationParams(
-                    scrape_results_path=scrape_path,
-                    save_to_path=eval_path,
-                    api_key=self.api_key,
-                    eval_name=scraper.params.scrape_id + "_eval"
+        # Scrapes are blocking, so each runs in a worker thread. Evaluations are coroutines sharing one
+        # tracker, so waiting on them doesn't tie up a thread per scraper.
+        async def process_scraper(scraper, queries, runner, tracker, executor, workers_executor):
+            # Only pass the options in use, so scrapers that override `scrape` with the basic signature keep working
+            scrape_options = {}
+            if resume:
+                scrape_options["resume"] = True
+            if self.response_cache is not None:
+                scrape_options["cache"] = self.response_cache
+
+            workers, concurrency = worker_plan(scraper, len(set(queries)))
+            if self.scrape_executor is None and workers == 1:
+                worker = scraper if concurrency == scraper.concurrency else scraper.with_concurrency(concurrency)
+                scrape = functools.partial(worker.scrape, queries, runner.params.scrape_results_path, **scrape_options)
+            else:
+                scrape = functools.partial(
+                    scrape_partitioned, workers_executor, scraper, queries, runner.params.scrape_results_path, **scrape_options
                 )
-            ).run()
-            print("Evaluation ID completed: ", eval_id)
-            return eval_path
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(process_scraper, scraper, queries) for scraper in self.scrapers]
-            completed_eval_paths = [future.result() for future in concurrent.futures.as_completed(futures)]
+            engine = scraper.params.scrape_id
+            previous = self.set_aside_previous(runner) if incremental else None
+            if previous is not None:
+                try:
+                    with self.instrumentation.span(SCRAPE, engine=engine):
+                        await asyncio.get_running_loop().run_in_executor(executor, scrape)
+                    with self.instrumentation.span(EVALUATE, engine=engine):
+                        eval_id = await self.evaluate_changes(runner, previous, tracker)
+                except BaseException:
+                    # Put the previous run back, so the next incremental run still has it to compare with
+                    self.restore_previous(runner, previous)
+                    raise
+                for path in previous:
+                    os.remove(path)
+            elif pipeline:
+                with self.instrumentation.span(SCRAPE_AND_EVALUATE, engine=engine):
+                    eval_id = await self.run_pipelined(scrape, runner, tracker, executor)
+            else:
+                with self.instrumentation.span(SCRAPE, engine=engine):
+                    await asyncio.get_running_loop().run_in_executor(executor, scrape)
+                with self.instrumentation.span(EVALUATE, engine=engine):
+                    eval_id = await runner.run_async(tracker)
+            print("Evaluation ID completed: ", eval_id)
+            return runner.params.save_to_path
+
+        async def process_scrapers():
+            for scraper in self.scrapers:
+                scraper.instrument(self.instrumentation)
+            runners = [self.eval_runner(scraper) for scraper in self.scrapers]
+            if not runners:
+                return []
+            # Scrapes are coordinated from `executor`. Their workers run in `workers_executor`, so coordinating
+            # threads never wait on tasks queued behind them in the same pool.
+            workers = sum(worker_plan(scraper, len(set(queries)))[0] for scraper in self.scrapers)
+            with contextlib.ExitStack() as stack:
+                executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor())
+                workers_executor = self.scrape_executor or stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+                )
+                async with runners[0].tracker() as tracker:
+                    return await asyncio.gather(*(
+                        process_scraper(scraper, queries, runner, tracker, executor, workers_executor)
+                        for scraper, runner in zip(self.scrapers, runners)
+                    ))
+
+        with self.instrumentation.span(RUN):
+            completed_eval_paths = asyncio.run(process_scrapers())
+
+        if self.response_cache is not None:
+            print("Response cache: ", self.response_cache.stats)
+        if self.judgement_store is not None:
+            print("Judgement store: ", self.judgement_store.stats)
         
         self.load_eval_results(completed_eval_paths)
 
 
+    async def run_pipelined(self, scrape, runner: ObjectiveEvalRunner, tracker, executor) -> Optional[str]:
+        """Run `scrape` in `executor` and evaluate its results in chunks as they arrive."""
+        pipe = ScrapePipeline(
+            asyncio.get_running_loop(),
+            chunk_size=runner.params.chunk_size or PIPELINE_CHUNK_SIZE,
+            max_pending=runner.params.max_concurrent_chunks
+        )
+
+        def produce():
+            try:
+                scrape(on_results=pipe.feed)
+            except PipelineAborted:
+                return
+            except Exception as e:
+                pipe.close(e)
+                raise
+            pipe.close()
+
+        scraping = asyncio.get_running_loop().run_in_executor(executor, produce)
+        try:
+            eval_id = await runner.run_pipelined(pipe.chunks(), tracker)
+        except BaseException:
+            pipe.abort()
+            await asyncio.gather(scraping, return_exceptions=True)
+            raise
+        await scraping
+        return eval_id
+
+    def set_aside_previous(self, runner: ObjectiveEvalRunner) -> Optional[Tuple[str, str]]:
+        """Move the scrape and evaluation files of the runner's previous run out of the way, if it has both."""
+        scrape_path, eval_path = runner.params.scrape_results_path, runner.params.save_to_path
+        if not (os.path.exists(scrape_path) and os.path.exists(eval_path)):
+            return None
+        previous = (scrape_path + ".previous", eval_path + ".previous")
+        os.replace(scrape_path, previous[0])
+        os.replace(eval_path, previous[1])
+        return previous
+
+    def restore_previous(self, runner: ObjectiveEvalRunner, previous: Tuple[str, str]) -> None:
+        """Move the files set aside by `set_aside_previous` back, replacing any written since."""
+        for path, restored in zip(previous, (runner.params.scrape_results_path, runner.params.save_to_path)):
+            if os.path.exists(path):
+                os.replace(path, restored)
+
+    async def evaluate_changes(self, runner: ObjectiveEvalRunner, previous: Tuple[str, str], tracker) -> Optional[str]:
+        """Evaluate the queries whose hits differ from the previous scrape, and carry the other judgements forward.
+
+        The merged results are saved as a full evaluation, with the diff under "changes" (see `EvalResults.changes`).
+        Returns the evaluation ID, or None if no query changed.
+        """
+        previous_scrape, previous_eval = previous
+        diff = diff_scrapes(previous_scrape, runner.params.scrape_results_path)
+        eval_id, status = None, {"status": "completed"}
+        changed_scrape = runner.params.scrape_results_path + ".changed"
+        changed_eval = runner.params.save_to_path + ".changed"
+        try:
+            if diff.to_evaluate:
+                write_subset(runner.params.scrape_results_path, diff.to_evaluate, changed_scrape)
+                params = runner.params.model_copy(
+                    update={"scrape_results_path": changed_scrape, "save_to_path": changed_eval, "compact": False}
+                )
+                eval_id = await runner.model_copy(update={"params": params}).run_async(tracker)
+                with open(changed_eval) as f:
+                    status = json.load(f)
+            runner.save(merge_evaluations(diff, previous_eval, status))
+        finally:
+            for path in (changed_scrape, changed_eval):
+                if os.path.exists(path):
+                    os.remove(path)
+        print(f"Incremental run of {runner.params.eval_name}: {len(diff.to_evaluate)} of {len(diff.queries)} queries changed")
+        return eval_id
+
+    def eval_runner(self, scraper: BaseScraper) -> ObjectiveEvalRunner:
+        return ObjectiveEvalRunner(
+            EvaluationParams(
+                scrape_results_path=self.work_dir + scraper.params.scrape_id + ".jsonl",
+                save_to_path=self.work_dir + scraper.params.scrape_id + "_eval.json",
+                api_key=self.api_key,
+                eval_name=scraper.params.scrape_id + "_eval",
+                **{"compact": scraper.params.compact, **self.eval_options}
+            ),
+            judgement_store=self.judgement_store,
+            instrumentation=self.instrumentation
+        )
+
     def eval_to_df(self, path: str) -> pd.DataFrame:
-        with open(path, 'r') as file:
-            data = json.load(file)
-        
-        judgements = data.get('judgements', [])
-        rows = []
-        
-        current_query = None
-        position = 0
-        for judgement in judgements:
-            if judgement['query'] != current_query:
-                current_query = judgement['query']
-                position = 1
-            else:
-                position += 1
-            
-            row = {
-                'query': judgement['query'],
-                'position': position,
-                'object_id': judgement['object_id'],
-                'object': json.dumps(judgement['object']),  # Convert object to JSON string
-                'score': judgement['judgement']['score'],
-                'label': judgement['judgement']['label'],
-                'explanation': judgement['judgement']['explanation']
-            }
-            rows.append(row)
-        df = pd.DataFrame(rows)
+        df = load_eval_df(path)
         df.Name = path.split("/")[-1].replace("_eval.json", "") 
         return df
-            
+
+    @property
+    def dfs(self) -> LazyFrames:
+        """The loaded results as DataFrames. Each is read from its columnar cache when it is accessed and is not kept."""
+        return LazyFrames(self.results)
 
     def load_eval_results(self, paths: List[str]):
         for path in paths:
-            df = self.eval_to_df(path)
-            self.dfs.append(df)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"No evaluation results at {path}")
+            self.results.append(EvalResults(path, self.instrumentation))
 
 
 
-    def summary(self):
-        for df in self.dfs:
-            judgement_counts = df['label'].value_counts()
-            print(f"Summary for {df.Name}:")
-            print(f"GREAT: {judgement_counts.get('GREAT', 0)}")
-            print(f"OK: {judgement_counts.get('OK', 0)}")
-            print(f"BAD: {judgement_counts.get('BAD', 0)}")
-            print()  # Add a blank line between summaries
-
+    def label_counts(self) -> Dict[str, LabelCounts]:
+        """Label counts per evaluation, with per-query and per-position breakdowns. Computed once per evaluation."""
+        return {results.name: label_counts(results) for results in self.results}
 
+    def metrics(self, k: int = 10) -> pd.DataFrame:
+        """nDCG@k, DCG@k, precision@k, MRR and mean first BAD position per evaluation, see `objective_evaluator.metrics`.
 
-    def full_results_html(self, save_to_path: str):
-        for df in self.dfs:
-            styled_df = df.style.set_table_styles(DF_STYLE)
-            full_html = styled_df.to_html()
+        Use `query_metrics(results, k)` from that module for the per-query values.
+        """
+        return engine_metrics(self.results, k)
 
-            # Generate summary section
-            summary_html = "<h2>Summary</h2>"
-            summary_html += "<table>"
-            summary_html += "<tr><th>Label</th><th>Count</th><th>Percentage</th></tr>"
-            total_judgements = len(df)
-            for label in ['GREAT', 'OK', 'BAD']:
-                count = df['label'].value_counts().get(label, 0)
-                percentage = (count / total_judgements) * 100 if total_judgements > 0 else 0
-                summary_html += f"<tr><td>{label}</td><td>{count}</td><td>{percentage:.2f}%</td></tr>"
-            summary_html += "</table>"
+    def summary(self):
+        for name, counts in self.label_counts().items():
+            totals = counts.totals
+            print(f"Summary for {name}:")
+            print(f"GREAT: {totals['GREAT']}")
+            print(f"OK: {totals['OK']}")
+            print(f"BAD: {totals['BAD']}")
+            print()  # Add a blank line between summaries
 
-            # Add summary section to the full HTML
-            full_html = summary_html + full_html
+    def full_results_html(self, save_to_path: str, queries_per_page: int = 100):
+        """Write an index page with a summary of every evaluation to `save_to_path`, linking to pages of results.
 
-            html = HTML_TEMPLATE.format(title="Evaluation Results - " + df.Name, df_html=full_html)
-            with open(save_to_path, "w") as f:
-                f.write(html)
+        The pages are streamed to a `<name>_pages` directory next to `save_to_path`, `queries_per_page` queries each.
+        """
+        with self.instrumentation.span(RENDER):
+            HTMLReportWriter(save_to_path, queries_per_page).write_results(self.results, self.latency())
 
+    def comparison_df(self, on: str = "position") -> pd.DataFrame:
+        """The evaluations side by side, one row per query and position, or per query and document with `on="object_id"`.
 
-    def comparison_df(self):
-        if len(self.dfs) < 2:
+        See `objective_evaluator.compare.build_comparison`.
+        """
+        if len(self.results) < 2:
             raise ValueError("At least two DataFrames are required to join.")
-        result_df = self.dfs[0][['query', 'position', 'label', 'object', 'explanation']].copy()
-        result_df.columns = ['query', 'position', f'{self.dfs[0].Name}_label', f'{self.dfs[0].Name}_object', f'{self.dfs[0].Name}_explanation']
-        
-        for df in self.dfs[1:]:
-            temp_df = df[['query', 'position', 'label', 'object', 'explanation']].copy()
-            temp_df.columns = ['query', 'position', f'{df.Name}_label', f'{df.Name}_object', f'{df.Name}_explanation']
-            result_df = pd.merge(result_df, temp_df, on=['query', 'position'], how='outer')
-        
-        return result_df.sort_values(['query', 'position']).reset_index(drop=True)
-       
-    def comparison_html(self, save_to_path: str):
-        df = self.comparison_df()
-        styled_df = df.style.set_table_styles(DF_STYLE)
-
-        # Generate summary section
-        summary_html = "<h2>Summary Comparison</h2>"
-        summary_html += "<table>"
-        summary_html += "<tr><th>Eval Name</th><th>GREAT</th><th>OK</th><th>BAD</th><th>Total</th></tr>"
-
-        for df in self.dfs:
-            total_judgements = len(df)
-            great_count = df['label'].value_counts().get('GREAT', 0)
-            ok_count = df['label'].value_counts().get('OK', 0)
-            bad_count = df['label'].value_counts().get('BAD', 0)
-
-            summary_html += f"<tr>"
-            summary_html += f"<td>{df.Name}</td>"
-            summary_html += f"<td>{great_count} ({great_count/total_judgements*100:.2f}%)</td>"
-            summary_html += f"<td>{ok_count} ({ok_count/total_judgements*100:.2f}%)</td>"
-            summary_html += f"<td>{bad_count} ({bad_count/total_judgements*100:.2f}%)</td>"
-            summary_html += f"<td>{total_judgements}</td>"
-            summary_html += f"</tr>"
-
-        summary_html += "</table>"
-
-        full_html = summary_html + styled_df.to_html()
-
-        html = HTML_TEMPLATE.format(title="Evaluation Comparison", df_html=full_html)
-        with open(save_to_path, "w") as f:
-            f.write(html)
-
+        return comparison_df(self.results, on=on)
+
+    def significance(
+        self,
+        metric: str = "ndcg@10",
+        k: int = 10,
+        baseline: int = 0,
+        iterations: int = 10_000,
+        confidence: float = 0.95
+    ) -> pd.DataFrame:
+        """Paired bootstrap interval, randomization, Wilcoxon and sign tests of each evaluation against `dfs[baseline]`.
+
+        `metric` is a per-query ranking metric (e.g. "ndcg@10", "reciprocal_rank") or a label share (e.g. "GREAT").
+        See `objective_evaluator.significance`.
+        """
+        return compare_engines(self.results, metric, k, baseline, iterations, confidence)
+
+    def comparison_html(
+        self,
+        save_to_path: str,
+        queries_per_page: int = 100,
+        significance_metrics: Sequence[str] = ("GREAT", "ndcg@10"),
+        iterations: int = 10_000
+    ):
+        """Like `full_results_html`, with the evaluations side by side, joined on query and position.
+
+        The summary also tests each evaluation against the first on `significance_metrics`.
+        """
+        if len(self.results) < 2:
+            raise ValueError("At least two DataFrames are required to join.")
+        with self.instrumentation.span(RENDER):
+            significance = pd.concat([
+                self.significance(metric, iterations=iterations) for metric in significance_metrics
+            ], ignore_index=True) if significance_metrics else None
+            HTMLReportWriter(save_to_path, queries_per_page).write_comparison(self.results, significance, self.latency())
+
+    def latency(self) -> pd.DataFrame:
+        """p50/p95/p99 search latency per engine, in seconds, from the last `run`.
+
+        `search.latency` is the round trip seen by the scraper, per request (a whole batch with `_msearch`).
+        `search.took` is the time the engine reports spending on each search, e.g. OpenSearch's `took`.
+        """
+        return self.instrumentation.latency_df()
+
+    def timings(self) -> pd.DataFrame:
+        """Count, mean, max and p50/p95/p99 of every span and measurement recorded since the last `run` started, in seconds.
+
+        Use `instrumentation.write_json(path)` to export them with the individual spans, or pass
+        `Instrumentation(sinks=[...])` to stream every value to a metrics backend.
+        """
+        return self.instrumentation.summary_df()
@@ -0,0 +1,83 @@
+import json
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+from objective_evaluator.compact import document_id, expand_judgements
+from objective_evaluator.scraper import SearchResultItem, SearchResultsWriter, read_search_results
+
+
+class ScrapeDiff(BaseModel):
+    """How each query's hit list in a scrape differs from the previous scrape. Queries are in scrape order."""
+    queries: List[str]
+    # Queries whose hits (the documents, or their order) changed, and queries that are new
+    changed: List[str]
+    added: List[str]
+    # Queries that were only in the previous scrape, and the number of queries with the same hits
+    removed: List[str]
+    unchanged: int
+
+    @property
+    def to_evaluate(self) -> List[str]:
+        """Queries that need new judgements, in scrape order."""
+        evaluate = set(self.changed) | set(self.added)
+        return [query for query in self.queries if query in evaluate]
+
+    def summary(self) -> dict:
+        return self.model_dump(exclude={"queries"})
+
+
+def hit_lists(path: str) -> Dict[str, List[str]]:
+    """The ids of the documents each query returned, in rank order, see `compact.document_id`."""
+    hits: Dict[str, List[str]] = {}
+    for item in read_search_results(path):
+        hits.setdefault(item["query"], []).append(document_id(item["object"]))
+    return hits
+
+
+def diff_scrapes(previous_path: str, current_path: str) -> ScrapeDiff:
+    previous, current = hit_lists(previous_path), hit_lists(current_path)
+    changed, added = [], []
+    for query, hits in current.items():
+        if query not in previous:
+            added.append(query)
+        elif previous[query] != hits:
+            changed.append(query)
+    return ScrapeDiff(
+        queries=list(current),
+        changed=changed,
+        added=added,
+        removed=[query for query in previous if query not in current],
+        unchanged=len(current) - len(changed) - len(added)
+    )
+
+
+def write_subset(scrape_path: str, queries: List[str], save_to_path: str) -> None:
+    """Write the results of `queries` in a scrape file to a new NDJSON scrape file."""
+    wanted = set(queries)
+    with SearchResultsWriter(save_to_path) as writer:
+        writer.write(
+            SearchResultItem(query=item["query"], object=item["object"])
+            for item in read_search_results(scrape_path) if item["query"] in wanted
+        )
+
+
+def judgements_by_query(data: dict) -> Dict[str, List[dict]]:
+    """The judgements of an evaluation status or `_eval.json` file, compact or not, grouped by query."""
+    by_query: Dict[str, List[dict]] = {}
+    for judgement in expand_judgements(data):
+        by_query.setdefault(judgement["query"], []).append(judgement)
+    return by_query
+
+
+def merge_evaluations(diff: ScrapeDiff, previous_eval_path: str, status: dict) -> dict:
+    """A full evaluation status from the `status` of evaluating `diff.to_evaluate`, with the judgements of the
+    other queries carried forward from `previous_eval_path`, in scrape order. The diff is recorded under "changes"."""
+    with open(previous_eval_path) as f:
+        previous = judgements_by_query(json.load(f))
+    new = judgements_by_query(status)
+    evaluate = set(diff.to_evaluate)
+    judgements = []
+    for query in diff.queries:
+        judgements.extend((new if query in evaluate else previous).get(query, []))
+    return {**status, "status": "completed", "judgements": judgements, "changes": diff.summary()}
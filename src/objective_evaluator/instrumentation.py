@@ -0,0 +1,173 @@
+import contextlib
+import json
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Measurements recorded by the evaluator and scrapers, all in seconds:
+# stage spans, tagged with `engine` where they belong to one scraper
+PREPARE, RUN, SCRAPE, EVALUATE, EVALUATE_SUBMIT, EVALUATE_POLL, LOAD, RENDER = (
+    "prepare", "run", "scrape", "evaluate", "evaluate.submit", "evaluate.poll", "load", "render"
+)
+# building an evaluation's columnar cache, the first time its results are read
+LOAD_CACHE = "load.cache"
+# pipelined runs overlap scraping and evaluating, so they are timed together
+SCRAPE_AND_EVALUATE = "scrape+evaluate"
+# per search request as seen by the scraper, and as reported by the engine (e.g. OpenSearch's `took`)
+SEARCH_LATENCY, ENGINE_TOOK = "search.latency", "search.took"
+
+PERCENTILES = (50, 95, 99)
+
+Tags = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Every value of one measurement, kept compactly so exact percentiles can be read at any time."""
+
+    def __init__(self):
+        self.values = array("d")
+
+    def observe(self, value: float) -> None:
+        self.values.append(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def summary(self) -> dict:
+        values = np.array(self.values, dtype=np.float64)
+        summary = {
+            "count": len(values),
+            "mean": float(values.mean()) if len(values) else None,
+            "max": float(values.max()) if len(values) else None
+        }
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES) if len(values) else [None] * len(PERCENTILES)):
+            summary[f"p{p}"] = None if value is None else float(value)
+        return summary
+
+
+class MetricsSink:
+    """Receives every measurement as it is recorded. Subclass to forward them to StatsD, Prometheus, logs, etc."""
+
+    def observe(self, name: str, value: float, tags: Dict[str, str]) -> None:
+        raise NotImplementedError("Subclass must implement abstract method")
+
+
+class JSONLinesSink(MetricsSink):
+    """Appends each measurement to a file as a {"name", "value", "tags", "time"} JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, tags: Dict[str, str]) -> None:
+        line = json.dumps({"name": name, "value": value, "tags": tags, "time": time.time()})
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+
+
+class Instrumentation:
+    """Thread-safe spans and histograms of where a run's time goes.
+
+    `span(name, **tags)` times a stage: it is kept as a span and its duration goes into the `name` histogram
+    for those tags. `observe` records a single value, e.g. one search's latency. Every value is also passed to
+    each of `sinks`. Instrumentation pickles without its sinks, so values recorded by a copy in another
+    process only reach them once the copy is sent back and `merge`d.
+    """
+
+    def __init__(self, sinks: Optional[List[MetricsSink]] = None):
+        self.sinks = list(sinks or [])
+        self.histograms: Dict[Tuple[str, Tags], Histogram] = {}
+        self.spans: List[dict] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        with self._lock:
+            return {"histograms": self.histograms, "spans": self.spans, "started": self.started}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__()
+        self.__dict__.update(state)
+
+    def reset(self) -> None:
+        """Forget the spans and values recorded so far. The sinks, which have already been sent them, are kept."""
+        with self._lock:
+            self.histograms = {}
+            self.spans = []
+            self.started = time.perf_counter()
+
+    def observe(self, name: str, value: float, **tags: str) -> None:
+        key = (name, tuple(sorted(tags.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+        for sink in self.sinks:
+            sink.observe(name, value, tags)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **tags: str) -> Iterator[None]:
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.spans.append({
+                    "name": name, "tags": tags, "start": start - self.started, "duration": duration, "failed": failed
+                })
+            self.observe(name, duration, **tags)
+
+    def merge(self, other: "Instrumentation") -> None:
+        """Add the spans and values recorded by `other`, e.g. in a worker process."""
+        with other._lock:
+            histograms = [(key, array("d", histogram.values)) for key, histogram in other.histograms.items()]
+        for (name, tags), values in histograms:
+            for value in values:
+                self.observe(name, value, **dict(tags))
+        with self._lock:
+            self.spans.extend(other.spans)
+
+    def summaries(self, names: Optional[List[str]] = None) -> List[dict]:
+        """One {"name", "tags", "count", "mean", "max", "p50", "p95", "p99"} dict per measurement and tags."""
+        with self._lock:
+            return [
+                {"name": name, "tags": dict(tags), **histogram.summary()}
+                for (name, tags), histogram in self.histograms.items()
+                if names is None or name in names
+            ]
+
+    def summary_df(self, names: Optional[List[str]] = None) -> pd.DataFrame:
+        """`summaries` as a table, with a column per tag."""
+        return pd.DataFrame([
+            {"name": summary["name"], **summary["tags"], **{k: v for k, v in summary.items() if k not in ("name", "tags")}}
+            for summary in self.summaries(names)
+        ])
+
+    def latency_df(self) -> pd.DataFrame:
+        """Search latency percentiles per engine, as seen by the scraper and as reported by the engine."""
+        df = self.summary_df([SEARCH_LATENCY, ENGINE_TOOK])
+        if df.empty:
+            return df
+        return df.sort_values(["engine", "name"]).reset_index(drop=True)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "spans": spans,
+            "histograms": self.summaries()
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
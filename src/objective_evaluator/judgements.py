@@ -0,0 +1,64 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Set
+
+from objective_evaluator.cache import CacheStats, cache_key
+
+
+def judgement_key(query: str, obj: dict, configuration: dict) -> str:
+    """Key for a (query, object) pair judged under an evaluation configuration. The eval name is only a label, so it is left out."""
+    return cache_key("judgement", query, obj, {k: v for k, v in configuration.items() if k != "eval_name"})
+
+
+class JudgementStore:
+    """Judgements already returned by the evaluation API, in a single SQLite file.
+
+    Only the judgement itself is stored (e.g. `object_id` and `judgement`), since the query and object
+    are part of the key and are known to the caller.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS judgements (key TEXT PRIMARY KEY, judgement BLOB, created REAL)")
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def lookup(self, keys: Iterable[str]) -> Set[str]:
+        """Return the keys that have a stored judgement, counting hits and misses."""
+        keys = list(keys)
+        found = set()
+        with self._lock:
+            # Stay well under SQLite's limit on bound parameters
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._db.execute(
+                    f"SELECT key FROM judgements WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(key for key, in rows)
+            self.stats.hits += len(found)
+            self.stats.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT judgement FROM judgements WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_many(self, judgements: List[tuple]) -> None:
+        """Store (key, judgement) pairs."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO judgements (key, judgement, created) VALUES (?, ?, ?)",
+                [(key, json.dumps(judgement).encode(), now) for key, judgement in judgements]
+            )
+            self._db.commit()
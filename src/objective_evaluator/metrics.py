@@ -0,0 +1,101 @@
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.results import EvalResults
+
+RELEVANT_LABELS = ("GREAT", "OK")
+METRIC_COLUMNS = ["query", "position", "score", "label"]
+
+
+def ranking_metrics(
+    df: pd.DataFrame,
+    k: int = 10,
+    relevant_labels: Iterable[str] = RELEVANT_LABELS,
+    exponential_gain: bool = True
+) -> pd.DataFrame:
+    """Ranking metrics for each query of a results DataFrame with `query`, `position`, `score` and `label` columns.
+
+    Returns one row per query with its number of results, `dcg@k`, `ndcg@k`, `precision@k`,
+    `reciprocal_rank` and `first_bad_position` (NaN when no result is BAD). The gain of a result is
+    `2 ** score - 1`, or `score` without `exponential_gain`. The ideal DCG is computed from the query's
+    own judged results. A result is relevant, for precision and reciprocal rank, when its label is
+    in `relevant_labels`.
+
+    Every metric is computed for all queries at once with NumPy segment sums, so the cost is a couple
+    of sorts and bincounts over the whole set rather than a Python loop per query.
+    """
+    query = df["query"] if isinstance(df["query"].dtype, pd.CategoricalDtype) else df["query"].astype("category")
+    codes = query.cat.codes.to_numpy(np.int64)
+    queries = len(query.cat.categories)
+    positions = df["position"].to_numpy(np.int64)
+    scores = pd.to_numeric(df["score"], errors="coerce").fillna(0).to_numpy(np.float64)
+    relevant = df["label"].isin(list(relevant_labels)).to_numpy()
+    bad = (df["label"] == "BAD").to_numpy()
+
+    gains = np.exp2(scores) - 1 if exponential_gain else scores
+    top = positions <= k
+    dcg = np.bincount(codes, weights=np.where(top, gains / np.log2(positions + 1), 0.0), minlength=queries)
+
+    # The ideal ranking puts each query's results in descending order of gain
+    order = np.lexsort((-gains, codes))
+    ideal_codes = codes[order]
+    ideal_ranks = np.arange(len(order)) - np.searchsorted(ideal_codes, ideal_codes, side="left")
+    idcg = np.bincount(
+        ideal_codes,
+        weights=np.where(ideal_ranks < k, gains[order] / np.log2(ideal_ranks + 2), 0.0),
+        minlength=queries
+    )
+    ndcg = np.divide(dcg, idcg, out=np.zeros(queries), where=idcg > 0)
+
+    precision = np.bincount(codes, weights=relevant & top, minlength=queries) / k
+
+    first_relevant = np.full(queries, np.inf)
+    np.minimum.at(first_relevant, codes[relevant], positions[relevant])
+    reciprocal_rank = np.divide(1.0, first_relevant, out=np.zeros(queries), where=np.isfinite(first_relevant))
+
+    first_bad = np.full(queries, np.inf)
+    np.minimum.at(first_bad, codes[bad], positions[bad])
+    first_bad[~np.isfinite(first_bad)] = np.nan
+
+    return pd.DataFrame({
+        "results": np.bincount(codes, minlength=queries),
+        f"dcg@{k}": dcg,
+        f"ndcg@{k}": ndcg,
+        f"precision@{k}": precision,
+        "reciprocal_rank": reciprocal_rank,
+        "first_bad_position": first_bad
+    }, index=pd.Index(query.cat.categories, name="query"))
+
+
+def summarize_metrics(per_query: pd.DataFrame) -> dict:
+    """Mean of each per-query metric. `reciprocal_rank` becomes `mrr`, and queries without a BAD result are
+    left out of `first_bad_position` and counted in `queries_without_bad` instead."""
+    summary = {"queries": len(per_query)}
+    for column in per_query.columns.drop(["results", "first_bad_position"]):
+        name = "mrr" if column == "reciprocal_rank" else column
+        summary[name] = float(per_query[column].mean()) if len(per_query) else np.nan
+    first_bad = per_query["first_bad_position"]
+    summary["first_bad_position"] = float(first_bad.mean()) if first_bad.notna().any() else np.nan
+    summary["queries_without_bad"] = int(first_bad.isna().sum())
+    return summary
+
+
+def query_metrics(results: EvalResults, k: int = 10, relevant_labels: Iterable[str] = RELEVANT_LABELS, exponential_gain: bool = True) -> pd.DataFrame:
+    """`ranking_metrics` for an evaluation, computed from its narrow columns once per set of options."""
+    relevant_labels = tuple(relevant_labels)
+    return results.cached(
+        f"ranking_metrics:{k}:{relevant_labels}:{exponential_gain}",
+        lambda r: ranking_metrics(r.load(columns=METRIC_COLUMNS), k, relevant_labels, exponential_gain)
+    )
+
+
+def engine_metrics(results: List[EvalResults], k: int = 10, relevant_labels: Iterable[str] = RELEVANT_LABELS, exponential_gain: bool = True) -> pd.DataFrame:
+    """One row per evaluation with its metrics averaged over queries, see `summarize_metrics`."""
+    df = pd.DataFrame.from_dict({
+        r.name: summarize_metrics(query_metrics(r, k, relevant_labels, exponential_gain))
+        for r in results
+    }, orient="index")
+    df.index.name = "eval_name"
+    return df
@@ -0,0 +1,146 @@
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from objective_evaluator.instrumentation import Instrumentation
+from objective_evaluator.scraper import BaseScraper, SearchResultItem, SearchResultsWriter
+
+
+def worker_plan(scraper: BaseScraper, queries: int) -> Tuple[int, int]:
+    """How many workers to split a scrape of `queries` unique queries across, and the concurrency of each.
+
+    There are at most `max_workers` workers and no more than there are queries. With `max_concurrency`,
+    the engine's total in-flight requests are capped: each worker gets an equal share of at least one,
+    so the number of workers is capped too.
+    """
+    params = scraper.params
+    workers = max(1, min(params.max_workers, queries))
+    concurrency = scraper.concurrency
+    if params.max_concurrency is not None:
+        workers = min(workers, max(1, params.max_concurrency))
+        concurrency = max(1, min(concurrency, params.max_concurrency // workers))
+    return workers, concurrency
+
+
+def partition(queries: List[str], workers: int) -> List[List[str]]:
+    """Split the unique queries into `workers` contiguous, nearly equal parts."""
+    unique = list(dict.fromkeys(queries))
+    size, extra = divmod(len(unique), workers)
+    parts, start = [], 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        parts.append(unique[start:end])
+        start = end
+    return [part for part in parts if part]
+
+
+def part_path(save_to_path: str, index: int, parts: int) -> str:
+    return f"{save_to_path}.part{index + 1}of{parts}.jsonl"
+
+
+def scrape_part(
+    scraper: BaseScraper, queries: List[str], path: str, options: dict, rate_share: float = 1.0, process: bool = False
+) -> Tuple[str, Optional[Instrumentation]]:
+    """Run in a worker, which may be another `process`: scrape one part of the queries into its own file.
+
+    A scraper's throttle and instrumentation are shared by threads. Each process gets its own copy of the
+    throttle, limited to `rate_share` of the rate, and records into fresh instrumentation that is returned
+    to be merged.
+    """
+    if scraper.throttle is not None and rate_share != 1.0:
+        scraper.throttle.limiter.scale(rate_share)
+    if process and scraper.instrumentation is not None:
+        scraper.instrument(Instrumentation())
+    scraper.scrape(queries, path, **options)
+    return path, scraper.instrumentation if process else None
+
+
+def index_lines(path: str) -> Dict[str, Tuple[int, int]]:
+    """The byte range of each query's results in an NDJSON scrape file, whose results are grouped by query."""
+    ranges, offset = {}, 0
+    with open(path, "rb") as f:
+        for line in f:
+            query = json.loads(line)["query"]
+            start, length = ranges.get(query, (offset, 0))
+            ranges[query] = (start, length + len(line))
+            offset += len(line)
+    return ranges
+
+
+def replay(path: str, on_results: Callable[[str, List[SearchResultItem]], None]) -> None:
+    """Call `on_results(query, items)` for each query in a part's scrape file."""
+    query, items = None, []
+    with open(path, "rb") as f:
+        for line in f:
+            item = json.loads(line)
+            if item["query"] != query and query is not None:
+                on_results(query, items)
+                items = []
+            query = item["query"]
+            items.append(SearchResultItem(query=item["query"], object=item["object"]))
+    if query is not None:
+        on_results(query, items)
+
+
+def scrape_partitioned(
+    executor: Executor,
+    scraper: BaseScraper,
+    queries: List[str],
+    save_to_path: str,
+    resume: bool = False,
+    cache=None,
+    on_results: Optional[Callable[[str, List[SearchResultItem]], None]] = None
+) -> None:
+    """Like `BaseScraper.scrape`, with the queries split across workers of `executor`.
+
+    Call it from a thread that is not one of `executor`'s workers. Each part is scraped by its own
+    `scraper.with_concurrency(...)` copy (see `worker_plan`) into a file next to `save_to_path`, with its
+    own checkpoint, so resuming works as long as `max_workers` is unchanged. With a process pool, the
+    scraper and `cache` must be picklable. `on_results` is called for a part's queries once it and the
+    parts before it are done. The parts are then merged into `save_to_path` in query order.
+    """
+    workers, concurrency = worker_plan(scraper, len(set(queries)))
+    worker = scraper.with_concurrency(concurrency)
+    parts = partition(queries, workers)
+    # Parts are always written in the full format, to be replayed and merged
+    options = {"compact": False} if scraper.params.compact else {}
+    if resume:
+        options["resume"] = True
+    if cache is not None:
+        options["cache"] = cache
+
+    paths = [part_path(save_to_path, i, len(parts)) for i in range(len(parts))]
+    process = isinstance(executor, ProcessPoolExecutor)
+    rate_share = 1 / len(parts) if process else 1.0
+    futures = [
+        executor.submit(scrape_part, worker, part, path, options, rate_share, process)
+        for part, path in zip(parts, paths)
+    ]
+    try:
+        # Parts are handed on in order, so results reach `on_results` in query order
+        for future in futures:
+            path, instrumentation = future.result()
+            if instrumentation is not None and scraper.instrumentation is not None:
+                scraper.instrumentation.merge(instrumentation)
+            if on_results is not None:
+                replay(path, on_results)
+    finally:
+        for future in futures:
+            future.cancel()
+
+    ranges = [index_lines(path) for path in paths]
+    owner = {query: i for i, part in enumerate(parts) for query in part}
+    files = [open(path, "rb") for path in paths]
+    try:
+        with SearchResultsWriter(save_to_path, scraper.params.compact) as writer:
+            for query in queries:
+                f = files[owner[query]]
+                offset, length = ranges[owner[query]].get(query, (0, 0))
+                f.seek(offset)
+                writer.write_lines(f.read(length))
+    finally:
+        for f in files:
+            f.close()
+    for path in paths:
+        os.remove(path)
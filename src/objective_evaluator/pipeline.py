@@ -0,0 +1,63 @@
+import asyncio
+import dataclasses
+from typing import AsyncIterator, List, Optional
+
+from objective_evaluator.scraper import SearchResultItem
+
+
+class PipelineAborted(Exception):
+    """Raised in the scraping thread when the evaluation side of a pipeline has stopped."""
+
+
+class ScrapePipeline:
+    """Hands results from a scrape running in a worker thread to an evaluation running in an event loop.
+
+    The scrape calls `feed` for each query. Results are grouped into chunks of `chunk_size` queries and
+    put on a queue holding at most `max_pending` chunks. When the queue is full, `feed` blocks the
+    scraping thread until the evaluation catches up, so memory stays bounded. The evaluation consumes
+    `chunks()`.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, chunk_size: int, max_pending: int):
+        self.loop = loop
+        self.chunk_size = chunk_size
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.aborted = False
+        self._chunk: List[dict] = []
+        self._queries = 0
+
+    def feed(self, query: str, items: List[SearchResultItem]) -> None:
+        """Called from the scraping thread."""
+        self._chunk.extend(dataclasses.asdict(item) for item in items)
+        self._queries += 1
+        if self._queries == self.chunk_size:
+            self._put(self._chunk)
+            self._chunk, self._queries = [], 0
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        """Called from the scraping thread once the scrape has finished, or failed with `error`."""
+        if error is None and self._chunk:
+            self._put(self._chunk)
+        self._put(error if error is not None else StopAsyncIteration())
+
+    def abort(self) -> None:
+        """Called from the event loop when the evaluation fails, to unblock and stop the scrape."""
+        self.aborted = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def chunks(self) -> AsyncIterator[List[dict]]:
+        while True:
+            chunk = await self.queue.get()
+            if isinstance(chunk, StopAsyncIteration):
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+    def _put(self, item) -> None:
+        if self.aborted:
+            raise PipelineAborted("The evaluation stopped before the scrape finished.")
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+        if self.aborted:
+            raise PipelineAborted("The evaluation stopped before the scrape finished.")
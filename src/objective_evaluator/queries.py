@@ -0,0 +1,225 @@
+import hashlib
+import re
+import unicodedata
+from concurrent.futures import Executor
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+# MinHash permutations are (a * x + b) mod a Mersenne prime, on 31-bit shingle hashes, so products fit in 64 bits
+PRIME = (1 << 31) - 1
+# Queries hashed per block, to bound the memory of the (permutations x shingles) matrix
+SIGNATURE_BLOCK = 10_000
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QuerySetParams(BaseModel):
+    # Case-fold, apply Unicode NFKC and collapse whitespace before comparing queries
+    normalize: bool = True
+    # Also merge near-duplicates: queries whose token shingles have a Jaccard similarity of at least
+    # `similarity`. Candidates are found with MinHash LSH: `bands` bands of `rows` rows each.
+    near_duplicates: bool = False
+    similarity: float = 0.8
+    shingle_size: int = 1
+    bands: int = 16
+    rows: int = 4
+    # Keep a stratified sample of this many of the deduplicated queries
+    sample_size: Optional[int] = None
+    seed: int = 0
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", query).casefold()).strip()
+
+
+def shingles(query: str, size: int = 1) -> frozenset:
+    """The set of `size`-token shingles of a query. With size 1, word order does not matter."""
+    tokens = query.split()
+    if len(tokens) <= size:
+        return frozenset([" ".join(tokens)])
+    return frozenset(" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _shingle_hash(shingle: str) -> int:
+    # Stable across processes, unlike `hash`
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little") & PRIME
+
+
+class MinHasher:
+    """MinHash signatures of shingle sets, computed for a block of queries at a time with NumPy."""
+
+    def __init__(self, permutations: int, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, permutations, dtype=np.uint64)
+
+    def signatures(self, sets: List[frozenset]) -> np.ndarray:
+        """A (len(sets), permutations) array of uint32 MinHash values."""
+        hashes = np.fromiter((_shingle_hash(s) for shingle_set in sets for s in shingle_set), dtype=np.uint64)
+        lengths = np.fromiter((len(shingle_set) for shingle_set in sets), dtype=np.int64, count=len(sets))
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME
+        return np.minimum.reduceat(permuted, starts, axis=1).T.astype(np.uint32)
+
+    def band_keys(self, signatures: np.ndarray, bands: int) -> np.ndarray:
+        """A (len(signatures), bands) array hashing each band of each signature, and the band's number, to 64 bits."""
+        rows = signatures.shape[1] // bands
+        rng = np.random.default_rng(len(self.a))
+        multipliers = rng.integers(1, 1 << 63, (bands, rows), dtype=np.uint64) | np.uint64(1)
+        salts = rng.integers(0, 1 << 63, bands, dtype=np.uint64)
+        # Arithmetic wraps around modulo 2**64
+        banded = signatures.astype(np.uint64).reshape(len(signatures), bands, rows)
+        return (banded * multipliers).sum(axis=2, dtype=np.uint64) + salts
+
+
+class QuerySet:
+    """Queries prepared for a run, and the mapping from every original query to the query sent in its place.
+
+    `queries` are the representatives, each the first original query of its group, in the order they
+    first appear. `fan_out` copies results for the representatives back to every original query.
+    """
+
+    def __init__(self, originals: List[str], representative: Dict[str, str], queries: List[str]):
+        self.originals = originals
+        self.representative = representative
+        self.queries = queries
+
+    def __len__(self) -> int:
+        return len(self.queries)
+
+    def groups(self) -> Dict[str, List[str]]:
+        """The original queries each representative stands for."""
+        groups = {query: [] for query in self.queries}
+        for original in self.originals:
+            rep = self.representative.get(original)
+            if rep in groups:
+                groups[rep].append(original)
+        return groups
+
+    def sample(
+        self,
+        size: int,
+        stratum: Optional[Callable[[str], Hashable]] = None,
+        seed: int = 0
+    ) -> "QuerySet":
+        """A stratified sample of `size` representatives, keeping their originals.
+
+        Each stratum (by default the number of tokens, with 5 or more grouped together) gets a share
+        proportional to its size. The sample keeps the queries' order.
+        """
+        if size >= len(self.queries):
+            return self
+        if size <= 0:
+            return QuerySet([], {}, [])
+        stratum = stratum or (lambda query: min(len(query.split()), 5))
+        strata: Dict[Hashable, List[int]] = {}
+        for i, query in enumerate(self.queries):
+            strata.setdefault(stratum(query), []).append(i)
+
+        # Largest remainder allocation of `size` across the strata
+        counts = np.array([len(members) for members in strata.values()])
+        quotas = counts * size / len(self.queries)
+        allocation = np.floor(quotas).astype(int)
+        for i in np.argsort(-(quotas - allocation), kind="stable")[:size - allocation.sum()]:
+            allocation[i] += 1
+
+        rng = np.random.default_rng(seed)
+        chosen = np.concatenate([
+            rng.choice(members, n, replace=False) for members, n in zip(strata.values(), allocation) if n
+        ])
+        queries = [self.queries[i] for i in np.sort(chosen)]
+        kept = set(queries)
+        return QuerySet(
+            [original for original in self.originals if self.representative[original] in kept],
+            {original: rep for original, rep in self.representative.items() if rep in kept},
+            queries
+        )
+
+    def fan_out(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Results for the representatives, with each query's rows repeated for every original query it stands for.
+
+        The `query` column then holds the original queries, in their original order, and `representative`
+        the query that was sent.
+        """
+        mapping = pd.DataFrame({
+            "representative": [self.representative[original] for original in self.originals],
+            "original": self.originals,
+            "order": np.arange(len(self.originals))
+        })
+        fanned = df.rename(columns={"query": "representative"})
+        fanned["representative"] = fanned["representative"].astype(str)
+        fanned = fanned.merge(mapping, on="representative", how="inner")
+        fanned = fanned.sort_values("order", kind="stable").drop(columns="order").rename(columns={"original": "query"})
+        columns = ["query"] + [column for column in df.columns if column != "query"] + ["representative"]
+        return fanned[columns].reset_index(drop=True)
+
+
+def prepare_queries(queries: List[str], params: QuerySetParams = QuerySetParams(), executor: Optional[Executor] = None) -> QuerySet:
+    """Deduplicate `queries` after normalization, optionally merge near-duplicates, and optionally sample them.
+
+    With `executor`, MinHash signatures are computed for blocks of queries in parallel.
+    """
+    originals = list(dict.fromkeys(queries))
+    keys = {query: normalize_query(query) if params.normalize else query for query in originals}
+
+    # The first original query for each normalized form, and for each near-duplicate group
+    first: Dict[str, str] = {}
+    for original in originals:
+        first.setdefault(keys[original], original)
+    canonical = near_duplicates(list(first), params, executor) if params.near_duplicates else {}
+    representative = {
+        original: first[canonical.get(keys[original], keys[original])] for original in originals
+    }
+    unique = list(dict.fromkeys(representative.values()))
+
+    query_set = QuerySet(originals, representative, unique)
+    if params.sample_size is not None:
+        query_set = query_set.sample(params.sample_size, seed=params.seed)
+    return query_set
+
+
+def _blocks(items: List, size: int) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def near_duplicates(keys: List[str], params: QuerySetParams, executor: Optional[Executor] = None) -> Dict[str, str]:
+    """Map each key to the first earlier key whose shingles are at least `params.similarity` similar, or to itself.
+
+    Only keys that share a band of their MinHash signature are compared, and each key is only merged into a
+    key that is not itself merged, so groups don't chain into each other.
+    """
+    if not keys:
+        return {}
+    sets = [shingles(key, params.shingle_size) for key in keys]
+    hasher = MinHasher(params.bands * params.rows, params.seed)
+    blocks = list(_blocks(sets, SIGNATURE_BLOCK))
+    signatures = np.concatenate(list(executor.map(hasher.signatures, blocks) if executor else map(hasher.signatures, blocks)))
+    band_keys = hasher.band_keys(signatures, params.bands)
+
+    # Only keys sharing at least one band key with another key can have a near-duplicate
+    _, inverse, counts = np.unique(band_keys, return_inverse=True, return_counts=True)
+    colliding = np.flatnonzero((counts[inverse.reshape(band_keys.shape)] > 1).any(axis=1))
+
+    merged = {key: key for key in keys}
+    buckets: Dict[int, List[int]] = {}
+    for i, row in zip(colliding.tolist(), band_keys[colliding].tolist()):
+        candidates = set()
+        for band_key in row:
+            found = buckets.get(band_key)
+            if found:
+                candidates.update(found)
+        match = next((j for j in sorted(candidates) if jaccard(sets[i], sets[j]) >= params.similarity), None)
+        if match is not None:
+            merged[keys[i]] = keys[match]
+            continue
+        for band_key in row:
+            buckets.setdefault(band_key, []).append(i)
+    return merged
@@ -0,0 +1,233 @@
+import random
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from pydantic import BaseModel
+
+# Status codes that mean the engine is overloaded: back off, then retry
+THROTTLE_STATUS_CODES = (429, 503)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+T = TypeVar("T")
+
+
+class ScrapeError(Exception):
+    """A search request failed. `retryable` errors (throttling, overload, dropped connections) may succeed if retried."""
+    def __init__(self, message: str, status_code: int = None, retryable: bool = False, retry_after: float = None):
+        self.message = message
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+    @property
+    def throttled(self) -> bool:
+        return self.status_code in THROTTLE_STATUS_CODES
+
+
+class CircuitOpenError(ScrapeError):
+    """The engine failed too often in a row, so requests are held back until the circuit's reset timeout has passed."""
+
+
+class RateLimitParams(BaseModel):
+    # Requests per second to start at, and the bounds the adaptive rate stays within
+    rate: float = 10.0
+    min_rate: float = 0.5
+    max_rate: float = 1000.0
+    # Requests that may be sent back to back when the bucket is full
+    burst: int = 10
+    # AIMD: the rate grows by `increase` requests per second for every second of healthy responses, and is
+    # multiplied by `decrease` on throttling or when latency goes over `target_latency` seconds
+    increase: float = 1.0
+    decrease: float = 0.5
+    target_latency: Optional[float] = None
+    # Retries of throttled or failed requests, with exponential backoff and jitter, honouring Retry-After
+    max_retries: int = 5
+    retry_backoff: float = 0.5
+    max_backoff: float = 30.0
+    # After `failure_threshold` failed requests in a row the circuit opens for `reset_timeout` seconds,
+    # then a single probe request decides whether it closes again
+    failure_threshold: int = 10
+    reset_timeout: float = 30.0
+
+
+class AdaptiveRateLimiter:
+    """A thread-safe token bucket whose rate adapts to the engine with additive increase, multiplicative decrease."""
+
+    def __init__(self, params: RateLimitParams):
+        self.params = params
+        self.rate = params.rate
+        self.tokens = float(params.burst)
+        self.updated = time.monotonic()
+        self.decreased = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return {"params": self.params, "rate": self.rate}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["params"])
+        self.rate = state["rate"]
+
+    def scale(self, share: float) -> None:
+        """Use `share` of the rate and its bounds, e.g. for one of several worker processes scraping one engine."""
+        self.params = self.params.model_copy(update={
+            "rate": self.params.rate * share,
+            "min_rate": self.params.min_rate * share,
+            "max_rate": self.params.max_rate * share,
+            "burst": max(1, int(self.params.burst * share))
+        })
+        self.rate *= share
+
+    def acquire(self, tokens: int = 1) -> None:
+        """Block until `tokens` requests may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.params.burst, tokens), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def success(self, latency: float, tokens: int = 1) -> None:
+        if self.params.target_latency is not None and latency > self.params.target_latency:
+            self.slow_down(latency)
+            return
+        with self._lock:
+            self.rate = min(self.params.max_rate, self.rate + self.params.increase * tokens / self.rate)
+
+    def slow_down(self, latency: float = 0.0) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # Requests in flight when the engine pushed back report it too, so decrease at most once per round trip
+            if now - self.decreased < max(latency, 1 / self.rate):
+                return
+            self.decreased = now
+            self.rate = max(self.params.min_rate, self.rate * self.params.decrease)
+
+
+class CircuitBreaker:
+    """Stops requests to an engine that keeps failing, and lets one probe through after `reset_timeout`.
+
+    A probe that never reports back, e.g. because its caller raised something unexpected, stops blocking
+    other requests after another `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened: Optional[float] = None
+        self.probing = False
+        self.probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        return {"failure_threshold": self.failure_threshold, "reset_timeout": self.reset_timeout}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    @property
+    def state(self) -> str:
+        if self.opened is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened >= self.reset_timeout else "open"
+
+    def before(self) -> None:
+        """Raise `CircuitOpenError` if a request may not be sent now."""
+        with self._lock:
+            if self.opened is None:
+                return
+            now = time.monotonic()
+            remaining = self.reset_timeout - (now - self.opened)
+            if self.probing:
+                remaining = max(remaining, self.reset_timeout - (now - self.probe_started))
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"Circuit open after {self.failures} failed requests in a row",
+                    retryable=True,
+                    retry_after=remaining
+                )
+            self.probing, self.probe_started = True, now
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures, self.opened, self.probing = 0, None, False
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened, self.probing = time.monotonic(), False
+
+    def release(self) -> None:
+        """End a probe that neither succeeded nor failed in a way that says the engine is unhealthy."""
+        with self._lock:
+            self.probing = False
+
+
+class Throttle:
+    """Rate limiting, retries with backoff and a circuit breaker for the requests of one engine."""
+
+    def __init__(self, params: RateLimitParams):
+        self.params = params
+        self.limiter = AdaptiveRateLimiter(params)
+        self.breaker = CircuitBreaker(params.failure_threshold, params.reset_timeout)
+        self.retries = 0
+        self.throttled = 0
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.params.max_backoff)
+        delay = min(self.params.max_backoff, self.params.retry_backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def acquire(self, tokens: int = 1) -> None:
+        self.breaker.before()
+        self.limiter.acquire(tokens)
+
+    def success(self, latency: float, tokens: int = 1) -> None:
+        self.breaker.success()
+        self.limiter.success(latency, tokens)
+
+    def failure(self, error: ScrapeError, latency: float = 0.0) -> None:
+        if error.throttled:
+            self.throttled += 1
+            self.limiter.slow_down(latency)
+        # Errors that retrying can't fix, e.g. a bad query, say nothing about the engine's health
+        if error.retryable:
+            self.breaker.failure()
+        else:
+            self.breaker.release()
+
+    def call(self, fn: Callable[[], T], tokens: int = 1) -> T:
+        """Call `fn` once the rate limit and circuit allow it, retrying retryable `ScrapeError`s."""
+        for attempt in range(self.params.max_retries + 1):
+            try:
+                self.acquire(tokens)
+            except CircuitOpenError as e:
+                if attempt == self.params.max_retries:
+                    raise
+                time.sleep(self.backoff(attempt, e.retry_after))
+                continue
+
+            start = time.monotonic()
+            try:
+                result = fn()
+            except ScrapeError as e:
+                self.failure(e, time.monotonic() - start)
+                if not e.retryable or attempt == self.params.max_retries:
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff(attempt, e.retry_after))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.success(time.monotonic() - start, tokens)
+            return result
@@ -0,0 +1,236 @@
+import contextlib
+import html
+import os
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.aggregate import label_counts
+from objective_evaluator.compare import COMPARISON_COLUMNS
+from objective_evaluator.results import COLUMNS, LABELS, EvalResults
+
+DF_STYLE = [
+                {'selector': 'th', 'props': [('background-color', '#f2f2f2'), ('color', 'black'), ('font-weight', 'bold')]},
+                {'selector': 'td', 'props': [('border', '1px solid #ddd'), ('padding', '8px')]},
+                {'selector': 'tr:nth-of-type(even)', 'props': [('background-color', '#f9f9f9')]},
+            ]
+
+HTML_TEMPLATE = """
+    <html>
+    <head>
+        <style>
+            body {{ font-family: Arial, sans-serif; }}
+            table {{ border-collapse: collapse; width: 100%; }}
+            th, td {{ text-align: left; padding: 8px; }}
+            th {{ background-color: #f2f2f2; }}
+        </style>
+    </head>
+    <body>
+        <h1><svg class="text-primary fill-current h-5 w-auto" width="93" height="30" viewBox="0 0 93 30" fill="none" xmlns="http://www.w3.org/2000/svg"><rect x="31.8769" width="29.9999" height="29.9999" fill="currentColor"></rect><path d="M92.8086 30L62.8087 30L92.8086 8.01086e-05L92.8086 30Z" fill="currentColor"></path><ellipse cx="15" cy="15" rx="15" ry="15" fill="currentColor"></ellipse></svg>&nbsp;&nbsp;{title}</h1>
+        {df_html}
+    </body>
+    </html>
+    """
+
+
+def style_css(style: List[dict]) -> str:
+    """`DF_STYLE` table styles as a CSS block."""
+    rules = (
+        f"{rule['selector']} {{ {' '.join(f'{name}: {value};' for name, value in rule['props'])} }}"
+        for rule in style
+    )
+    return "<style>" + " ".join(rules) + "</style>"
+
+
+class HTMLReportWriter:
+    """Writes an HTML report to disk a row at a time, so memory stays flat and time grows linearly with rows.
+
+    `save_to_path` is a lightweight index page with the summary and links to the results, which are split
+    by query into pages of at most `queries_per_page` queries in a `<name>_pages` directory next to it.
+    Only the rows of one page are in memory at once.
+    """
+
+    def __init__(self, save_to_path: str, queries_per_page: int = 100):
+        self.save_to_path = save_to_path
+        self.queries_per_page = queries_per_page
+        stem = os.path.splitext(save_to_path)[0]
+        self.pages_dir = stem + "_pages"
+        self.pages_link = os.path.basename(self.pages_dir)
+
+    def write_results(self, results: List[EvalResults], latency: Optional[pd.DataFrame] = None) -> None:
+        """Report every judgement of each of `results`, with a summary section per evaluation on the index page.
+
+        `latency` is a table of search latency percentiles per engine (see `Instrumentation.latency_df`) to show first.
+        """
+        os.makedirs(self.pages_dir, exist_ok=True)
+        title = "Evaluation Results - " + ", ".join(r.name for r in results)
+        with self.page(self.save_to_path, title) as index:
+            if latency is not None and len(latency):
+                self.write_latency(index, latency)
+            for r in results:
+                counts = label_counts(r)
+                totals, total = counts.totals, counts.total
+                index.write(f"<h2>{html.escape(r.name)}</h2><h3>Summary</h3><table>")
+                index.write("<tr><th>Label</th><th>Count</th><th>Percentage</th></tr>")
+                for label in LABELS:
+                    count = totals[label]
+                    percentage = (count / total) * 100 if total > 0 else 0
+                    index.write(f"<tr><td>{label}</td><td>{count}</td><td>{percentage:.2f}%</td></tr>")
+                index.write("</table>")
+                if r.changes is not None:
+                    self.write_changes(index, r.changes)
+
+                pages = list(self.query_pages(r.queries))
+                self.write_links(index, r.name, pages)
+                query_rows = r.query_rows()
+                for number, (first, last) in enumerate(pages, 1):
+                    rows = np.concatenate(query_rows[first:last]) if last > first else np.empty(0, dtype=np.int64)
+                    with self.page(self.page_path(r.name, number), f"{r.name} - page {number} of {len(pages)}") as f:
+                        self.write_nav(f, r.name, number, len(pages))
+                        self.write_table(f, COLUMNS, self.result_rows(r, rows))
+
+    def write_comparison(
+        self,
+        results: List[EvalResults],
+        significance: Optional[pd.DataFrame] = None,
+        latency: Optional[pd.DataFrame] = None
+    ) -> None:
+        """Report `results` side by side, joined on query and position, with a summary table on the index page.
+
+        `significance` is a table of `PairedComparison` rows (see `objective_evaluator.significance`) to show
+        under the summary, and `latency` a table of search latency percentiles as for `write_results`.
+        """
+        os.makedirs(self.pages_dir, exist_ok=True)
+        with self.page(self.save_to_path, "Evaluation Comparison") as index:
+            index.write("<h2>Summary Comparison</h2><table>")
+            index.write("<tr><th>Eval Name</th><th>GREAT</th><th>OK</th><th>BAD</th><th>Total</th></tr>")
+            for r in results:
+                counts = label_counts(r)
+                totals, total = counts.totals, counts.total
+                cells = "".join(
+                    f"<td>{totals[label]} ({totals[label] / total * 100 if total else 0:.2f}%)</td>"
+                    for label in LABELS
+                )
+                index.write(f"<tr><td>{html.escape(r.name)}</td>{cells}<td>{total}</td></tr>")
+            index.write("</table>")
+            if significance is not None and len(significance):
+                self.write_significance(index, significance)
+            if latency is not None and len(latency):
+                self.write_latency(index, latency)
+            for r in results:
+                if r.changes is not None:
+                    self.write_changes(index, r.changes, f"{r.name}: Changes Since the Previous Run")
+
+            queries = sorted(set().union(*(r.queries for r in results)))
+            lookups = [dict(zip(r.queries, r.query_rows())) for r in results]
+            pages = list(self.query_pages(queries))
+            self.write_links(index, "comparison", pages, queries)
+
+            columns = ["query", "position"] + [f"{r.name}_{column}" for r in results for column in COMPARISON_COLUMNS]
+            empty = np.empty(0, dtype=np.int64)
+            for number, (first, last) in enumerate(pages, 1):
+                page_queries = queries[first:last]
+                # For each evaluation, map (query, position) to its cells for the queries on this page
+                cells, positions = [], {query: set() for query in page_queries}
+                for r, lookup in zip(results, lookups):
+                    rows = np.concatenate([lookup.get(query, empty) for query in page_queries] or [empty])
+                    evaluation = {}
+                    for query, position, *values in self.result_rows(r, rows, ["query", "position"] + COMPARISON_COLUMNS):
+                        evaluation[query, position] = values
+                        positions[query].add(position)
+                    cells.append(evaluation)
+
+                def comparison_rows() -> Iterator[list]:
+                    for query in page_queries:
+                        for position in sorted(positions[query]):
+                            row = [query, position]
+                            for evaluation in cells:
+                                row.extend(evaluation.get((query, position), [""] * len(COMPARISON_COLUMNS)))
+                            yield row
+
+                with self.page(self.page_path("comparison", number), f"Evaluation Comparison - page {number} of {len(pages)}") as f:
+                    self.write_nav(f, "comparison", number, len(pages))
+                    self.write_table(f, columns, comparison_rows())
+
+    def write_significance(self, f: TextIO, significance: pd.DataFrame) -> None:
+        f.write(f"<h3>Significance vs {html.escape(str(significance['baseline'].iloc[0]))}</h3><table>")
+        f.write(
+            "<tr><th>Metric</th><th>Eval Name</th><th>Queries</th><th>Baseline</th><th>Eval</th><th>Difference</th>"
+            "<th>Randomization p</th><th>Wilcoxon p</th><th>Sign test p</th></tr>"
+        )
+        for row in significance.itertuples():
+            f.write(
+                f"<tr><td>{html.escape(row.metric)}</td><td>{html.escape(row.candidate)}</td><td>{row.queries}</td>"
+                f"<td>{row.baseline_mean:.4f}</td><td>{row.candidate_mean:.4f}</td>"
+                f"<td>{row.difference:+.4f} ({row.confidence:.0%} CI {row.ci_low:+.4f} to {row.ci_high:+.4f})</td>"
+                f"<td>{row.randomization_p:.4f}</td><td>{row.wilcoxon_p:.4f}</td><td>{row.sign_test_p:.4f}</td></tr>"
+            )
+        f.write("</table>")
+
+    def write_latency(self, f: TextIO, latency: pd.DataFrame) -> None:
+        f.write("<h3>Search Latency (ms)</h3><table>")
+        f.write("<tr><th>Engine</th><th>Measurement</th><th>Count</th><th>p50</th><th>p95</th><th>p99</th><th>Max</th></tr>")
+        for row in latency.itertuples():
+            cells = "".join(f"<td>{value * 1000:.1f}</td>" for value in (row.p50, row.p95, row.p99, row.max))
+            f.write(f"<tr><td>{html.escape(str(row.engine))}</td><td>{html.escape(row.name)}</td><td>{row.count}</td>{cells}</tr>")
+        f.write("</table>")
+
+    def write_changes(self, f: TextIO, changes: dict, title: str = "Changes Since the Previous Run") -> None:
+        """The queries an incremental run re-evaluated because their hits changed, see `objective_evaluator.incremental`."""
+        f.write(
+            f"<h3>{html.escape(title)}</h3><p>{len(changes['changed'])} changed, {len(changes['added'])} added, "
+            f"{len(changes['removed'])} removed, {changes['unchanged']} unchanged (judgements carried forward)</p>"
+        )
+        f.write("<table><tr><th>Query</th><th>Change</th></tr>")
+        for change in ("changed", "added", "removed"):
+            for query in changes[change]:
+                f.write(f"<tr><td>{html.escape(query)}</td><td>{change}</td></tr>")
+        f.write("</table>")
+
+    def result_rows(self, results: EvalResults, rows: np.ndarray, columns: List[str] = COLUMNS) -> Iterator[list]:
+        values = [results.column(column, rows) for column in columns]
+        return (list(row) for row in zip(*values))
+
+    def query_pages(self, queries: List[str]) -> Iterator[Tuple[int, int]]:
+        for first in range(0, len(queries), self.queries_per_page):
+            yield first, min(first + self.queries_per_page, len(queries))
+
+    def page_path(self, name: str, number: int) -> str:
+        return os.path.join(self.pages_dir, f"{name}-{number:04d}.html")
+
+    def page_link(self, name: str, number: int) -> str:
+        return f"{self.pages_link}/{name}-{number:04d}.html"
+
+    @contextlib.contextmanager
+    def page(self, path: str, title: str) -> Iterator[TextIO]:
+        """Open a page for writing between the template's header and footer."""
+        header, footer = HTML_TEMPLATE.format(title=html.escape(title), df_html="\0").split("\0")
+        with open(path, "w") as f:
+            f.write(header.replace("</head>", style_css(DF_STYLE) + "</head>", 1))
+            yield f
+            f.write(footer)
+
+    def write_links(self, f: TextIO, name: str, pages: List[Tuple[int, int]], queries: List[str] = None) -> None:
+        f.write(f"<h3>Results ({len(pages)} pages)</h3><ul>")
+        for number, (first, last) in enumerate(pages, 1):
+            label = f"Page {number}: queries {first + 1}-{last}"
+            if queries is not None:
+                label += f" ({html.escape(queries[first])} &hellip; {html.escape(queries[last - 1])})"
+            f.write(f'<li><a href="{html.escape(self.page_link(name, number))}">{label}</a></li>')
+        f.write("</ul>")
+
+    def write_nav(self, f: TextIO, name: str, number: int, pages: int) -> None:
+        links = [f'<a href="../{html.escape(os.path.basename(self.save_to_path))}">Index</a>']
+        if number > 1:
+            links.append(f'<a href="{html.escape(os.path.basename(self.page_path(name, number - 1)))}">Previous</a>')
+        if number < pages:
+            links.append(f'<a href="{html.escape(os.path.basename(self.page_path(name, number + 1)))}">Next</a>')
+        f.write("<p>" + " | ".join(links) + "</p>")
+
+    def write_table(self, f: TextIO, columns: List[str], rows: Iterator[list]) -> None:
+        f.write("<table><thead><tr>" + "".join(f"<th>{html.escape(column)}</th>" for column in columns) + "</tr></thead><tbody>")
+        for row in rows:
+            f.write("<tr>" + "".join(f"<td>{html.escape(str(value))}</td>" for value in row) + "</tr>\n")
+        f.write("</tbody></table>")
+
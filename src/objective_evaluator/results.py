@@ -0,0 +1,265 @@
+import contextlib
+import json
+import mmap
+import os
+import shutil
+from collections.abc import Sequence
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from objective_evaluator.compact import DOC_KEY, DOCUMENTS_KEY
+from objective_evaluator.instrumentation import LOAD, LOAD_CACHE, Instrumentation
+
+LABELS = ["GREAT", "OK", "BAD"]
+COLUMNS = ["query", "position", "object_id", "object", "score", "label", "explanation"]
+# Columns that are large per row. The columnar cache keeps them in separate files and reads them only on request.
+WIDE_COLUMNS = ["object", "explanation"]
+CACHE_VERSION = 3
+
+
+def judgements_to_df(judgements: List[dict], documents: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """Build the results DataFrame column by column.
+
+    `position` is the 1-based rank of each judgement among the judgements for its query, in file order,
+    even when a query's judgements are not contiguous. `query` and `label` are categorical, and `object`
+    is the object as a JSON string. With `documents`, from a compact `_eval.json` file, judgements refer
+    to their object by id, so each object is serialized once and rows with the same object share the string.
+    """
+    queries = list(map(itemgetter("query"), judgements))
+    details = list(map(itemgetter("judgement"), judgements))
+    objects = np.empty(len(judgements), dtype=object)
+    if documents is None:
+        objects[:] = list(map(json.dumps, map(itemgetter("object"), judgements)))
+    else:
+        shared = {doc: json.dumps(obj) for doc, obj in documents.items()}
+        objects[:] = [shared[doc] for doc in map(itemgetter(DOC_KEY), judgements)]
+
+    labels = list(map(itemgetter("label"), details))
+    extra = sorted(set(labels).difference(LABELS))
+
+    df = pd.DataFrame({
+        "query": pd.Categorical(queries),
+        "position": np.zeros(len(judgements), dtype=np.int64),
+        "object_id": list(map(itemgetter("object_id"), judgements)),
+        "object": objects,
+        "score": list(map(itemgetter("score"), details)),
+        "label": pd.Categorical(labels, categories=LABELS + extra),
+        "explanation": list(map(itemgetter("explanation"), details))
+    }, columns=COLUMNS)
+    df["position"] = df.groupby("query", observed=True, sort=False).cumcount().to_numpy() + 1
+    return df
+
+
+def load_eval_df(path: str) -> pd.DataFrame:
+    """Load the judgements in an `_eval.json` file into a DataFrame, see `judgements_to_df`."""
+    with open(path, 'r') as file:
+        data = json.load(file)
+    return judgements_to_df(data.get('judgements', []), data.get(DOCUMENTS_KEY))
+
+
+class EvalResults:
+    """A lazily loaded `_eval.json` file, backed by a columnar cache in a `.columns` directory next to it.
+
+    The cache is built the first time the results are read and rebuilt whenever the `_eval.json` file
+    changes. Narrow columns are NumPy arrays that are memory-mapped. Each wide column (`object`,
+    `explanation`) is stored as one JSON value per line plus an array of line offsets. It is read only
+    when it is asked for, either whole or for a range of rows.
+    """
+
+    def __init__(self, path: str, instrumentation: Optional[Instrumentation] = None):
+        self.path = path
+        self.name = path.split("/")[-1].replace("_eval.json", "")
+        # Where the time spent building the cache and loading DataFrames is recorded, if anywhere
+        self.instrumentation = instrumentation
+        self.cache_dir = (path[:-len(".json")] if path.endswith(".json") else path) + ".columns"
+        self._meta: Optional[dict] = None
+        self._computed: Dict[str, Any] = {}
+        self._computed_for: Optional[dict] = None
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def __repr__(self) -> str:
+        return f"EvalResults({self.path!r})"
+
+    @property
+    def meta(self) -> dict:
+        if self._meta is None or not self._fresh(self._meta):
+            self._meta = self._read_meta()
+            if self._meta is None or not self._fresh(self._meta):
+                with self._span(LOAD_CACHE):
+                    self._meta = self.build_cache()
+        return self._meta
+
+    def _span(self, name: str):
+        if self.instrumentation is None:
+            return contextlib.nullcontext()
+        return self.instrumentation.span(name, engine=self.name)
+
+    @property
+    def queries(self) -> List[str]:
+        return self.meta["queries"]
+
+    @property
+    def labels(self) -> List[str]:
+        return self.meta["labels"]
+
+    @property
+    def changes(self) -> Optional[dict]:
+        """For an incremental run, the queries whose hits changed since the previous run, see `objective_evaluator.incremental`."""
+        return self.meta["changes"]
+
+    def cached(self, key: str, compute: Callable[["EvalResults"], Any]) -> Any:
+        """`compute(self)`, remembered under `key` until the `_eval.json` file changes."""
+        meta = self.meta
+        if self._computed_for is not meta:
+            self._computed, self._computed_for = {}, meta
+        if key not in self._computed:
+            self._computed[key] = compute(self)
+        return self._computed[key]
+
+    def load(self, columns: Optional[Iterable[str]] = None, rows=None) -> pd.DataFrame:
+        """Load `columns` (all by default) for `rows` (all by default) into a DataFrame named after the results."""
+        columns = COLUMNS if columns is None else list(columns)
+        with self._span(LOAD):
+            df = pd.DataFrame({name: self.column(name, rows) for name in columns}, columns=columns, copy=False)
+        df.Name = self.name
+        return df
+
+    def column(self, name: str, rows=None):
+        """One column as an array, or a list of values for the wide columns. `rows` is a slice or an array of row numbers."""
+        if name not in COLUMNS:
+            raise ValueError(f"Unknown column {name!r}. Expected one of {COLUMNS}.")
+        meta = self.meta
+        rows = slice(None) if rows is None else rows
+        if name in WIDE_COLUMNS:
+            values = self.read_wide(name, rows)
+            if name == "object":
+                # Stored as the JSON string the column holds, so it is returned without being parsed
+                array = np.empty(len(values), dtype=object)
+                array[:] = values
+                return array
+            return [json.loads(text) for text in values]
+
+        array = np.load(os.path.join(self.cache_dir, f"{name}.npy"), mmap_mode="r")[rows]
+        if name == "query":
+            return pd.Categorical.from_codes(array, categories=meta["queries"])
+        if name == "label":
+            return pd.Categorical.from_codes(array, categories=meta["labels"])
+        if name == "object_id":
+            return array.astype(object)
+        return array
+
+    def read_wide(self, name: str, rows) -> List[str]:
+        """The raw JSON text of a wide column for `rows`, a slice or an array of row numbers."""
+        index_path = os.path.join(self.cache_dir, f"{name}.index.npy")
+        if os.path.exists(index_path):
+            rows = np.load(index_path, mmap_mode="r")[rows]
+        offsets = np.load(os.path.join(self.cache_dir, f"{name}.offsets.npy"), mmap_mode="r")
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(offsets) - 1)
+            if start >= stop:
+                return []
+            with open(os.path.join(self.cache_dir, f"{name}.jsonl"), "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    lines = data[offsets[start]:offsets[stop] - 1].decode().split("\n")
+            return lines[::step]
+
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return []
+        starts, ends = offsets[rows], offsets[rows + 1] - 1
+        with open(os.path.join(self.cache_dir, f"{name}.jsonl"), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return [data[start:end].decode() for start, end in zip(starts, ends)]
+
+    def query_rows(self) -> List[np.ndarray]:
+        """Row numbers for each query, indexed like `queries`, in file order."""
+        codes = np.load(os.path.join(self.cache_dir, "query.npy"), mmap_mode="r") if len(self) else np.empty(0, dtype=np.int8)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(self.queries) + 1))
+        return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def build_cache(self) -> dict:
+        """(Re)build the columnar cache from the `_eval.json` file and return its metadata."""
+        stat = os.stat(self.path)
+        with open(self.path) as f:
+            data = json.load(f)
+        df = judgements_to_df(data.pop("judgements", []), data.pop(DOCUMENTS_KEY, None))
+
+        tmp_dir = self.cache_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, "query.npy"), df["query"].cat.codes.to_numpy())
+        np.save(os.path.join(tmp_dir, "position.npy"), df["position"].to_numpy())
+        np.save(os.path.join(tmp_dir, "object_id.npy"), df["object_id"].to_numpy(dtype=str))
+        np.save(os.path.join(tmp_dir, "score.npy"), pd.to_numeric(df["score"]).to_numpy())
+        np.save(os.path.join(tmp_dir, "label.npy"), df["label"].cat.codes.to_numpy())
+        self._write_wide(tmp_dir, "object", df["object"], dedup=True)
+        self._write_wide(tmp_dir, "explanation", map(json.dumps, df["explanation"]))
+
+        meta = {
+            "version": CACHE_VERSION,
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "rows": len(df),
+            "queries": list(df["query"].cat.categories),
+            "labels": list(df["label"].cat.categories),
+            "changes": data.get("changes")
+        }
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.cache_dir)
+        return meta
+
+    def _write_wide(self, directory: str, name: str, values: Iterable[str], dedup: bool = False) -> None:
+        """Write a wide column. With `dedup`, each distinct value is written once and `<name>.index.npy` maps rows to lines."""
+        offsets, lines, index = [0], {}, []
+        with open(os.path.join(directory, f"{name}.jsonl"), "wb") as f:
+            for value in values:
+                if dedup:
+                    line_number = lines.setdefault(value, len(lines))
+                    index.append(line_number)
+                    if line_number < len(offsets) - 1:
+                        continue
+                line = value.encode() + b"\n"
+                f.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(directory, f"{name}.offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        if dedup:
+            np.save(os.path.join(directory, f"{name}.index.npy"), np.asarray(index, dtype=np.int64))
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.cache_dir, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fresh(self, meta: dict) -> bool:
+        stat = os.stat(self.path)
+        return (
+            meta.get("version") == CACHE_VERSION
+            and meta.get("source_size") == stat.st_size
+            and meta.get("source_mtime_ns") == stat.st_mtime_ns
+        )
+
+
+class LazyFrames(Sequence):
+    """A read-only list of DataFrames that loads each one from its `EvalResults` when it is accessed."""
+
+    def __init__(self, results: List[EvalResults]):
+        self.results = results
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyFrames(self.results[index])
+        return self.results[index].load()
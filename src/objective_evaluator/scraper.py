@@ -1,23 +1,171 @@
+import itertools
 import json
-from typing import List
-from pydantic import BaseModel, RootModel, model_validator
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+from pydantic import BaseModel, PrivateAttr, RootModel, TypeAdapter, model_validator
 from pydantic.dataclasses import dataclass
 
+from objective_evaluator.cache import ResponseCache, cache_key
+from objective_evaluator.compact import compact_lines, expand_records, is_compact, project
+from objective_evaluator.instrumentation import ENGINE_TOOK, SEARCH_LATENCY, Instrumentation
+from objective_evaluator.ratelimit import RateLimitParams, Throttle
+
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 
 class ScrapeParams(BaseModel):
     limit: int
     scrape_id: str
+    # Split the queries across this many workers of the evaluator's scrape executor, see `objective_evaluator.partition`
+    max_workers: int = 1
+    # Cap on requests in flight to this engine across all workers. Each worker gets an equal share, at least one.
+    max_concurrency: Optional[int] = None
+    # Adaptive rate limiting, retries and a circuit breaker for this engine's requests, see `Throttle`
+    rate_limit: Optional[RateLimitParams] = None
+    # Keep only these fields of each result object, e.g. ["title", "brand.name"], see `compact.project`
+    fields: Optional[List[str]] = None
+    # Write the scrape file in the compact format: each distinct document once, and a list of document ids per query
+    compact: bool = False
 
 class BaseScraper(BaseModel):
     params: ScrapeParams
+    _throttle: Optional[Throttle] = PrivateAttr(default=None)
+    _instrumentation: Optional[Instrumentation] = PrivateAttr(default=None)
 
     def __init__(self, params: ScrapeParams):
         super().__init__(params=params)
+        if params.rate_limit is not None:
+            self._throttle = Throttle(params.rate_limit)
+
+    def scrape(
+        self,
+        queries: List[str],
+        save_to_path: str,
+        resume: bool = False,
+        cache: Optional[ResponseCache] = None,
+        on_results: Optional[Callable[[str, List["SearchResultItem"]], None]] = None,
+        compact: Optional[bool] = None
+    ) -> None:
+        """Scrape `queries` into `save_to_path`.
 
-    def scrape(self, queries: List[str], save_to_path: str) -> None:
+        With `resume`, queries finished by an earlier, interrupted scrape are skipped. With `cache`, responses
+        for queries this engine configuration has already answered are read from the cache instead of the engine.
+        `on_results(query, items)` is called once per unique query as its results are saved, including
+        queries restored from the checkpoint when resuming. `compact` overrides `params.compact`.
+        """
+        checkpoint = ScrapeCheckpoint(save_to_path, resume)
+        with checkpoint:
+            unique = list(dict.fromkeys(queries))
+            if on_results is not None:
+                for query in unique:
+                    if query in checkpoint.done:
+                        on_results(query, checkpoint.read(query))
+            remaining = [query for query in unique if query not in checkpoint.done]
+            results = self.search_cached(remaining, cache) if cache is not None else self.search_many(remaining)
+            for query, items in results:
+                if self.params.fields is not None:
+                    items = [SearchResultItem(query=item.query, object=project(item.object, self.params.fields)) for item in items]
+                checkpoint.commit(query, items)
+                if on_results is not None:
+                    on_results(query, items)
+            checkpoint.merge(queries, save_to_path, self.params.compact if compact is None else compact)
+        checkpoint.remove()
+
+    def search(self, query: str) -> List["SearchResultItem"]:
         raise NotImplementedError("Subclass must implement abstract method")
 
+    @property
+    def throttle(self) -> Optional[Throttle]:
+        """The engine's rate limiter, retry policy and circuit breaker, when `rate_limit` is set."""
+        return self._throttle
+
+    @property
+    def instrumentation(self) -> Optional[Instrumentation]:
+        """Where search latencies are recorded, see `instrument`."""
+        return self._instrumentation
+
+    def instrument(self, instrumentation: Optional[Instrumentation]) -> None:
+        """Record the latency of each search request in `instrumentation`, tagged with this scraper's `scrape_id`."""
+        self._instrumentation = instrumentation
+
+    def observe(self, name: str, value: float) -> None:
+        if self._instrumentation is not None:
+            self._instrumentation.observe(name, value, engine=self.params.scrape_id)
+
+    def observe_took(self, milliseconds: Optional[float]) -> None:
+        """Record the engine's own processing time for a search, where it reports one."""
+        if milliseconds is not None:
+            self.observe(ENGINE_TOOK, milliseconds / 1000)
+
+    def request(self, send: Callable[[], T], tokens: int = 1) -> T:
+        """Send a request to the engine through `throttle`, if any. `send` raises `ScrapeError` when the request fails.
+
+        `tokens` is the number of searches the request carries, e.g. the size of a batch. The latency of each
+        successful attempt is recorded as `search.latency`.
+        """
+        def timed() -> T:
+            start = time.perf_counter()
+            result = send()
+            self.observe(SEARCH_LATENCY, time.perf_counter() - start)
+            return result
+
+        return timed() if self._throttle is None else self._throttle.call(timed, tokens)
+
+    def share_state(self, scraper: "BaseScraper") -> "BaseScraper":
+        """Give `scraper`, a copy of this one, the same `throttle` and `instrumentation`."""
+        scraper._throttle = self._throttle
+        scraper._instrumentation = self._instrumentation
+        return scraper
+
+    @property
+    def concurrency(self) -> int:
+        """Requests this scraper keeps in flight at once."""
+        return 1
+
+    def with_concurrency(self, concurrency: int) -> "BaseScraper":
+        """A scraper for the same engine that keeps at most `concurrency` requests in flight. Override along with `concurrency`.
+
+        The copy should share this scraper's `throttle`, so the engine's rate limit holds across copies, and its
+        `instrumentation`. See `share_state`.
+        """
+        return self
+
+    def search_many(self, queries: Iterable[str]) -> Iterator[Tuple[str, List["SearchResultItem"]]]:
+        """Yield (query, results) pairs in query order. Override to search several queries at once."""
+        for query in queries:
+            yield query, self.search(query)
+
+    def search_config(self, query: str) -> dict:
+        """Everything that determines the engine's response to `query`. Override to leave out credentials and tuning knobs."""
+        return {**self.params.model_dump(exclude={"scrape_id"}), "query": query}
+
+    def cache_key(self, query: str) -> str:
+        return cache_key(type(self).__name__, self.search_config(query))
+
+    def search_cached(self, queries: List[str], cache: ResponseCache) -> Iterator[Tuple[str, List["SearchResultItem"]]]:
+        """Like `search_many`, but only queries missing from `cache` reach the engine."""
+        keys = {query: self.cache_key(query) for query in queries}
+        cached = cache.lookup(keys.values())
+        fetched = self.search_many(query for query in queries if keys[query] not in cached)
+
+        for query in queries:
+            key = keys[query]
+            objects = cache.get(key) if key in cached else None
+            if objects is not None:
+                yield query, [SearchResultItem(query=query, object=obj) for obj in objects]
+                continue
+
+            # Entries can expire or be evicted between the lookup and here
+            items = self.search(query) if key in cached else next(fetched)[1]
+            cache.put(key, [item.object for item in items])
+            yield query, items
+
 
 @dataclass
 class SearchResultItem:
@@ -31,14 +179,170 @@ class SearchResults:
         return RootModel[List[SearchResultItem]](self.items).model_dump_json(indent=4)
 
 
+SEARCH_RESULT_ITEM = TypeAdapter(SearchResultItem)
+NDJSON_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+class SearchResultsWriter:
+    """Writes search results to disk as they arrive, so memory stays flat however many queries are scraped.
+
+    Paths ending in `.jsonl` or `.ndjson` get one JSON object per line, flushed after every write, so a
+    crash only loses the results that were in flight. Other paths get a JSON array, as `SearchResults.to_json` does.
+    `compact` files are NDJSON in the format described in `objective_evaluator.compact`, whatever the path.
+    """
+
+    def __init__(self, path: str, compact: bool = False):
+        self.path = path
+        self.compact = compact
+        self.ndjson = compact or path.endswith(NDJSON_EXTENSIONS)
+        self._file = None
+        self._first = True
+        self._written = set()
+
+    def __enter__(self):
+        self._file = open(self.path, "wb")
+        if not self.ndjson:
+            self._file.write(b"[")
+        return self
+
+    def __exit__(self, *exc):
+        if not self.ndjson:
+            self._file.write(b"\n]")
+        self._file.close()
+
+    def write(self, items: Iterable[SearchResultItem]) -> None:
+        if self.compact:
+            self._write_compact((item.query, item.object) for item in items)
+            return
+        for item in items:
+            line = SEARCH_RESULT_ITEM.dump_json(item)
+            if self.ndjson:
+                self._file.write(line + b"\n")
+            else:
+                self._file.write((b"\n" if self._first else b",\n") + line)
+            self._first = False
+        self._file.flush()
+
+    def write_lines(self, data: bytes) -> None:
+        """Write results that are already serialized as NDJSON."""
+        if self.compact:
+            self._write_compact((record["query"], record["object"]) for record in map(json.loads, data.splitlines()))
+        elif self.ndjson:
+            self._file.write(data)
+        else:
+            for line in data.splitlines():
+                self._file.write((b"\n" if self._first else b",\n") + line)
+                self._first = False
+        self._file.flush()
+
+    def _write_compact(self, results: Iterable[Tuple[str, Any]]) -> None:
+        for query, group in itertools.groupby(results, key=itemgetter(0)):
+            self._file.write(compact_lines(query, (obj for _, obj in group), self._written))
+        self._file.flush()
+
+
+class ScrapeCheckpoint:
+    """Records which queries of a scrape are done, so an interrupted scrape can pick up where it stopped.
+
+    Results are appended to `<save_to_path>.partial` as NDJSON, in completion order. Once a query's results
+    are flushed, its byte range in that file is recorded in `<save_to_path>.checkpoint`. `merge` then writes
+    the final file in query order from those ranges.
+    """
+
+    def __init__(self, save_to_path: str, resume: bool = False):
+        self.partial_path = save_to_path + ".partial"
+        self.checkpoint_path = save_to_path + ".checkpoint"
+        self.resume = resume
+        self.done: Dict[str, Tuple[int, int]] = {}
+        self._partial = None
+        self._checkpoint = None
+
+    def __enter__(self):
+        if self.resume and os.path.exists(self.checkpoint_path) and os.path.exists(self.partial_path):
+            with open(self.checkpoint_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be torn if the previous run died while writing it
+                        break
+                    self.done[entry["query"]] = (entry["offset"], entry["length"])
+            # Drop results written after the last recorded query; they will be fetched again
+            end = max((offset + length for offset, length in self.done.values()), default=0)
+            self._partial = open(self.partial_path, "r+b")
+            self._partial.truncate(end)
+            self._partial.seek(end)
+        else:
+            self._partial = open(self.partial_path, "wb")
+
+        self._checkpoint = open(self.checkpoint_path, "wb")
+        for query, (offset, length) in self.done.items():
+            self._record(query, offset, length)
+        self._checkpoint.flush()
+        return self
+
+    def __exit__(self, *exc):
+        self._partial.close()
+        self._checkpoint.close()
+
+    def commit(self, query: str, items: List[SearchResultItem]) -> None:
+        offset = self._partial.tell()
+        self._partial.write(b"".join(SEARCH_RESULT_ITEM.dump_json(item) + b"\n" for item in items))
+        self._partial.flush()
+        length = self._partial.tell() - offset
+        self._record(query, offset, length)
+        self._checkpoint.flush()
+        self.done[query] = (offset, length)
+
+    def read(self, query: str) -> List[SearchResultItem]:
+        offset, length = self.done[query]
+        with open(self.partial_path, "rb") as partial:
+            partial.seek(offset)
+            return [SEARCH_RESULT_ITEM.validate_json(line) for line in partial.read(length).splitlines()]
 
+    def merge(self, queries: List[str], save_to_path: str, compact: bool = False) -> None:
+        self._partial.flush()
+        with open(self.partial_path, "rb") as partial, SearchResultsWriter(save_to_path, compact) as writer:
+            for query in queries:
+                offset, length = self.done[query]
+                partial.seek(offset)
+                writer.write_lines(partial.read(length))
 
+    def remove(self) -> None:
+        os.remove(self.partial_path)
+        os.remove(self.checkpoint_path)
 
+    def _record(self, query: str, offset: int, length: int) -> None:
+        self._checkpoint.write(json.dumps({"query": query, "offset": offset, "length": length}).encode() + b"\n")
 
 
+def read_search_results(path: str) -> Iterator[dict]:
+    """Yield {"query", "object"} dicts from a scrape file written as NDJSON, as a JSON array, or in the compact format."""
+    with open(path, "r") as f:
+        start = f.read(1)
+        while start.isspace():
+            start = f.read(1)
+        f.seek(0)
+        if start == "[":
+            yield from json.load(f)
+            return
+        records = (json.loads(line) for line in f if line.strip())
+        first = next(records, None)
+        if first is None:
+            return
+        records = itertools.chain([first], records)
+        yield from expand_records(records) if is_compact(first) else records
 
 
-    
+def ordered_map(executor: Executor, fn: Callable[[T], R], items: Iterable[T], window: int) -> Iterator[R]:
+    """Like executor.map, but keeps at most `window` tasks in flight and yields results in input order."""
+    pending = deque()
+    for item in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
 
 
 # def to_json(data: SearchResults):
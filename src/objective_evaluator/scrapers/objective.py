@@ -1,32 +1,226 @@
-from typing import List
-from objective import Objective
-from objective_evaluator.scraper import BaseScraper, ScrapeParams, SearchResults, SearchResultItem
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+from objective import APIConnectionError, APIStatusError, AsyncObjective, Objective
+from pydantic import PrivateAttr
+from objective_evaluator.instrumentation import SEARCH_LATENCY
+from objective_evaluator.ratelimit import RETRYABLE_STATUS_CODES, CircuitOpenError, ScrapeError
+from objective_evaluator.scraper import BaseScraper, ScrapeParams, SearchResultItem
+from objective_evaluator.tracker import retry_after
 
 class ObjectiveScrapeParams(ScrapeParams):
     api_key: str
     index_id: str
     object_fields: str
+    # Defaults to the SDK's API URL
+    base_url: Optional[str] = None
+    # Searches in flight at once. Above 1, searches run concurrently on an async client that is kept
+    # for the scraper's lifetime, see `ObjectiveScraper.search_many_async`.
+    concurrency: int = 1
+    # Retries of each failed search, by the SDK with its backoff, or by the scraper's `throttle` when `rate_limit` is set
+    max_retries: int = 3
+
+class ObjectiveClients:
+    """The clients and event loop of an `ObjectiveScraper`, created on first use and shared with its copies."""
+
+    def __init__(self):
+        self.client: Optional[Objective] = None
+        self.async_client: Optional[AsyncObjective] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        with self.lock:
+            client, async_client, loop = self.client, self.async_client, self.loop
+            self.client = self.async_client = self.loop = None
+        if client is not None:
+            client.close()
+        if loop is not None:
+            if async_client is not None:
+                asyncio.run_coroutine_threadsafe(async_client.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
 
 class ObjectiveScraper(BaseScraper):
+    _clients: ObjectiveClients = PrivateAttr(default_factory=ObjectiveClients)
+
     def __init__(self, params: ObjectiveScrapeParams):
         super().__init__(params=params)
         self.params = params
-    
-    def scrape(self, queries: List[str], save_to_path: str) -> None:
-        results = SearchResults(items=[])
-        client = Objective(api_key=self.params.api_key)
 
+    def __getstate__(self):
+        # Clients and the event loop stay behind; a copy in another process opens its own
+        state = super().__getstate__()
+        return {**state, "__pydantic_private__": {**state["__pydantic_private__"], "_clients": None}}
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._clients = ObjectiveClients()
+
+    def search(self, query: str) -> List[SearchResultItem]:
+        return list(self.search_many([query]))[0][1]
+
+    @property
+    def concurrency(self) -> int:
+        return self.params.concurrency
+
+    def with_concurrency(self, concurrency: int) -> "ObjectiveScraper":
+        return self.share_state(ObjectiveScraper(self.params.model_copy(update={"concurrency": concurrency})))
+
+    def share_state(self, scraper: BaseScraper) -> BaseScraper:
+        """Also share the clients and event loop, so copies reuse the same connections and `close` reaches them."""
+        scraper = super().share_state(scraper)
+        if isinstance(scraper, ObjectiveScraper):
+            scraper._clients = self._clients
+        return scraper
+
+    def search_config(self, query: str) -> dict:
+        return {
+            # Indexes in different environments can share an id
+            "base_url": self.params.base_url,
+            "index_id": self.params.index_id,
+            "limit": self.params.limit,
+            "object_fields": self.params.object_fields,
+            "query": query
+        }
+
+    def search_many(self, queries: Iterable[str]) -> Iterator[Tuple[str, List[SearchResultItem]]]:
+        if self.params.concurrency > 1:
+            yield from self._run_async(self.search_many_async(queries))
+            return
+
+        client = self.client()
         for query in queries:
-            resp = client.indexes.search(
-                index_id=self.params.index_id,
-                query=query,
-                limit=self.params.limit,
-                object_fields=self.params.object_fields
+            resp = self.request(lambda: self._search(client, query))
+            yield query, self._items(query, resp)
+
+    async def search_many_async(self, queries: Iterable[str]) -> AsyncIterator[Tuple[str, List[SearchResultItem]]]:
+        """Yield (query, results) pairs in query order, with up to `concurrency` searches in flight.
+
+        Every search goes through one async client that is reused across calls, and by copies of the scraper.
+        Call it from the scraper's own event loop, as `search_many` does, since the client is bound to the
+        loop it first runs on.
+        """
+        client = self.async_client()
+        semaphore = asyncio.Semaphore(self.params.concurrency)
+
+        async def search(query: str) -> List[SearchResultItem]:
+            async with semaphore:
+                return await self._search_async(client, query)
+
+        # A window of twice the concurrency keeps searches in flight while the oldest one finishes
+        pending = deque()
+        try:
+            for query in queries:
+                if len(pending) >= self.params.concurrency * 2:
+                    done, task = pending.popleft()
+                    yield done, await task
+                pending.append((query, asyncio.ensure_future(search(query))))
+            while pending:
+                done, task = pending.popleft()
+                yield done, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    def client(self) -> Objective:
+        with self._clients.lock:
+            if self._clients.client is None:
+                self._clients.client = Objective(**self._client_options())
+            return self._clients.client
+
+    def async_client(self) -> AsyncObjective:
+        with self._clients.lock:
+            if self._clients.async_client is None:
+                self._clients.async_client = AsyncObjective(**self._client_options())
+            return self._clients.async_client
+
+    def _client_options(self) -> dict:
+        options = {
+            "api_key": self.params.api_key,
+            # With a throttle, retries are left to it so they count against the rate limit
+            "max_retries": 0 if self.throttle is not None else self.params.max_retries
+        }
+        if self.params.base_url is not None:
+            options["base_url"] = self.params.base_url
+        return options
+
+    def close(self) -> None:
+        """Close the clients and stop the event loop of concurrent searches, for this scraper and its copies."""
+        self._clients.close()
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._clients.lock:
+            if self._clients.loop is None:
+                self._clients.loop = asyncio.new_event_loop()
+                threading.Thread(target=self._clients.loop.run_forever, daemon=True).start()
+            return self._clients.loop
+
+    def _run_async(self, results: AsyncIterator[Tuple[str, List[SearchResultItem]]]) -> Iterator[Tuple[str, List[SearchResultItem]]]:
+        """Iterate over an async generator on the scraper's event loop, from a synchronous caller."""
+        loop = self._event_loop()
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(results.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(results.aclose(), loop).result()
+
+    def _items(self, query: str, response) -> List[SearchResultItem]:
+        return [SearchResultItem(query=query, object=result.object) for result in response.results]
+
+    def _search_options(self, query: str) -> dict:
+        return {
+            "index_id": self.params.index_id,
+            "query": query,
+            "limit": self.params.limit,
+            "object_fields": self.params.object_fields
+        }
+
+    def _search(self, client: Objective, query: str):
+        try:
+            return client.indexes.search(**self._search_options(query))
+        except (APIStatusError, APIConnectionError) as e:
+            raise self._error(e)
+
+    async def _search_async(self, client: AsyncObjective, query: str) -> List[SearchResultItem]:
+        throttle = self.throttle
+        attempts = 1 if throttle is None else throttle.params.max_retries + 1
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                if throttle is not None:
+                    # The token bucket blocks, so wait for it off the event loop
+                    await asyncio.to_thread(throttle.acquire)
+                    start = time.perf_counter()
+                try:
+                    response = await client.indexes.search(**self._search_options(query))
+                except (APIStatusError, APIConnectionError) as e:
+                    raise self._error(e)
+            except ScrapeError as e:
+                if throttle is not None and not isinstance(e, CircuitOpenError):
+                    throttle.failure(e, time.perf_counter() - start)
+                if throttle is None or not e.retryable or attempt == attempts - 1:
+                    raise
+                throttle.retries += 1
+                await asyncio.sleep(throttle.backoff(attempt, e.retry_after))
+                continue
+
+            latency = time.perf_counter() - start
+            self.observe(SEARCH_LATENCY, latency)
+            if throttle is not None:
+                throttle.success(latency)
+            return self._items(query, response)
+
+    def _error(self, e: Exception) -> ScrapeError:
+        if isinstance(e, APIStatusError):
+            return ScrapeError(
+                f"Objective search failed: {e.message}",
+                e.status_code,
+                retryable=e.status_code in RETRYABLE_STATUS_CODES,
+                retry_after=retry_after(e.response)
             )
-            for result in resp.results:
-                results.items.append(SearchResultItem(
-                    query=query,
-                    object=result.object
-                ))
-        with open(save_to_path, "w") as f:
-            f.write(results.to_json())
\ No newline at end of file
+        return ScrapeError(f"Failed to connect to the Objective API: {e}", retryable=True)
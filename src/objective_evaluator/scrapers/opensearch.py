@@ -1,10 +1,18 @@
 import json
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
-from objective_evaluator.scraper import BaseScraper, ScrapeParams, SearchResults, SearchResultItem 
+from objective_evaluator.instrumentation import SEARCH_LATENCY
+from objective_evaluator.ratelimit import RETRYABLE_STATUS_CODES, THROTTLE_STATUS_CODES, CircuitOpenError, ScrapeError
+from objective_evaluator.scraper import BaseScraper, ScrapeParams, SearchResultItem, ordered_map
+from objective_evaluator.tracker import retry_after
+from objective_evaluator.template import QueryTemplate
 
 class OpenSearchScrapeParams(ScrapeParams):
     host: str
@@ -13,7 +21,22 @@ class OpenSearchScrapeParams(ScrapeParams):
     username: str
     password: str
     ssl_verify: bool = False
+    # Placeholders such as "{query}" are replaced by typed values, see `QueryTemplate`.
     query_template: dict
+    # Values for placeholders other than "{query}" and "{limit}", e.g. {"filters": [...]}.
+    template_vars: Dict[str, Any] = {}
+    # Per-query placeholder values, keyed by query. These override `template_vars`.
+    query_vars: Dict[str, Dict[str, Any]] = {}
+    # Number of search requests in flight at once. Connections are pooled and kept alive across queries.
+    concurrency: int = 1
+    # Pack many queries into each `_msearch` request. A batch is closed once it reaches either
+    # `msearch_batch_size` queries or `msearch_max_bytes` of NDJSON body.
+    msearch: bool = False
+    msearch_batch_size: int = 100
+    msearch_max_bytes: int = 1_000_000
+    # Failed `_msearch` sub-requests are retried on their own, with exponential backoff.
+    max_retries: int = 3
+    retry_backoff: float = 0.5
 
 class OpenSearchScraper(BaseScraper):
 
@@ -21,32 +44,180 @@ class OpenSearchScraper(BaseScraper):
         super().__init__(params=params)
         self.params = params
 
-    def scrape(self, queries: List[str], save_to_path: str) -> None:
-        results = SearchResults(items=[])
-        for query in queries:
-            url = f"{self.params.host}:{self.params.port}/{self.params.index}/_search"
-            payload = json.loads(json.dumps(self.params.query_template).replace('"{query}"', json.dumps(query)))        
-            headers = {
-                'Content-Type': 'application/json',
-            }
-            auth = HTTPBasicAuth(self.params.username, self.params.password)
-            response = requests.post(
-                url,
-                json=payload,
-                auth=auth,
-                headers=headers,
-                verify=self.params.ssl_verify
-            )
+    def search(self, query: str) -> List[SearchResultItem]:
+        return list(self.search_many([query]))[0][1]
+
+    @property
+    def concurrency(self) -> int:
+        return self.params.concurrency
+
+    def with_concurrency(self, concurrency: int) -> "OpenSearchScraper":
+        return self.share_state(OpenSearchScraper(self.params.model_copy(update={"concurrency": concurrency})))
+
+    def search_many(self, queries: Iterable[str]) -> Iterator[Tuple[str, List[SearchResultItem]]]:
+        base_url = f"{self.params.host}:{self.params.port}/{self.params.index}"
+
+        with self._session() as session, ThreadPoolExecutor(max_workers=self.params.concurrency) as executor:
+            if self.params.msearch:
+                def search(batch: List[Tuple[str, bytes]]) -> List[Tuple[str, List[SearchResultItem]]]:
+                    return list(zip([query for query, _ in batch], self._msearch(session, base_url + "/_msearch", batch)))
+                batches = self._batches(queries)
+            else:
+                def search(query: str) -> List[Tuple[str, List[SearchResultItem]]]:
+                    return [(query, self._search(session, base_url + "/_search", query))]
+                batches = queries
+
+            for batch_results in ordered_map(executor, search, batches, window=self.params.concurrency * 2):
+                yield from batch_results
+
+    def _session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.params.concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.auth = HTTPBasicAuth(self.params.username, self.params.password)
+        session.headers.update({
+            'Content-Type': 'application/json',
+        })
+        session.verify = self.params.ssl_verify
+        return session
+
+    @cached_property
+    def template(self) -> QueryTemplate:
+        return QueryTemplate(self.params.query_template)
+
+    def _render(self, query: str) -> dict:
+        return self.template.render(
+            query=query,
+            limit=self.params.limit,
+            **{**self.params.template_vars, **self.params.query_vars.get(query, {})}
+        )
+
+    def search_config(self, query: str) -> dict:
+        return {
+            "host": self.params.host,
+            "port": self.params.port,
+            "index": self.params.index,
+            "limit": self.params.limit,
+            "body": self._render(query)
+        }
+
+    def _items(self, query: str, response: dict) -> List[SearchResultItem]:
+        self.observe_took(response.get('took'))
+        hits = response.get('hits', {}).get('hits', [])
+        return [
+            SearchResultItem(query=query, object=hit['_source'])
+            for hit in hits[:self.params.limit]
+        ]
 
+    def _search(self, session: requests.Session, url: str, query: str) -> List[SearchResultItem]:
+        def send() -> dict:
+            response = self._post(session, url, json=self._render(query))
             if response.status_code != 200:
-                raise Exception(f"Failed to connect to OpenSearch API. Status code: {response.status_code}")
-            
-            hits = response.json().get('hits', {}).get('hits', [])
-            for hit in hits[:self.params.limit]:
-                results.items.append(SearchResultItem(
-                    query=query,
-                    object=hit['_source']
-                ))
-
-        with open(save_to_path, "w") as f:
-            f.write(results.to_json())
\ No newline at end of file
+                raise self._error(response)
+            return response.json()
+
+        return self._items(query, self.request(send))
+
+    def _post(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        try:
+            return session.post(url, **kwargs)
+        except requests.ConnectionError as e:
+            raise ScrapeError(f"Failed to connect to OpenSearch API: {e}", retryable=True)
+
+    def _error(self, response: requests.Response, message: str = "") -> ScrapeError:
+        return ScrapeError(
+            f"Failed to connect to OpenSearch API. {message}Status code: {response.status_code}",
+            response.status_code,
+            retryable=response.status_code in RETRYABLE_STATUS_CODES,
+            retry_after=retry_after(response)
+        )
+
+    def _batches(self, queries: Iterable[str]) -> Iterator[List[Tuple[str, bytes]]]:
+        batch, size = [], 0
+        for query in queries:
+            # Each search is a header line (the index comes from the URL) followed by the body line.
+            lines = b"{}\n" + json.dumps(self._render(query)).encode() + b"\n"
+            if batch and (len(batch) >= self.params.msearch_batch_size or size + len(lines) > self.params.msearch_max_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append((query, lines))
+            size += len(lines)
+        if batch:
+            yield batch
+
+    def _msearch(self, session: requests.Session, url: str, batch: List[Tuple[str, bytes]]) -> List[List[SearchResultItem]]:
+        """Send a batch, retrying only the searches that failed with a retryable status. A search that can't
+        succeed, e.g. with a 400 for a query OpenSearch can't parse, fails the batch at once. With a `throttle`,
+        each search takes a token from the rate limiter, and rejected searches slow it down."""
+        throttle = self.throttle
+        max_retries = throttle.params.max_retries if throttle is not None else self.params.max_retries
+        results = [None] * len(batch)
+        pending = list(range(len(batch)))
+        status, wait = None, None
+
+        for attempt in range(max_retries + 1):
+            if attempt > 0:
+                if throttle is not None:
+                    time.sleep(throttle.backoff(attempt - 1, wait))
+                else:
+                    time.sleep(self.params.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                if throttle is not None:
+                    throttle.acquire(len(pending))
+                start = time.monotonic()
+                response = self._post(
+                    session,
+                    url,
+                    data=b"".join(batch[i][1] for i in pending),
+                    headers={'Content-Type': 'application/x-ndjson'}
+                )
+                if response.status_code != 200:
+                    raise self._error(response)
+            except ScrapeError as e:
+                status, wait = e.status_code, e.retry_after
+                if throttle is not None and not isinstance(e, CircuitOpenError):
+                    throttle.failure(e)
+                if not e.retryable:
+                    raise
+                continue
+            latency = time.monotonic() - start
+            self.observe(SEARCH_LATENCY, latency)
+
+            failed, rejected, fatal = [], set(), None
+            sub_responses = response.json().get('responses', [])
+            for n, i in enumerate(pending):
+                sub_response = sub_responses[n] if n < len(sub_responses) else {'error': 'missing response'}
+                if 'error' in sub_response or (sub_response.get('status') or 200) >= 400:
+                    status = sub_response.get('status')
+                    failed.append(i)
+                    if status in THROTTLE_STATUS_CODES:
+                        rejected.add(status)
+                    # A missing response has no status and may be there next time
+                    if status is not None and status not in RETRYABLE_STATUS_CODES and fatal is None:
+                        fatal = (batch[i][0], status, sub_response.get('error'))
+                else:
+                    results[i] = self._items(batch[i][0], sub_response)
+
+            if throttle is not None:
+                if rejected:
+                    throttle.failure(ScrapeError("Searches rejected by OpenSearch", min(rejected), retryable=True), latency)
+                else:
+                    throttle.success(latency, len(pending) - len(failed))
+            if fatal is not None:
+                query, status, error = fatal
+                raise ScrapeError(
+                    f"Search for {query!r} in the _msearch batch failed and can't be retried: {json.dumps(error)}. "
+                    f"Status code: {status}",
+                    status
+                )
+            pending, wait = failed, None
+            if not pending:
+                return results
+
+        raise ScrapeError(
+            f"Failed to connect to OpenSearch API. {len(pending)} of {len(batch)} searches in the _msearch batch "
+            f"still failing after {max_retries} retries. Status code: {status}",
+            status
+        )
@@ -0,0 +1,192 @@
+import math
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from objective_evaluator.aggregate import label_counts
+from objective_evaluator.metrics import query_metrics
+from objective_evaluator.results import EvalResults
+
+# Resampling is done in blocks of iterations holding at most this many values, to bound memory
+BLOCK_VALUES = 1 << 22
+
+
+class PairedComparison(BaseModel):
+    """How a candidate engine differs from the baseline on a per-query metric, over the queries both answered."""
+    metric: str
+    baseline: str
+    candidate: str
+    queries: int
+    baseline_mean: float
+    candidate_mean: float
+    # candidate - baseline, with a paired bootstrap confidence interval
+    difference: float
+    ci_low: float
+    ci_high: float
+    confidence: float
+    randomization_p: float
+    wilcoxon_p: float
+    sign_test_p: float
+
+
+def _blocks(iterations: int, n: int) -> Iterator[int]:
+    size = max(1, BLOCK_VALUES // max(n, 1))
+    for start in range(0, iterations, size):
+        yield min(size, iterations - start)
+
+
+def paired_bootstrap(
+    differences: np.ndarray,
+    iterations: int = 10_000,
+    confidence: float = 0.95,
+    rng: Optional[np.random.Generator] = None
+) -> Tuple[float, float]:
+    """Percentile confidence interval of the mean of paired `differences`, resampling queries with replacement."""
+    differences = np.asarray(differences, dtype=np.float64)
+    n = len(differences)
+    if n == 0:
+        return math.nan, math.nan
+    rng = rng or np.random.default_rng()
+    index_type = np.int32 if n < 2 ** 31 else np.int64
+    means = np.concatenate([
+        differences[rng.integers(0, n, size=(block, n), dtype=index_type)].mean(axis=1)
+        for block in _blocks(iterations, n)
+    ])
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def randomization_test(differences: np.ndarray, iterations: int = 10_000, rng: Optional[np.random.Generator] = None) -> float:
+    """Two-sided p-value of a paired randomization (sign-flip) test that the mean difference is zero."""
+    differences = np.asarray(differences, dtype=np.float64)
+    n = len(differences)
+    if n == 0:
+        return math.nan
+    rng = rng or np.random.default_rng()
+    observed = abs(differences.sum())
+    total = differences.sum()
+    extreme = 0
+    for block in _blocks(iterations, n):
+        # Flipping the signs of a random subset S turns the sum into total - 2 * sum(S)
+        flips = (rng.random((block, n), dtype=np.float32) < 0.5).astype(np.float64)
+        sums = total - 2 * (flips @ differences)
+        extreme += int((np.abs(sums) >= observed - 1e-12).sum())
+    return (extreme + 1) / (iterations + 1)
+
+
+def _average_ranks(values: np.ndarray) -> np.ndarray:
+    """1-based ranks of `values`, with ties given the average of their ranks."""
+    order = np.argsort(values, kind="stable")
+    sorted_values = values[order]
+    _, first, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+    average = first + (counts + 1) / 2
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(average, counts)
+    return ranks
+
+
+def _normal_p(z: float) -> float:
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def wilcoxon_test(differences: np.ndarray) -> float:
+    """Two-sided p-value of the Wilcoxon signed-rank test, using the normal approximation with tie and continuity corrections.
+
+    Zero differences are dropped. The approximation is good from about 20 non-zero differences.
+    """
+    differences = np.asarray(differences, dtype=np.float64)
+    differences = differences[differences != 0]
+    n = len(differences)
+    if n == 0:
+        return 1.0
+    ranks = _average_ranks(np.abs(differences))
+    positive = ranks[differences > 0].sum()
+    mean = n * (n + 1) / 4
+    _, ties = np.unique(np.abs(differences), return_counts=True)
+    variance = n * (n + 1) * (2 * n + 1) / 24 - (ties ** 3 - ties).sum() / 48
+    if variance <= 0:
+        return 1.0
+    correction = 0.5 * np.sign(positive - mean)
+    return _normal_p((positive - mean - correction) / math.sqrt(variance))
+
+
+def sign_test(differences: np.ndarray) -> float:
+    """Two-sided exact p-value of the sign test. Zero differences are dropped."""
+    differences = np.asarray(differences)
+    positive, negative = int((differences > 0).sum()), int((differences < 0).sum())
+    n = positive + negative
+    if n == 0:
+        return 1.0
+    k = np.arange(min(positive, negative) + 1)
+    log_pmf = (
+        math.lgamma(n + 1)
+        - np.array([math.lgamma(i + 1) + math.lgamma(n - i + 1) for i in k])
+        - n * math.log(2)
+    )
+    return min(1.0, 2 * float(np.exp(log_pmf).sum()))
+
+
+def per_query_metric(results: EvalResults, metric: str, k: int = 10) -> pd.Series:
+    """One value per query: a column of `query_metrics` (e.g. `ndcg@10`), or the share of results with a label (e.g. `GREAT`)."""
+    counts = label_counts(results)
+    if metric in counts.labels or metric in ("GREAT", "OK", "BAD"):
+        per_query = counts.per_query()
+        if metric not in per_query.columns:
+            return pd.Series(0.0, index=per_query.index)
+        totals = per_query.sum(axis=1)
+        return (per_query[metric] / totals.where(totals > 0)).dropna()
+    metrics = query_metrics(results, k)
+    if metric not in metrics.columns:
+        raise ValueError(f"Unknown metric {metric!r}. Expected a label or one of {list(metrics.columns)}.")
+    return metrics[metric].dropna()
+
+
+def compare_pair(
+    baseline: EvalResults,
+    candidate: EvalResults,
+    metric: str = "ndcg@10",
+    k: int = 10,
+    iterations: int = 10_000,
+    confidence: float = 0.95,
+    seed: Optional[int] = 0
+) -> PairedComparison:
+    """Compare `candidate` with `baseline` on `metric`, paired by query."""
+    a, b = per_query_metric(baseline, metric, k).align(per_query_metric(candidate, metric, k), join="inner")
+    differences = b.to_numpy(np.float64) - a.to_numpy(np.float64)
+    rng = np.random.default_rng(seed)
+    ci_low, ci_high = paired_bootstrap(differences, iterations, confidence, rng)
+    return PairedComparison(
+        metric=metric,
+        baseline=baseline.name,
+        candidate=candidate.name,
+        queries=len(differences),
+        baseline_mean=float(a.mean()) if len(a) else math.nan,
+        candidate_mean=float(b.mean()) if len(b) else math.nan,
+        difference=float(differences.mean()) if len(differences) else math.nan,
+        ci_low=ci_low,
+        ci_high=ci_high,
+        confidence=confidence,
+        randomization_p=randomization_test(differences, iterations, rng),
+        wilcoxon_p=wilcoxon_test(differences),
+        sign_test_p=sign_test(differences)
+    )
+
+
+def compare_engines(
+    results: List[EvalResults],
+    metric: str = "ndcg@10",
+    k: int = 10,
+    baseline: int = 0,
+    iterations: int = 10_000,
+    confidence: float = 0.95,
+    seed: Optional[int] = 0
+) -> pd.DataFrame:
+    """`compare_pair` of every evaluation against `results[baseline]`, one row per candidate."""
+    rows = [
+        compare_pair(results[baseline], candidate, metric, k, iterations, confidence, seed).model_dump()
+        for i, candidate in enumerate(results) if i != baseline
+    ]
+    return pd.DataFrame(rows, columns=list(PairedComparison.model_fields))
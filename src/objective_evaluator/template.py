@@ -0,0 +1,58 @@
+import re
+from typing import Any, Dict, List, Tuple, Union
+
+PLACEHOLDER = re.compile(r"^\{(\w+)\}$")
+
+Path = Tuple[Union[str, int], ...]
+
+
+class QueryTemplate:
+    """A search request body with typed placeholders, compiled once and rendered per query.
+
+    A placeholder is any string value that is exactly `{name}`, e.g. `"{query}"`, `"{limit}"` or
+    `"{filters}"`. It is replaced by the value passed for `name` as-is, so `{limit}` renders as a
+    number and `{filters}` can render as a list or an object.
+
+    Rendering copies only the containers on the way to a placeholder; everything else is shared
+    with the compiled template, so the result must be treated as read-only.
+    """
+
+    def __init__(self, template: dict):
+        self.template = template
+        self.paths: List[Tuple[Path, str]] = list(self._compile(template, ()))
+        self.placeholders = {name for _, name in self.paths}
+        # Nested {key: name | sub-plan} mirroring the template along placeholder paths only.
+        self._plan: Dict[Any, Any] = {}
+        for path, name in self.paths:
+            if not path:
+                raise ValueError("The query template itself cannot be a placeholder.")
+            node = self._plan
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = name
+
+    def render(self, **values: Any) -> dict:
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise ValueError(f"Missing values for query template placeholders: {', '.join(sorted(missing))}")
+        return self._render(self.template, self._plan, values)
+
+    @classmethod
+    def _compile(cls, node: Any, path: Path):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                yield from cls._compile(value, path + (key,))
+        elif isinstance(node, list):
+            for i, value in enumerate(node):
+                yield from cls._compile(value, path + (i,))
+        elif isinstance(node, str):
+            match = PLACEHOLDER.match(node)
+            if match:
+                yield path, match.group(1)
+
+    @classmethod
+    def _render(cls, node: Any, plan: Dict[Any, Any], values: Dict[str, Any]) -> Any:
+        copy = dict(node) if isinstance(node, dict) else list(node)
+        for key, sub in plan.items():
+            copy[key] = values[sub] if isinstance(sub, str) else cls._render(node[key], sub, values)
+        return copy
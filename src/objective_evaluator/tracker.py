@@ -0,0 +1,153 @@
+import asyncio
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional
+
+import httpx
+
+PENDING_STATUSES = ("processing", "accepted")
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# A request that is not idempotent, like submitting an evaluation, is only retried when the server can't have
+# acted on it: when it was throttled or turned away, or when the connection failed before anything was sent
+REJECTED_STATUS_CODES = (429, 503)
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class ObjectiveAntonEvalFailed(Exception):
+    """Custom exception for ObjectiveAntonEvaluator failures."""
+    def __init__(self, message: str, status_code: int = None):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(self.message)
+
+
+class EvaluationFailed(ObjectiveAntonEvalFailed):
+    """An evaluation that was accepted but finished with the "failed" or "error" status, so resubmitting it is safe."""
+
+
+def retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header, given either as seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class EvaluationTracker:
+    """Submits evaluations and polls their status over one pooled async HTTP client.
+
+    Each tracked evaluation is a coroutine that sleeps between polls, so waiting on dozens of
+    evaluations costs a few idle coroutines rather than a thread each. Polling starts every
+    `poll_interval` seconds and backs off exponentially, with jitter, up to `max_poll_interval`.
+    429 and 5xx responses and connection errors are retried up to `max_retries` times in a row,
+    honouring Retry-After. Submissions are only retried when they cannot have started an evaluation,
+    see `request`. `on_complete(eval_id, status)` is called as each evaluation finishes.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        poll_interval: float = 1.0,
+        max_poll_interval: float = 30.0,
+        backoff: float = 1.5,
+        jitter: float = 0.1,
+        max_retries: int = 5,
+        max_connections: int = 20,
+        on_complete: Optional[Callable[[str, dict], None]] = None
+    ):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.on_complete = on_complete
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(60.0)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        content: Optional[Callable[[], AsyncIterator[bytes]]] = None,
+        headers: Optional[dict] = None,
+        idempotent: Optional[bool] = None
+    ) -> httpx.Response:
+        """Send a request, retrying throttled and failed ones. `content` is a factory, so the body can be re-sent.
+
+        Requests are idempotent unless they are POSTs. Other requests are only retried on `REJECTED_STATUS_CODES`
+        and `UNSENT_ERRORS`, so a submission the server may have accepted is never sent twice.
+        """
+        if idempotent is None:
+            idempotent = method != "POST"
+        retry_statuses = RETRYABLE_STATUS_CODES if idempotent else REJECTED_STATUS_CODES
+        retry_errors = httpx.TransportError if idempotent else UNSENT_ERRORS
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.client.request(
+                    method, url, content=content() if content is not None else None, headers=headers
+                )
+            except httpx.TransportError as e:
+                if not isinstance(e, retry_errors) or attempt == self.max_retries:
+                    raise ObjectiveAntonEvalFailed(f"Request to {url} failed: {e!r}")
+                await asyncio.sleep(self.delay(attempt))
+                continue
+
+            if response.status_code not in retry_statuses or attempt == self.max_retries:
+                break
+            wait = retry_after(response)
+            await asyncio.sleep(wait if wait is not None else self.delay(attempt))
+
+        if response.status_code != 200:
+            raise ObjectiveAntonEvalFailed(
+                f"Request failed with status code {response.status_code}",
+                response.status_code
+            )
+        return response
+
+    async def status(self, eval_id: str) -> dict:
+        response = await self.request("GET", f"{self.api_url}/{eval_id}")
+        return response.json()
+
+    async def wait(self, eval_id: str) -> dict:
+        """Poll an evaluation until it is no longer pending and return its final status."""
+        polls = 0
+        status = await self.status(eval_id)
+        while status['status'] in PENDING_STATUSES:
+            await asyncio.sleep(self.delay(polls))
+            polls += 1
+            status = await self.status(eval_id)
+
+        if self.on_complete is not None:
+            self.on_complete(eval_id, status)
+        return status
+
+    async def wait_all(self, eval_ids: Iterable[str]) -> Dict[str, dict]:
+        eval_ids = list(eval_ids)
+        statuses = await asyncio.gather(*(self.wait(eval_id) for eval_id in eval_ids))
+        return dict(zip(eval_ids, statuses))
+
+    def delay(self, attempt: int) -> float:
+        delay = min(self.max_poll_interval, self.poll_interval * self.backoff ** attempt)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,268 @@
+import hashlib
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def find_query(body):
+    """Return the first `query` string found in an OpenSearch request body."""
+    if isinstance(body, dict):
+        for key, value in body.items():
+            if key == "query" and isinstance(value, str):
+                return value
+            found = find_query(value)
+            if found is not None:
+                return found
+    elif isinstance(body, list):
+        for value in body:
+            found = find_query(value)
+            if found is not None:
+                return found
+    return None
+
+
+class FakeServer:
+    """A local HTTP/1.1 keep-alive server on a free port. Subclasses implement `handle`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return "http://127.0.0.1"
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method: str, path: str, data: bytes):
+        """Return (status, payload) or (status, payload, headers)."""
+        raise NotImplementedError
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, so Nagle's algorithm would hold the body back for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def _dispatch(self, method: str):
+                with fake._lock:
+                    fake.requests += 1
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    fake.connections.add(self.client_address)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    data = self.rfile.read(length)
+                    time.sleep(fake.latency)
+                    status, payload, *headers = fake.handle(method, self.path, data)
+                    self._send(status, payload, headers[0] if headers else {})
+                finally:
+                    with fake._lock:
+                        fake.in_flight -= 1
+
+            def _send(self, status: int, payload: dict, headers: dict):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class FakeOpenSearch(FakeServer):
+    """A local stand-in for OpenSearch's `_search` and `_msearch` endpoints.
+
+    Every hit's `_source` echoes the query it was returned for, so callers can check ordering.
+    `failures` maps a query to the number of times its search should fail with a 429 before succeeding.
+    With `max_rate`, searches beyond that many per second (with bursts of a tenth of a second) are rejected with a 429.
+    """
+
+    def __init__(self, latency: float = 0.0, hits: int = 10, failures: dict = None, max_rate: float = None):
+        super().__init__(latency)
+        self.hits = hits
+        self.failures = dict(failures or {})
+        self.max_rate = max_rate
+        self.searches = 0
+        self.rejected = 0
+        self.last_search = None
+        self._tokens = max(1.0, max_rate / 10) if max_rate else 0.0
+        self._updated = time.monotonic()
+
+    def _over_rate(self) -> bool:
+        if self.max_rate is None:
+            return False
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.max_rate / 10), self._tokens + (now - self._updated) * self.max_rate)
+        self._updated = now
+        if self._tokens < 1:
+            self.rejected += 1
+            return True
+        self._tokens -= 1
+        return False
+
+    def search(self, body: dict) -> dict:
+        query = find_query(body)
+        with self._lock:
+            self.searches += 1
+            self.last_search = time.monotonic()
+            if self._over_rate():
+                return {"status": 429, "error": {"type": "too_many_requests"}}
+            if self.failures.get(query, 0) > 0:
+                self.failures[query] -= 1
+                return {"status": 429, "error": {"type": "es_rejected_execution_exception"}}
+        return {
+            "took": int(self.latency * 1000),
+            "hits": {
+                "hits": [
+                    {"_id": f"{query}-{i}", "_source": {"query": query, "rank": i}}
+                    for i in range(self.hits)
+                ]
+            }
+        }
+
+    def handle(self, method: str, path: str, data: bytes):
+        if path.endswith("/_msearch"):
+            # NDJSON: a header line followed by a body line for each search.
+            bodies = [json.loads(line) for line in data.splitlines()[1::2]]
+            return 200, {"responses": [
+                {"status": 200, **response} if "error" not in response else response
+                for response in map(self.search, bodies)
+            ]}
+        response = self.search(json.loads(data))
+        return response.get("status", 200), response, {"Retry-After": "0"} if "error" in response else {}
+
+
+class FakeObjectiveSearch(FakeServer):
+    """A local stand-in for the Objective `/indexes/{index_id}/search` endpoint.
+
+    Like `FakeOpenSearch`, every result echoes the query it was returned for. `errors` is a list of HTTP
+    status codes to answer the next searches with, before serving normally.
+    """
+
+    def __init__(self, latency: float = 0.0, hits: int = 10, errors: list = None):
+        super().__init__(latency)
+        self.hits = hits
+        self.errors = list(errors or [])
+        self.searches = 0
+
+    def handle(self, method: str, path: str, data: bytes):
+        with self._lock:
+            error = self.errors.pop(0) if self.errors else None
+            self.searches += error is None
+        if error is not None:
+            return error, {"error": "unavailable"}, {"Retry-After": "0"}
+
+        params = parse_qs(urlparse(path).query)
+        query = params["query"][0]
+        limit = int(float(params.get("limit", [self.hits])[0]))
+        return 200, {
+            "pagination": {"next": {"limit": limit, "offset": limit}, "page": 1, "pages": 1},
+            "results": [
+                {"id": f"{query}-{i}", "object": {"query": query, "rank": i}}
+                for i in range(min(limit, self.hits))
+            ]
+        }
+
+
+def fake_judgement(item: dict) -> dict:
+    """A deterministic judgement for a {"query", "object"} pair."""
+    digest = hashlib.sha256(json.dumps(item, sort_keys=True).encode()).digest()
+    label = ["GREAT", "OK", "BAD"][digest[0] % 3]
+    return {
+        "query": item["query"],
+        "object_id": digest[:6].hex(),
+        "object": item["object"],
+        "judgement": {"score": {"GREAT": 2, "OK": 1, "BAD": 0}[label], "label": label, "explanation": f"{label} match"}
+    }
+
+
+class FakeEvaluationAPI(FakeServer):
+    """A local stand-in for the `/v1/evaluations` API.
+
+    Evaluations complete `eval_latency` seconds after they are submitted. `failures` is the number of
+    evaluations that should end in the "failed" status before they start to succeed. `errors` is a list
+    of HTTP status codes (e.g. 429 or 503) to answer the next requests with, before serving normally.
+    """
+
+    def __init__(self, latency: float = 0.0, eval_latency: float = 0.0, failures: int = 0, errors: list = None):
+        super().__init__(latency)
+        self.eval_latency = eval_latency
+        self.failures = failures
+        self.errors = list(errors or [])
+        self.evaluations = {}
+        self.judged = 0
+        self._ids = itertools.count(1)
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.url}/v1/evaluations"
+
+    def handle(self, method: str, path: str, data: bytes):
+        with self._lock:
+            error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            return error, {"error": "unavailable"}, {"Retry-After": "0"}
+
+        if method == "POST":
+            payload = json.loads(data)
+            with self._lock:
+                eval_id = f"eval_{next(self._ids)}"
+                failed = self.failures > 0
+                self.failures -= failed
+                self.judged += len(payload["data"])
+                self.evaluations[eval_id] = (time.monotonic(), payload, failed)
+            return 200, {"id": eval_id, "status": "accepted"}
+
+        eval_id = path.rsplit("/", 1)[-1]
+        if eval_id not in self.evaluations:
+            return 404, {"error": "not found"}
+        submitted, payload, failed = self.evaluations[eval_id]
+        if time.monotonic() - submitted < self.eval_latency:
+            return 200, {"id": eval_id, "status": "processing"}
+        if failed:
+            return 200, {"id": eval_id, "status": "failed"}
+        return 200, {
+            "id": eval_id,
+            "status": "completed",
+            "configuration": payload["configuration"],
+            "judgements": [fake_judgement(item) for item in payload["data"]]
+        }
@@ -1,11 +1,35 @@
 
+import asyncio
+import html
+import json
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
+import httpx
+import numpy as np
+import pandas as pd
 import pytest
 
+from objective_evaluator.aggregate import engine_label_counts
+from objective_evaluator.cache import SQLiteResponseCache
+from objective_evaluator.compare import build_comparison
+from objective_evaluator.evalrunner import EvaluationParams, ObjectiveEvalRunner
 from objective_evaluator.evaluator import ObjectiveEvaluator
+from objective_evaluator.instrumentation import Instrumentation, JSONLinesSink
+from objective_evaluator.judgements import JudgementStore
+from objective_evaluator.metrics import ranking_metrics, summarize_metrics
+from objective_evaluator.partition import scrape_partitioned, worker_plan
+from objective_evaluator.queries import QuerySetParams, prepare_queries
+from objective_evaluator.ratelimit import CircuitBreaker, CircuitOpenError, RateLimitParams, ScrapeError, Throttle
+from objective_evaluator.scraper import SearchResultItem, SearchResultsWriter, read_search_results
 from objective_evaluator.scrapers.objective import ObjectiveScraper, ObjectiveScrapeParams
 from objective_evaluator.scrapers.opensearch import OpenSearchScraper, OpenSearchScrapeParams
+from objective_evaluator.significance import paired_bootstrap, randomization_test, sign_test, wilcoxon_test
+from objective_evaluator.template import QueryTemplate
+from objective_evaluator.tracker import ObjectiveAntonEvalFailed
+from tests.fakes import FakeEvaluationAPI, FakeObjectiveSearch, FakeOpenSearch, fake_judgement, find_query
 
 load_dotenv()
 
@@ -128,3 +152,1070 @@ def test_evaluator():
     ]
 
     evaluator.run(queries, clear_work_dir=True)
+
+
+def fake_opensearch_scraper(server: FakeOpenSearch, **params) -> OpenSearchScraper:
+    return OpenSearchScraper(
+        OpenSearchScrapeParams(
+            limit=params.pop("limit", 5),
+            scrape_id=params.pop("scrape_id", "fake-opensearch"),
+            index="obj-quickstart",
+            host=server.host,
+            port=server.port,
+            username="admin",
+            password="admin",
+            query_template={"query": {"multi_match": {"query": "{query}", "fields": ["prod_name"]}}},
+            **params
+        )
+    )
+
+
+def test_opensearch_scraper_concurrent(tmp_path):
+    queries = [f"query {i}" for i in range(40)]
+    save_to_path = str(tmp_path / "scrape.json")
+
+    with FakeOpenSearch(latency=0.05, hits=10) as server:
+        start = time.perf_counter()
+        fake_opensearch_scraper(server, concurrency=8).scrape(queries, save_to_path)
+        elapsed = time.perf_counter() - start
+
+    with open(save_to_path) as f:
+        items = json.load(f)
+    assert [item["query"] for item in items] == [q for q in queries for _ in range(5)]
+    assert all(item["object"]["query"] == item["query"] for item in items)
+    assert elapsed < len(queries) * server.latency / 2
+    assert 1 < server.max_in_flight <= 8
+    assert len(server.connections) <= 8
+
+
+def test_opensearch_scraper_msearch(tmp_path):
+    queries = [f"query {i}" for i in range(25)]
+    save_to_path = str(tmp_path / "scrape.json")
+
+    with FakeOpenSearch(hits=3, failures={"query 7": 1, "query 19": 2}) as server:
+        fake_opensearch_scraper(
+            server, limit=3, concurrency=2, msearch=True, msearch_batch_size=10, retry_backoff=0
+        ).scrape(queries, save_to_path)
+
+    with open(save_to_path) as f:
+        items = json.load(f)
+    assert [item["query"] for item in items] == [q for q in queries for _ in range(3)]
+    # 3 batches, plus one retry each for the batches holding "query 7" and "query 19" and a second one for "query 19".
+    assert server.requests == 6
+    # Only the failed sub-requests are retried.
+    assert server.searches == len(queries) + 3
+
+
+def test_opensearch_scraper_msearch_byte_budget(tmp_path):
+    queries = [f"query {i}" for i in range(10)]
+
+    with FakeOpenSearch(hits=1) as server:
+        scraper = fake_opensearch_scraper(server, msearch=True, msearch_max_bytes=300)
+        batches = list(scraper._batches(queries))
+        scraper.scrape(queries, str(tmp_path / "scrape.json"))
+
+    assert all(sum(len(lines) for _, lines in batch) <= 300 for batch in batches)
+    assert [query for batch in batches for query, _ in batch] == queries
+    assert server.requests == len(batches) > 1
+
+
+def test_opensearch_scraper_msearch_gives_up(tmp_path):
+    with FakeOpenSearch(failures={"query 1": 10}) as server:
+        scraper = fake_opensearch_scraper(server, msearch=True, max_retries=2, retry_backoff=0)
+        with pytest.raises(Exception, match="1 of 3 searches"):
+            scraper.scrape(["query 0", "query 1", "query 2"], str(tmp_path / "scrape.json"))
+
+
+def test_opensearch_scraper_msearch_bad_query(tmp_path):
+    class ParseErrorSearch(FakeOpenSearch):
+        def search(self, body):
+            if find_query(body) == "query 1":
+                with self._lock:
+                    self.searches += 1
+                return {"status": 400, "error": {"type": "parsing_exception"}}
+            return super().search(body)
+
+    with ParseErrorSearch() as server:
+        scraper = fake_opensearch_scraper(server, msearch=True, max_retries=3, retry_backoff=10)
+        start = time.perf_counter()
+        with pytest.raises(ScrapeError, match="'query 1'.*parsing_exception") as error:
+            scraper.scrape(["query 0", "query 1", "query 2"], str(tmp_path / "scrape.json"))
+    # Not retried, so there was no backoff
+    assert time.perf_counter() - start < 5 and server.searches == 3
+    assert error.value.status_code == 400 and not error.value.retryable
+
+
+@pytest.mark.parametrize("msearch", [False, True])
+def test_opensearch_scraper_rate_limit(tmp_path, msearch):
+    queries = [f"query {i}" for i in range(60)]
+    save_to_path = str(tmp_path / "scrape.json")
+    rate_limit = RateLimitParams(
+        rate=400, min_rate=20, burst=20, max_retries=20, retry_backoff=0.01,
+        # Rejections are expected here, so they must not open the circuit
+        failure_threshold=1000
+    )
+
+    with FakeOpenSearch(hits=2, max_rate=50) as server:
+        scraper = fake_opensearch_scraper(
+            server, limit=2, concurrency=4, msearch=msearch, msearch_batch_size=5, rate_limit=rate_limit
+        )
+        scraper.scrape(queries, save_to_path)
+
+    with open(save_to_path) as f:
+        items = json.load(f)
+    assert [item["query"] for item in items] == [q for q in queries for _ in range(2)]
+    # The engine pushed back, and the limiter slowed down to meet it
+    assert server.rejected > 0 and scraper.throttle.throttled > 0
+    assert scraper.throttle.limiter.rate < 400
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.failure()
+    breaker.before()
+    breaker.failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    breaker.before()
+    # Only one probe at a time, and a failed probe opens the circuit again
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+    breaker.failure()
+    assert breaker.state == "open"
+
+    # A probe that never reports back stops blocking requests after another reset timeout
+    time.sleep(0.06)
+    breaker.before()
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+    time.sleep(0.06)
+    breaker.before()
+    breaker.success()
+    assert breaker.state == "closed"
+
+    throttle = Throttle(RateLimitParams(max_retries=0, failure_threshold=2, reset_timeout=0.05))
+
+    def fail(error):
+        raise error
+
+    # Errors that retrying can't fix don't open the circuit
+    for _ in range(3):
+        with pytest.raises(ScrapeError):
+            throttle.call(lambda: fail(ScrapeError("bad query", 400)))
+    assert throttle.breaker.state == "closed"
+
+    # A probe that raises something else ends, so the next request can probe again
+    for _ in range(2):
+        with pytest.raises(ScrapeError):
+            throttle.call(lambda: fail(ScrapeError("unavailable", 503, retryable=True)))
+    time.sleep(0.06)
+    with pytest.raises(ValueError):
+        throttle.call(lambda: fail(ValueError("bad JSON")))
+    assert throttle.call(lambda: "ok") == "ok"
+    assert throttle.breaker.state == "closed"
+
+
+def test_throttle_gives_up():
+    throttle = Throttle(RateLimitParams(max_retries=3, retry_backoff=0, failure_threshold=100))
+    calls = []
+
+    def send(status):
+        calls.append(status)
+        raise ScrapeError("failed", status, retryable=status == 503)
+
+    with pytest.raises(ScrapeError):
+        throttle.call(lambda: send(400))
+    assert len(calls) == 1
+
+    with pytest.raises(ScrapeError):
+        throttle.call(lambda: send(503))
+    assert len(calls) == 5 and throttle.retries == 3 and throttle.throttled == 4
+
+
+def fake_objective_scraper(server: FakeObjectiveSearch, **params) -> ObjectiveScraper:
+    return ObjectiveScraper(
+        ObjectiveScrapeParams(
+            limit=params.pop("limit", 3),
+            scrape_id="fake-objective",
+            api_key="fake",
+            index_id="idx_fake",
+            object_fields="*",
+            base_url=server.url,
+            **params
+        )
+    )
+
+
+@pytest.mark.parametrize("throttled", [False, True])
+def test_objective_scraper_concurrent(tmp_path, throttled):
+    queries = [f"query {i}" for i in range(40)]
+    options = {"rate_limit": RateLimitParams(rate=1000, burst=100, retry_backoff=0)} if throttled else {}
+
+    with FakeObjectiveSearch(latency=0.05, hits=5, errors=[503, 429]) as server:
+        scraper = fake_objective_scraper(server, concurrency=8, **options)
+        scraper.scrape(queries, str(tmp_path / "first.jsonl"))
+        # The SDK's own backoff between retries is slow, so time a second scrape once the errors are served
+        start = time.perf_counter()
+        scraper.scrape(queries, str(tmp_path / "second.jsonl"))
+        elapsed = time.perf_counter() - start
+        scraper.close()
+
+    items = list(read_search_results(str(tmp_path / "first.jsonl")))
+    assert [(item["object"]["query"], item["object"]["rank"]) for item in items] == [
+        (query, rank) for query in queries for rank in range(3)
+    ]
+    # The failed searches were retried on their own
+    assert server.searches == 80
+    assert elapsed < len(queries) * server.latency / 2
+    assert 1 < server.max_in_flight <= 8
+    # Both scrapes went over the same pooled connections
+    assert len(server.connections) <= 8
+    if throttled:
+        assert scraper.throttle.retries == 2
+
+
+def test_objective_scraper_copies_share_clients(tmp_path):
+    queries = [f"query {i}" for i in range(20)]
+    threads = threading.active_count()
+    with FakeObjectiveSearch(hits=3) as server, ThreadPoolExecutor(max_workers=2) as executor:
+        scraper = fake_objective_scraper(server, concurrency=4, max_workers=2)
+        for i in range(5):
+            scrape_partitioned(executor, scraper, queries, str(tmp_path / f"scrape{i}.jsonl"))
+        # Every copy went over the scraper's one async client and event loop
+        assert len(server.connections) <= 8
+        scraper.close()
+        time.sleep(0.1)
+        # Only the fake server's threads are left
+        assert threading.active_count() <= threads + 3
+
+    assert len(list(read_search_results(str(tmp_path / "scrape4.jsonl")))) == len(queries) * 3
+
+    # Response cache keys tell environments apart
+    staging = ObjectiveScraper(scraper.params.model_copy(update={"base_url": "https://staging.example"}))
+    assert staging.cache_key("query 1") != scraper.cache_key("query 1")
+
+
+def test_query_template():
+    template = {
+        "size": "{limit}",
+        "query": {"bool": {"must": [{"match": {"prod_name": "{query}"}}], "filter": "{filters}"}},
+        "aggs": {"colours": {"terms": {"field": "colour_group_name"}}}
+    }
+    compiled = QueryTemplate(template)
+    assert compiled.placeholders == {"query", "limit", "filters"}
+
+    rendered = compiled.render(query='say "hi"', limit=10, filters=[{"term": {"in_stock": True}}])
+    assert rendered == {
+        "size": 10,
+        "query": {"bool": {"must": [{"match": {"prod_name": 'say "hi"'}}], "filter": [{"term": {"in_stock": True}}]}},
+        "aggs": {"colours": {"terms": {"field": "colour_group_name"}}}
+    }
+    # Only the containers leading to a placeholder are copied; the template itself is untouched.
+    assert rendered["aggs"] is template["aggs"]
+    assert template["query"]["bool"]["must"][0]["match"]["prod_name"] == "{query}"
+
+    with pytest.raises(ValueError, match="filters"):
+        compiled.render(query="red dress", limit=10)
+
+
+@pytest.mark.parametrize("extension", [".jsonl", ".json"])
+def test_streamed_scrape_results(tmp_path, extension):
+    queries = ["red dress", "graphic t-shirt", "jeans for men"]
+    scrape_path = str(tmp_path / f"scrape{extension}")
+
+    with FakeOpenSearch(hits=2) as server:
+        fake_opensearch_scraper(server, concurrency=2).scrape(queries, scrape_path)
+
+    with open(scrape_path) as f:
+        lines = f.read().splitlines()
+    if extension == ".jsonl":
+        assert len(lines) == 6 and json.loads(lines[0])["query"] == "red dress"
+
+    items = list(read_search_results(scrape_path))
+    assert [item["query"] for item in items] == [q for q in queries for _ in range(2)]
+
+    runner = ObjectiveEvalRunner(EvaluationParams(
+        scrape_results_path=scrape_path, save_to_path="", api_key="", eval_name="streamed"
+    ))
+    payload_path = tmp_path / "payload.json"
+    with open(payload_path, "wb") as f:
+        runner.write_payload(f)
+    with open(payload_path) as f:
+        assert json.load(f) == {"configuration": {"eval_name": "streamed"}, "data": items}
+
+
+def test_resume_interrupted_scrape(tmp_path):
+    queries = [f"query {i}" for i in range(10)]
+    scrape_path = str(tmp_path / "scrape.jsonl")
+
+    with FakeOpenSearch(hits=2, failures={"query 6": 1}) as server:
+        scraper = fake_opensearch_scraper(server, limit=2)
+        with pytest.raises(Exception):
+            scraper.scrape(queries, scrape_path)
+        assert os.path.exists(scrape_path + ".checkpoint")
+        searches = server.searches
+
+        scraper.scrape(queries, scrape_path, resume=True)
+        # Only the failed query and the ones after it are fetched again
+        assert server.searches - searches == 4
+
+    assert [item["query"] for item in read_search_results(scrape_path)] == [q for q in queries for _ in range(2)]
+    assert not os.path.exists(scrape_path + ".checkpoint")
+    assert not os.path.exists(scrape_path + ".partial")
+
+
+def test_response_cache(tmp_path):
+    queries = [f"query {i}" for i in range(10)]
+    cache = SQLiteResponseCache(str(tmp_path / "responses.sqlite"))
+
+    with FakeOpenSearch(hits=3) as server:
+        scraper = fake_opensearch_scraper(server, limit=3, concurrency=4)
+        scraper.scrape(queries[:6], str(tmp_path / "first.jsonl"), cache=cache)
+        scraper.scrape(queries, str(tmp_path / "second.jsonl"), cache=cache)
+        assert server.searches == 10
+        assert (cache.stats.hits, cache.stats.misses) == (6, 10)
+
+        # A different engine configuration does not share entries
+        fake_opensearch_scraper(server, limit=2).scrape(queries[:1], str(tmp_path / "third.jsonl"), cache=cache)
+        assert server.searches == 11
+
+    assert list(read_search_results(str(tmp_path / "second.jsonl")))[:18] == list(read_search_results(str(tmp_path / "first.jsonl")))
+
+
+def test_response_cache_expiry_and_eviction(tmp_path):
+    cache = SQLiteResponseCache(str(tmp_path / "responses.sqlite"), ttl=60, max_bytes=250)
+    for i in range(5):
+        cache.put(f"key {i}", [{"id": i, "text": "x" * 50}])
+        if i == 2:
+            cache.get("key 0")
+
+    # Least recently used entries go first once the cache is over budget
+    assert cache.lookup([f"key {i}" for i in range(5)]) == {"key 0", "key 3", "key 4"}
+    assert cache.stats.evictions == 2 and cache.size <= 250
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.lookup(["key 0"]) == set() and cache.stats.expired == 1
+
+
+def write_scrape(path: str, results: dict) -> str:
+    """Write a scrape file from {query: [object, ...]}."""
+    with SearchResultsWriter(path) as writer:
+        for query, objects in results.items():
+            writer.write([SearchResultItem(query=query, object=obj) for obj in objects])
+    return path
+
+
+def fake_eval_runner(api: FakeEvaluationAPI, scrape_path: str, save_to_path: str, **options) -> ObjectiveEvalRunner:
+    return ObjectiveEvalRunner(
+        EvaluationParams(
+            scrape_results_path=scrape_path,
+            save_to_path=save_to_path,
+            api_key="fake",
+            eval_name="fake",
+            api_url=api.api_url,
+            poll_interval=0.01
+        ),
+        **options
+    )
+
+
+def test_judgement_store(tmp_path):
+    store = JudgementStore(str(tmp_path / "judgements.sqlite"))
+    first = write_scrape(str(tmp_path / "a.jsonl"), {
+        "red dress": [{"id": 1}, {"id": 2}],
+        "jeans": [{"id": 3}]
+    })
+    second = write_scrape(str(tmp_path / "b.jsonl"), {
+        "red dress": [{"id": 2}, {"id": 4}],
+        "jeans": [{"id": 3}],
+        "top": [{"id": 1}]
+    })
+
+    with FakeEvaluationAPI() as api:
+        fake_eval_runner(api, first, str(tmp_path / "a_eval.json"), judgement_store=store).run()
+        assert api.judged == 3
+        fake_eval_runner(api, second, str(tmp_path / "b_eval.json"), judgement_store=store).run()
+        assert api.judged == 3 + 2
+        fake_eval_runner(api, second, str(tmp_path / "uncached_eval.json")).run()
+
+        # Nothing new to judge, so nothing is submitted
+        assert fake_eval_runner(api, first, str(tmp_path / "c_eval.json"), judgement_store=store).run() is None
+        assert api.judged == 3 + 2 + 4
+
+    with open(tmp_path / "b_eval.json") as f:
+        merged = json.load(f)
+    with open(tmp_path / "uncached_eval.json") as f:
+        uncached = json.load(f)
+    assert merged["cached_judgements"] == 2
+    assert [sorted(j.items()) for j in merged["judgements"]] == [sorted(j.items()) for j in uncached["judgements"]]
+
+
+def test_judgement_store_pairing(tmp_path):
+    class NormalisingEvaluationAPI(FakeEvaluationAPI):
+        """Echoes queries back lower-cased if `lower`, and drops the first judgement of each `dropped` query once."""
+        lower, dropped = True, set()
+
+        def handle(self, method, path, data):
+            response = super().handle(method, path, data)
+            for judgement in list(response[1].get("judgements", [])):
+                if judgement["query"] in self.dropped:
+                    self.dropped.discard(judgement["query"])
+                    response[1]["judgements"].remove(judgement)
+                if self.lower:
+                    judgement["query"] = judgement["query"].lower()
+            return response
+
+    store = JudgementStore(str(tmp_path / "judgements.sqlite"))
+    scrape_path = write_scrape(str(tmp_path / "scrape.jsonl"), {
+        f"Query {i}": [{"id": i}, {"id": i + 100}] for i in range(6)
+    })
+
+    # Judgements are stored under the results they were submitted for, whatever the API echoes back
+    with NormalisingEvaluationAPI() as api:
+        runner = fake_eval_runner(api, scrape_path, str(tmp_path / "eval.json"), judgement_store=store)
+        runner.params.chunk_size = 4
+        runner.run()
+        assert api.judged == 12
+    with open(tmp_path / "eval.json") as f:
+        judgements = json.load(f)["judgements"]
+    assert [j["query"] for j in judgements] == [f"Query {i}" for i in range(6) for _ in range(2)]
+
+    # A missing judgement fails the run rather than being left out, and only its result is submitted again
+    store = JudgementStore(str(tmp_path / "rerun.sqlite"))
+    NormalisingEvaluationAPI.lower, NormalisingEvaluationAPI.dropped = False, {"Query 2"}
+    with NormalisingEvaluationAPI() as api:
+        runner = fake_eval_runner(api, scrape_path, str(tmp_path / "rerun_eval.json"), judgement_store=store)
+        with pytest.raises(ObjectiveAntonEvalFailed, match="No judgement for 1 of 12"):
+            runner.run()
+        runner.run()
+        assert api.judged == 12 + 1
+    with open(tmp_path / "rerun_eval.json") as f:
+        assert json.load(f)["judgements"] == judgements
+
+
+def test_chunked_evaluation(tmp_path):
+    scrape_path = write_scrape(str(tmp_path / "scrape.jsonl"), {
+        f"query {i}": [{"id": i}, {"id": i + 100}] for i in range(12)
+    })
+
+    with FakeEvaluationAPI() as api:
+        fake_eval_runner(api, scrape_path, str(tmp_path / "whole_eval.json")).run()
+
+    with FakeEvaluationAPI(failures=1) as api:
+        runner = fake_eval_runner(api, scrape_path, str(tmp_path / "chunked_eval.json"))
+        runner.params.chunk_size = 5
+        eval_ids = runner.run()
+        # Three chunks of 5, 5 and 2 queries, one of which failed once and was resubmitted on its own
+        assert len(api.evaluations) == 4
+        assert len(eval_ids.split(",")) == 3
+        assert api.judged - 24 in (2 * 2, 5 * 2)
+
+    with open(tmp_path / "whole_eval.json") as f:
+        whole = json.load(f)
+    with open(tmp_path / "chunked_eval.json") as f:
+        chunked = json.load(f)
+    assert chunked["judgements"] == whole["judgements"]
+
+
+def test_evaluation_tracker(tmp_path):
+    scrape_path = write_scrape(str(tmp_path / "scrape.jsonl"), {"red dress": [{"id": 1}]})
+    completed = []
+
+    async def track(api):
+        runner = fake_eval_runner(api, scrape_path, "")
+        async with runner.tracker(on_complete=lambda eval_id, status: completed.append(eval_id)) as tracker:
+            eval_ids = [(await runner.submit(read_search_results(scrape_path), tracker))[0] for _ in range(3)]
+            api.errors = [429, 503, 502]
+            statuses = await tracker.wait_all(eval_ids)
+        return eval_ids, statuses
+
+    with FakeEvaluationAPI(eval_latency=0.05) as api:
+        eval_ids, statuses = asyncio.run(track(api))
+
+    assert all(status["status"] == "completed" for status in statuses.values())
+    assert sorted(completed) == sorted(eval_ids * 2)
+    # Every request went over the tracker's single keep-alive connection pool
+    assert len(api.connections) <= 3
+
+    async def give_up(api):
+        runner = fake_eval_runner(api, scrape_path, "")
+        async with runner.tracker(max_retries=2) as tracker:
+            await runner.run_async(tracker)
+
+    with FakeEvaluationAPI(errors=[503] * 10) as api:
+        with pytest.raises(ObjectiveAntonEvalFailed) as error:
+            asyncio.run(give_up(api))
+        assert error.value.status_code == 503 and api.requests == 3
+
+    # The server may have started an evaluation before answering with a 500, so the submission isn't resent
+    with FakeEvaluationAPI(errors=[500]) as api:
+        with pytest.raises(ObjectiveAntonEvalFailed) as error:
+            asyncio.run(give_up(api))
+        assert error.value.status_code == 500 and api.requests == 1
+
+    # Nor is a chunk: only chunks whose evaluation failed are resubmitted
+    async def give_up_chunked(api):
+        runner = fake_eval_runner(api, scrape_path, "")
+        runner.params.chunk_size = 2
+        async with runner.tracker(max_retries=2) as tracker:
+            await runner.run_async(tracker)
+
+    with FakeEvaluationAPI(errors=[500]) as api:
+        with pytest.raises(ObjectiveAntonEvalFailed) as error:
+            asyncio.run(give_up_chunked(api))
+        assert error.value.status_code == 500 and api.requests == 1
+
+    async def body():
+        yield b'{"configuration": {}, "data": []}'
+
+    async def read_timeout(api):
+        runner = fake_eval_runner(api, scrape_path, "")
+        async with runner.tracker(max_retries=2) as tracker:
+            tracker.client.timeout = httpx.Timeout(5.0, read=0.05)
+            with pytest.raises(ObjectiveAntonEvalFailed):
+                await tracker.request("POST", api.api_url, content=body)
+            with pytest.raises(ObjectiveAntonEvalFailed):
+                await tracker.request("GET", f"{api.api_url}/eval_1")
+
+    # A POST that timed out waiting for the response is not resent, a GET is
+    with FakeEvaluationAPI(latency=0.2) as api:
+        asyncio.run(read_timeout(api))
+        assert api.requests == 1 + 3
+
+
+def test_evaluator_end_to_end(tmp_path):
+    work_dir = str(tmp_path) + "/"
+    queries = ["red dress", "graphic t-shirt", "jeans for men"]
+
+    with FakeOpenSearch(hits=4) as opensearch, FakeEvaluationAPI(eval_latency=0.02) as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[fake_opensearch_scraper(opensearch, limit=4)],
+            api_key="fake",
+            work_dir=work_dir,
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01}
+        )
+        evaluator.run(queries)
+
+    df = evaluator.dfs[0]
+    assert df.Name == "fake-opensearch"
+    assert list(df["query"]) == [q for q in queries for _ in range(4)]
+    assert list(df["position"]) == [1, 2, 3, 4] * 3
+
+
+def test_pipelined_evaluation(tmp_path):
+    queries = [f"query {i}" for i in range(12)]
+
+    def run(work_dir, pipeline):
+        with FakeOpenSearch(latency=0.02, hits=3) as opensearch, FakeEvaluationAPI(eval_latency=0.02) as api:
+            evaluator = ObjectiveEvaluator(
+                scrapers=[fake_opensearch_scraper(opensearch, limit=3)],
+                api_key="fake",
+                work_dir=work_dir,
+                eval_options={"api_url": api.api_url, "poll_interval": 0.01, "chunk_size": 4}
+            )
+            evaluator.run(queries, pipeline=pipeline)
+            first_submitted = min(submitted for submitted, _, _ in api.evaluations.values())
+        return evaluator, first_submitted, opensearch
+
+    pipelined, first_submitted, opensearch = run(str(tmp_path / "pipelined") + "/", pipeline=True)
+    # The first chunk was submitted while the scrape was still running
+    assert first_submitted < opensearch.last_search
+    assert opensearch.searches == len(queries)
+    assert len(pipelined.dfs[0]) == len(queries) * 3
+
+    sequential, _, _ = run(str(tmp_path / "sequential") + "/", pipeline=False)
+    assert pipelined.dfs[0].to_dict("records") == sequential.dfs[0].to_dict("records")
+
+
+def test_pipelined_evaluation_failure(tmp_path):
+    with FakeOpenSearch(latency=0.01, hits=2) as opensearch, FakeEvaluationAPI(failures=100) as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[fake_opensearch_scraper(opensearch, limit=2)],
+            api_key="fake",
+            work_dir=str(tmp_path) + "/",
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01, "chunk_size": 1, "max_retries": 0, "max_concurrent_chunks": 1}
+        )
+        with pytest.raises(ObjectiveAntonEvalFailed):
+            evaluator.run([f"query {i}" for i in range(50)], pipeline=True)
+    # The scrape stopped soon after the evaluation failed rather than running to the end
+    assert opensearch.searches < 50
+
+
+def test_eval_to_df(tmp_path):
+    judgements = [
+        fake_judgement({"query": query, "object": {"title": f"{query} {i}"}})
+        for query, i in [("red dress", 0), ("red dress", 1), ("jeans", 0), ("red dress", 2)]
+    ]
+    path = str(tmp_path / "fake_eval.json")
+    with open(path, "w") as f:
+        json.dump({"status": "completed", "judgements": judgements}, f)
+
+    df = ObjectiveEvaluator(scrapers=[], api_key="fake", work_dir=str(tmp_path)).eval_to_df(path)
+    assert df.Name == "fake"
+    assert list(df.columns) == ["query", "position", "object_id", "object", "score", "label", "explanation"]
+    # Positions count per query, even when a query's judgements are not contiguous
+    assert list(df["position"]) == [1, 2, 1, 3]
+    assert df["query"].dtype == "category" and df["label"].dtype == "category"
+    assert list(df["label"].cat.categories[:3]) == ["GREAT", "OK", "BAD"]
+    # Objects are JSON strings
+    assert df["object"][0] == json.dumps({"title": "red dress 0"})
+    assert json.loads(df["object"][3]) == {"title": "red dress 2"}
+    assert df["object"].str.len().tolist() == [len(json.dumps({"title": title})) for title in ["red dress 0", "red dress 1", "jeans 0", "red dress 2"]]
+
+
+def test_lazy_eval_results(tmp_path):
+    judgements = [
+        fake_judgement({"query": query, "object": {"title": f"{query} {i}", "text": "line\nbreak"}})
+        for query in ["red dress", "jeans"] for i in range(3)
+    ]
+    path = str(tmp_path / "fake_eval.json")
+    with open(path, "w") as f:
+        json.dump({"status": "completed", "judgements": judgements}, f)
+
+    evaluator = ObjectiveEvaluator(scrapers=[], api_key="fake", work_dir=str(tmp_path))
+    evaluator.load_eval_results([path])
+    # Nothing is read until the results are used
+    assert not os.path.exists(str(tmp_path / "fake_eval.columns"))
+
+    results = evaluator.results[0]
+    assert len(results) == 6
+    assert os.path.exists(str(tmp_path / "fake_eval.columns" / "meta.json"))
+    df = evaluator.dfs[0]
+    assert df.Name == "fake"
+    assert df.to_dict("records") == evaluator.eval_to_df(path).to_dict("records")
+
+    # Wide columns are only read when asked for, and can be read for a range of rows
+    narrow = results.load(columns=["query", "position", "label"])
+    assert list(narrow.columns) == ["query", "position", "label"]
+    assert list(narrow["position"]) == [1, 2, 3, 1, 2, 3]
+    objects = results.column("object", rows=slice(2, 4))
+    assert [json.loads(obj)["title"] for obj in objects] == ["red dress 2", "jeans 0"]
+
+    # The cache is rebuilt when the eval file changes
+    with open(path, "w") as f:
+        json.dump({"status": "completed", "judgements": judgements[:2]}, f)
+    assert len(evaluator.dfs[0]) == 2
+
+
+def test_html_reports(tmp_path):
+    paths = []
+    for name, queries in [("first", ["a", "b", "c"]), ("second", ["b", "c", "<d>"])]:
+        judgements = [
+            fake_judgement({"query": query, "object": {"title": f"{name} {query} {i}"}})
+            for query in queries for i in range(2)
+        ]
+        paths.append(str(tmp_path / f"{name}_eval.json"))
+        with open(paths[-1], "w") as f:
+            json.dump({"status": "completed", "judgements": judgements}, f)
+
+    evaluator = ObjectiveEvaluator(scrapers=[], api_key="fake", work_dir=str(tmp_path))
+    evaluator.load_eval_results(paths)
+
+    # Every evaluation gets its own section of the index rather than overwriting the last one
+    evaluator.full_results_html(str(tmp_path / "full.html"), queries_per_page=2)
+    index = open(tmp_path / "full.html").read()
+    assert "<h2>first</h2>" in index and "<h2>second</h2>" in index
+    assert sorted(os.listdir(tmp_path / "full_pages")) == ["first-0001.html", "first-0002.html", "second-0001.html", "second-0002.html"]
+    page = open(tmp_path / "full_pages" / "second-0001.html").read()
+    assert page.count("<tr><td>") == 4
+    assert "&lt;d&gt;" in page and "<d>" not in page
+    assert html.escape(json.dumps({"title": "second <d> 0"})) in page
+
+    evaluator.comparison_html(str(tmp_path / "comparison.html"), queries_per_page=10)
+    page = open(tmp_path / "comparison_pages" / "comparison-0001.html").read()
+    assert "<th>first_label</th>" in page and "<th>second_explanation</th>" in page
+    # Outer join on (query, position): 4 queries with 2 positions each
+    assert page.count("<tr><td>") == 8
+    assert html.escape(json.dumps({"title": "first b 1"})) in page.split("<tr><td>b</td><td>2</td>")[1].split("</tr>")[0]
+
+
+def test_label_counts(tmp_path):
+    paths = []
+    for name, labels in [("first", {"a": ["GREAT", "OK", "BAD"], "b": ["GREAT", "GREAT"]}), ("second", {"a": ["BAD"]})]:
+        judgements = [
+            {"query": query, "object_id": f"{query}-{i}", "object": {}, "judgement": {"score": 0, "label": label, "explanation": ""}}
+            for query, query_labels in labels.items() for i, label in enumerate(query_labels)
+        ]
+        paths.append(str(tmp_path / f"{name}_eval.json"))
+        with open(paths[-1], "w") as f:
+            json.dump({"status": "completed", "judgements": judgements}, f)
+
+    evaluator = ObjectiveEvaluator(scrapers=[], api_key="fake", work_dir=str(tmp_path))
+    evaluator.load_eval_results(paths)
+    counts = evaluator.label_counts()
+    assert counts["first"].totals == {"GREAT": 3, "OK": 1, "BAD": 1}
+    assert counts["first"].per_query().loc["b"].to_dict() == {"GREAT": 2, "OK": 0, "BAD": 0}
+    assert counts["first"].per_position()["GREAT"].tolist() == [2, 1, 0]
+    assert counts["second"].totals == {"GREAT": 0, "OK": 0, "BAD": 1}
+    # Counts are computed once per evaluation
+    assert evaluator.label_counts()["first"] is counts["first"]
+
+    assert engine_label_counts(evaluator.results).to_dict("index") == {
+        "first": {"GREAT": 3, "OK": 1, "BAD": 1, "Total": 5},
+        "second": {"GREAT": 0, "OK": 0, "BAD": 1, "Total": 1}
+    }
+
+
+def test_ranking_metrics():
+    scores = {"GREAT": 2, "OK": 1, "BAD": 0}
+    rankings = {"a": ["OK", "GREAT", "BAD"], "b": ["BAD", "BAD"], "c": ["GREAT"]}
+    df = pd.DataFrame([
+        {"query": query, "position": position, "score": scores[label], "label": label}
+        for query, labels in rankings.items() for position, label in enumerate(labels, 1)
+    ])
+    # Shuffled rows give the same metrics, since positions come from the position column
+    metrics = ranking_metrics(df.sample(frac=1, random_state=0), k=2)
+
+    dcg = 1 / np.log2(2) + 3 / np.log2(3)
+    assert metrics.loc["a", "dcg@2"] == pytest.approx(dcg)
+    assert metrics.loc["a", "ndcg@2"] == pytest.approx(dcg / (3 / np.log2(2) + 1 / np.log2(3)))
+    assert metrics["ndcg@2"].tolist() == pytest.approx([metrics.loc["a", "ndcg@2"], 0.0, 1.0])
+    assert metrics["precision@2"].tolist() == [1.0, 0.0, 0.5]
+    assert metrics["reciprocal_rank"].tolist() == [1.0, 0.0, 1.0]
+    assert metrics["first_bad_position"].tolist()[:2] == [3, 1]
+    assert np.isnan(metrics.loc["c", "first_bad_position"])
+
+    summary = summarize_metrics(metrics)
+    assert summary["queries"] == 3
+    assert summary["mrr"] == pytest.approx(2 / 3)
+    assert summary["first_bad_position"] == 2
+    assert summary["queries_without_bad"] == 1
+
+
+def test_comparison_df():
+    def frame(name, rankings):
+        df = pd.DataFrame([
+            {"query": query, "position": position, "object_id": object_id, "object": {"id": object_id},
+             "label": "GREAT" if object_id.endswith("1") else "OK", "explanation": f"{name} {object_id}"}
+            for query, object_ids in rankings.items() for position, object_id in enumerate(object_ids, 1)
+        ])
+        df["label"] = df["label"].astype("category")
+        return df
+
+    frames = [
+        frame("first", {"a": ["a1", "a2", "a3"], "b": ["b1"]}),
+        frame("second", {"a": ["a3", "a1"], "c": ["c1", "c2"]}),
+        frame("third", {"b": ["b2", "b1"]})
+    ]
+    names = ["first", "second", "third"]
+
+    # The same rows and values as chained outer merges on (query, position)
+    expected = frames[0][["query", "position", "label", "object", "explanation"]].add_prefix("first_").rename(
+        columns={"first_query": "query", "first_position": "position"})
+    for name, df in zip(names[1:], frames[1:]):
+        df = df[["query", "position", "label", "object", "explanation"]].add_prefix(f"{name}_").rename(
+            columns={f"{name}_query": "query", f"{name}_position": "position"})
+        expected = pd.merge(expected, df, on=["query", "position"], how="outer")
+    expected = expected.sort_values(["query", "position"]).reset_index(drop=True)
+
+    comparison = build_comparison(frames, names)
+    assert list(comparison.columns) == list(expected.columns)
+    assert comparison.astype(str).values.tolist() == expected.astype(str).values.tolist()
+
+    # Joined on the document, showing how far it moved relative to the first engine
+    moved = build_comparison(frames, names, on="object_id", columns=["label"]).set_index(["query", "object_id"])
+    assert moved.loc[("a", "a3"), "second_rank_change"] == 2
+    assert moved.loc[("a", "a1"), "second_rank_change"] == -1
+    assert moved.loc[("b", "b1"), "third_rank_change"] == -1
+    assert np.isnan(moved.loc[("a", "a2"), "second_position"])
+    assert np.isnan(moved.loc[("c", "c1"), "second_rank_change"])
+    assert moved.loc[("c", "c1"), "second_label"] == "GREAT"
+
+
+def test_significance(tmp_path):
+    differences = np.arange(1, 11, dtype=float)
+    assert wilcoxon_test(differences) == pytest.approx(0.005922, abs=1e-5)
+    assert sign_test(differences) == pytest.approx(2 / 1024)
+    assert wilcoxon_test(np.zeros(5)) == 1.0
+
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 1, 2000)
+    low, high = paired_bootstrap(noise + 0.5, iterations=2000, rng=rng)
+    assert low < 0.5 < high
+    assert randomization_test(noise + 0.5, iterations=2000, rng=rng) < 0.01
+    assert randomization_test(noise, iterations=2000, rng=rng) > 0.01
+
+    # Engines whose results differ only for some queries, paired by query
+    paths = []
+    for name, bad_queries in [("baseline", 30), ("same", 30), ("better", 5)]:
+        judgements = [
+            {"query": f"query {q}", "object_id": f"{q}-{i}", "object": {},
+             "judgement": {"score": 0 if q < bad_queries and i == 0 else 2, "label": "BAD" if q < bad_queries and i == 0 else "GREAT", "explanation": ""}}
+            for q in range(60) for i in range(3)
+        ]
+        paths.append(str(tmp_path / f"{name}_eval.json"))
+        with open(paths[-1], "w") as f:
+            json.dump({"status": "completed", "judgements": judgements}, f)
+
+    evaluator = ObjectiveEvaluator(scrapers=[], api_key="fake", work_dir=str(tmp_path))
+    evaluator.load_eval_results(paths)
+    significance = evaluator.significance("GREAT", iterations=2000).set_index("candidate")
+    assert significance.loc["same", "difference"] == 0
+    assert significance.loc["same", "randomization_p"] == 1.0
+    assert significance.loc["better", "queries"] == 60
+    assert significance.loc["better", "difference"] == pytest.approx(25 / 60 / 3)
+    assert significance.loc["better", "ci_low"] > 0
+    assert significance.loc["better", "randomization_p"] < 0.01
+    assert significance.loc["better", "wilcoxon_p"] < 0.01
+
+    evaluator.comparison_html(str(tmp_path / "comparison.html"), iterations=200)
+    index = open(tmp_path / "comparison.html").read()
+    assert "Significance vs baseline" in index and "<td>ndcg@10</td><td>better</td>" in index
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_partitioned_scrape(tmp_path, processes):
+    queries = [f"query {i}" for i in range(30)] + ["query 3"]
+    expected = [(query, rank) for query in queries for rank in range(3)]
+
+    with FakeOpenSearch(latency=0.02, hits=3) as server:
+        scraper = fake_opensearch_scraper(server, limit=3, concurrency=2, max_workers=3, max_concurrency=4)
+        scraper.instrument(Instrumentation())
+        assert worker_plan(scraper, len(set(queries))) == (3, 1)
+
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with pool(max_workers=3) as executor:
+            seen = []
+            save_to_path = str(tmp_path / "scrape.jsonl")
+            scrape_partitioned(executor, scraper, queries, save_to_path, on_results=lambda query, items: seen.append(query))
+
+    items = list(read_search_results(save_to_path))
+    assert [(item["object"]["query"], item["object"]["rank"]) for item in items] == expected
+    assert sorted(seen) == sorted(set(queries))
+    # Three workers with one request in flight each, within the engine's limit of four
+    assert server.max_in_flight <= 3
+    assert server.searches == 30
+    assert os.listdir(tmp_path) == ["scrape.jsonl"]
+    # Latencies recorded in worker processes are merged back
+    assert scraper.instrumentation.latency_df()["count"].tolist() == [30, 30]
+
+
+def test_evaluator_partitioned_scrape(tmp_path):
+    queries = [f"query {i}" for i in range(10)]
+    with FakeOpenSearch(latency=0.01, hits=2) as opensearch, FakeEvaluationAPI() as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[fake_opensearch_scraper(opensearch, limit=2, max_workers=3)],
+            api_key="fake",
+            work_dir=str(tmp_path) + "/",
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01, "chunk_size": 4}
+        )
+        evaluator.run(queries, pipeline=True)
+
+    df = evaluator.dfs[0]
+    assert df["query"].tolist() == [query for query in queries for _ in range(2)]
+    assert opensearch.max_in_flight <= 3
+
+
+def test_instrumentation(tmp_path):
+    queries = [f"query {i}" for i in range(20)]
+    sink = str(tmp_path / "metrics.jsonl")
+    with FakeOpenSearch(latency=0.02, hits=2) as opensearch, FakeEvaluationAPI(eval_latency=0.02) as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[
+                fake_opensearch_scraper(opensearch, limit=2, concurrency=4, scrape_id="single"),
+                fake_opensearch_scraper(opensearch, limit=2, msearch=True, msearch_batch_size=5, scrape_id="batched")
+            ],
+            api_key="fake",
+            work_dir=str(tmp_path) + "/",
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01},
+            instrumentation=Instrumentation(sinks=[JSONLinesSink(sink)])
+        )
+        evaluator.run(queries)
+    evaluator.full_results_html(str(tmp_path / "results.html"))
+    assert len(evaluator.dfs[0]) == 40
+
+    latency = evaluator.latency().set_index(["engine", "name"])
+    assert latency.loc[("single", "search.latency"), "count"] == 20
+    assert latency.loc[("batched", "search.latency"), "count"] == 4
+    # The engine's own `took` is recorded per search, in seconds
+    assert latency.loc[("batched", "search.took"), "count"] == 20
+    assert latency.loc[("single", "search.took"), "p99"] == pytest.approx(0.02)
+    assert (latency["p50"] <= latency["p95"]).all() and (latency["p95"] <= latency["p99"]).all()
+
+    timings = evaluator.timings()
+    stages = set(timings["name"])
+    assert {"run", "scrape", "evaluate", "evaluate.submit", "evaluate.poll", "load.cache", "load", "render"} <= stages
+    run = timings.loc[timings["name"] == "run", "max"].item()
+    assert timings.loc[timings["name"] == "scrape", "max"].max() <= run
+
+    with open(tmp_path / "results.html") as f:
+        assert "Search Latency" in f.read()
+    export = str(tmp_path / "instrumentation.json")
+    evaluator.instrumentation.write_json(export)
+    with open(export) as f:
+        exported = json.load(f)
+    assert {span["name"] for span in exported["spans"]} == stages - {"search.latency", "search.took"}
+    with open(sink) as f:
+        assert sum(1 for _ in f) == sum(summary["count"] for summary in exported["histograms"])
+
+    # Another run replaces the measurements of the last one
+    with FakeOpenSearch(hits=2) as opensearch, FakeEvaluationAPI() as api:
+        evaluator.scrapers = [fake_opensearch_scraper(opensearch, limit=2, scrape_id="single")]
+        evaluator.eval_options = {"api_url": api.api_url, "poll_interval": 0.01}
+        evaluator.run(queries[:5])
+    latency = evaluator.latency().set_index(["engine", "name"])
+    assert list(latency.index.unique("engine")) == ["single"]
+    assert latency.loc[("single", "search.latency"), "count"] == 5
+
+
+def test_prepare_queries():
+    queries = [
+        "Cotton jersey top", "cotton  top jersey", "COTTON JERSEY TOP", "red dress", "Red dress ",
+        "linen shirt", "blue jeans", "Cotton jersey top"
+    ]
+    exact = prepare_queries(queries)
+    assert exact.queries == ["Cotton jersey top", "cotton  top jersey", "red dress", "linen shirt", "blue jeans"]
+    assert exact.representative["Red dress "] == "red dress"
+
+    near = prepare_queries(queries, QuerySetParams(near_duplicates=True))
+    assert near.queries == ["Cotton jersey top", "red dress", "linen shirt", "blue jeans"]
+    assert near.groups()["Cotton jersey top"] == ["Cotton jersey top", "cotton  top jersey", "COTTON JERSEY TOP"]
+
+    df = pd.DataFrame({"query": ["Cotton jersey top", "Cotton jersey top", "blue jeans"], "position": [1, 2, 1]})
+    fanned = near.fan_out(df)
+    assert fanned["query"].tolist() == ["Cotton jersey top"] * 2 + ["cotton  top jersey"] * 2 + ["COTTON JERSEY TOP"] * 2 + ["blue jeans"]
+    assert fanned["position"].tolist() == [1, 2, 1, 2, 1, 2, 1]
+    assert set(fanned["representative"]) == {"Cotton jersey top", "blue jeans"}
+
+    # Strata keep their share of the sample: 60% one-word, 40% three-word queries
+    many = [f"word{i}" for i in range(60)] + [f"three word {i}" for i in range(40)]
+    sample = prepare_queries(many, QuerySetParams(sample_size=10)).queries
+    assert len(sample) == 10
+    assert sum(len(query.split()) == 1 for query in sample) == 6
+    assert sample == [query for query in many if query in sample]
+
+    assert prepare_queries([], QuerySetParams(near_duplicates=True)).queries == []
+    empty = prepare_queries(["a", "b c"], QuerySetParams(sample_size=0))
+    assert empty.queries == [] and empty.originals == [] and empty.groups() == {}
+
+
+def test_evaluator_query_preparation(tmp_path):
+    queries = ["red dress", "Red Dress", "dress red", "blue jeans", "jeans"]
+    with FakeOpenSearch(hits=2) as opensearch, FakeEvaluationAPI() as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[fake_opensearch_scraper(opensearch, limit=2)],
+            api_key="fake",
+            work_dir=str(tmp_path) + "/",
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01},
+            query_preparation=QuerySetParams(near_duplicates=True)
+        )
+        evaluator.run(queries)
+
+    assert opensearch.searches == 3 and api.judged == 6
+    fanned = evaluator.query_set.fan_out(evaluator.dfs[0])
+    assert fanned["query"].tolist() == [query for query in queries for _ in range(2)]
+
+
+def test_compact_storage(tmp_path):
+    # A small catalogue, so the same documents come back for many queries
+    class CatalogueSearch(FakeOpenSearch):
+        def search(self, body):
+            response = super().search(body)
+            for i, hit in enumerate(response["hits"]["hits"]):
+                hit["_source"] = {"title": f"Product {i}", "description": "Soft cotton jersey " * 20, "brand": {"name": "Acme", "id": i}}
+            return response
+
+    queries = [f"query {i}" for i in range(30)]
+
+    def run(work_dir, **params):
+        with CatalogueSearch(hits=4) as opensearch, FakeEvaluationAPI() as api:
+            evaluator = ObjectiveEvaluator(
+                scrapers=[fake_opensearch_scraper(opensearch, limit=4, max_workers=2, **params)],
+                api_key="fake",
+                work_dir=work_dir,
+                eval_options={"api_url": api.api_url, "poll_interval": 0.01}
+            )
+            evaluator.run(queries)
+        return evaluator
+
+    full = run(str(tmp_path / "full") + "/")
+    compact = run(str(tmp_path / "compact") + "/", compact=True)
+    projected = run(str(tmp_path / "projected") + "/", compact=True, fields=["title", "brand.name"])
+
+    sizes = {
+        name: (os.path.getsize(evaluator.work_dir + "fake-opensearch.jsonl"), os.path.getsize(evaluator.results[0].path))
+        for name, evaluator in [("full", full), ("compact", compact), ("projected", projected)]
+    }
+    assert sizes["compact"][0] * 5 < sizes["full"][0] and sizes["compact"][1] * 2 < sizes["full"][1]
+    assert sizes["projected"][0] < sizes["compact"][0]
+
+    # Compact files read back exactly like full ones
+    assert list(read_search_results(compact.work_dir + "fake-opensearch.jsonl")) == list(
+        read_search_results(full.work_dir + "fake-opensearch.jsonl")
+    )
+    assert compact.dfs[0].to_dict("records") == full.dfs[0].to_dict("records")
+    assert compact.eval_to_df(compact.results[0].path).to_dict("records") == full.dfs[0].to_dict("records")
+    # The columnar cache stores each distinct object once
+    assert len(compact.results[0].read_wide("object", slice(None))) == 120
+    assert len(set(compact.results[0].read_wide("object", slice(None)))) == 4
+
+    objects = [json.loads(obj) for obj in projected.dfs[0]["object"]]
+    assert objects[:2] == [{"title": "Product 0", "brand": {"name": "Acme"}}, {"title": "Product 1", "brand": {"name": "Acme"}}]
+
+
+def test_incremental_run(tmp_path):
+    # An engine whose ranking was tweaked for a few queries since the last run
+    class RerankedSearch(FakeOpenSearch):
+        reranked = set()
+
+        def search(self, body):
+            response = super().search(body)
+            if find_query(body) in self.reranked:
+                response["hits"]["hits"].reverse()
+            return response
+
+    def run(work_dir, queries, reranked, **options):
+        RerankedSearch.reranked = reranked
+        with RerankedSearch(hits=3) as opensearch, FakeEvaluationAPI() as api:
+            evaluator = ObjectiveEvaluator(
+                scrapers=[fake_opensearch_scraper(opensearch, limit=3, compact=True)],
+                api_key="fake",
+                work_dir=work_dir,
+                eval_options={"api_url": api.api_url, "poll_interval": 0.01}
+            )
+            evaluator.run(queries, **options)
+        return evaluator, api
+
+    queries = [f"query {i}" for i in range(10)]
+    work_dir = str(tmp_path / "incremental") + "/"
+    run(work_dir, queries, set())
+    # Query 9 was dropped and query 10 added; queries 2 and 5 now return their hits in another order
+    queries = queries[:9] + ["query 10"]
+    incremental, api = run(work_dir, queries, {"query 2", "query 5"}, incremental=True)
+    assert api.judged == 3 * 3
+
+    full, _ = run(str(tmp_path / "full") + "/", queries, {"query 2", "query 5"})
+    assert incremental.dfs[0].to_dict("records") == full.dfs[0].to_dict("records")
+    changes = incremental.results[0].changes
+    assert changes["changed"] == ["query 2", "query 5"] and changes["added"] == ["query 10"]
+    assert changes["removed"] == ["query 9"] and changes["unchanged"] == 7
+    assert full.results[0].changes is None
+    assert not [name for name in os.listdir(work_dir) if name.endswith((".previous", ".changed"))]
+
+    incremental.full_results_html(str(tmp_path / "results.html"))
+    with open(tmp_path / "results.html") as f:
+        index = f.read()
+    assert "Changes Since the Previous Run" in index
+    assert "<tr><td>query 2</td><td>changed</td></tr>" in index and "<tr><td>query 9</td><td>removed</td></tr>" in index
+
+    # A failed incremental run leaves the previous run in place for the next one
+    with RerankedSearch(hits=3, failures={"query 4": 1}) as opensearch, FakeEvaluationAPI() as api:
+        evaluator = ObjectiveEvaluator(
+            scrapers=[fake_opensearch_scraper(opensearch, limit=3, compact=True)],
+            api_key="fake",
+            work_dir=work_dir,
+            eval_options={"api_url": api.api_url, "poll_interval": 0.01}
+        )
+        with pytest.raises(ScrapeError):
+            evaluator.run(queries, incremental=True)
+    assert not [name for name in os.listdir(work_dir) if name.endswith(".previous")]
+    assert {"fake-opensearch.jsonl", "fake-opensearch_eval.json"} <= set(os.listdir(work_dir))
+
+    # Nothing changed, so nothing is judged
+    _, api = run(work_dir, queries, {"query 2", "query 5"}, incremental=True)
+    assert api.judged == 0